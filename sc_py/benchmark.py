@@ -0,0 +1,346 @@
+"""
+Benchmarks of the sc_fxns database functions against a local stand-in database
+
+    python -m sc_py.benchmark --rows 10000 100000 1000000
+
+builds a synthetic fund universe (funds, external_entity_mapping, returns_ts, old_returns_ts, aum_ts, old_aum_ts,
+fees, fund_liquidity, fund_status and an incoming vendor file for each loader) at each row count, loads it into a
+fresh database for every function (sqlite by default, or any sqlalchemy url such as duckdb:///bench.duckdb)
+and reports wall time, rows/sec and peak python memory per function
+"""
+import logging
+from contextlib import contextmanager
+from sc_py import sc_fxns as sc
+LOGGER = logging.getLogger(__name__)
+
+# the sources in the synthetic universe, best first
+HIERARCHY = ['manual', 'albourne', 'hfr', 'eurekahedge']
+
+# columns of every table, the first column of the time series/fees/liquidity tables is their identity row id
+TABLES = {'funds': ['id', 'blend_aums', 'blend_returns', 'fund_name'],
+          'external_entity_mapping': ['id', 'external_id', 'external_source', 'mapping_status', 'is_shareclass'],
+          'returns_ts': ['ret_ts_id', 'id', 'asof_date', 'return_value', 'source', 'type'],
+          'old_returns_ts': ['ret_ts_id', 'id', 'asof_date', 'return_value', 'source', 'type'],
+          'aum_ts': ['aum_ts_id', 'id', 'asof_date', 'asset_value', 'source'],
+          'old_aum_ts': ['aum_ts_id', 'id', 'asof_date', 'asset_value', 'source'],
+          'fees': ['id_record_number', 'id', 'management_fee', 'performance_fee', 'hurdle_rate', 'high_water_mark',
+                   'source'],
+          'fund_liquidity': ['id_record_number', 'id', 'redemption_notice_days', 'redemption_frequency',
+                             'redemption_gate', 'lock_up', 'subscription_frequency', 'source'],
+          'fund_status': ['id', 'current_status', 'status_source', 'included', 'included_source']}
+
+COLUMN_TYPES = {'id': 'BIGINT', 'blend_aums': 'INT', 'blend_returns': 'INT', 'fund_name': 'VARCHAR(255)',
+                'external_id': 'VARCHAR(255)', 'external_source': 'VARCHAR(255)', 'mapping_status': 'VARCHAR(255)',
+                'is_shareclass': 'INT', 'asof_date': 'TIMESTAMP', 'return_value': 'FLOAT', 'asset_value': 'FLOAT',
+                'source': 'VARCHAR(255)', 'type': 'VARCHAR(255)', 'management_fee': 'FLOAT',
+                'performance_fee': 'FLOAT', 'hurdle_rate': 'FLOAT', 'high_water_mark': 'FLOAT',
+                'redemption_notice_days': 'FLOAT', 'redemption_frequency': 'VARCHAR(255)',
+                'redemption_gate': 'FLOAT', 'lock_up': 'INT', 'subscription_frequency': 'VARCHAR(255)',
+                'current_status': 'VARCHAR(255)', 'status_source': 'VARCHAR(255)', 'included': 'INT',
+                'included_source': 'VARCHAR(255)'}
+
+
+def make_universe(n_rows, seed=0, months=120, max_funds=None):
+    """
+    Builds a synthetic fund universe with about n_rows rows in each time series table
+
+    Parameters
+    ---------
+    n_rows : int
+        approximate number of rows in returns_ts and aum_ts (and in the incoming returns/aum files)
+    seed : int
+        seed for the random generator, the same seed always gives the same universe
+    months : int
+        months of history per fund, the number of funds is n_rows/months
+    max_funds : int, optional
+        cap on the number of funds, beyond it funds get longer histories instead
+
+    Returns
+    -------
+    universe : dict
+        {table name: dataframe} for every table in TABLES (without the identity row ids), plus the incoming
+        vendor files 'returns_df', 'aum_df', 'fees_df', 'liquidity_df' and 'status_df' from hfr
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    n_funds = max(n_rows//months, 10)
+    if max_funds is not None:
+        n_funds = min(n_funds, max_funds)
+    months = max(n_rows//n_funds, 2)
+    ids = np.arange(1, n_funds+1, dtype='int64')
+    # one month more than the database has, the vendor file is shifted forward by a month
+    dates = pd.date_range(end='2024-12-31', periods=months+1, freq=pd.offsets.MonthEnd())
+    fund_source = rng.choice(HIERARCHY[1:], n_funds, p=[0.25, 0.6, 0.15])
+
+    funds = pd.DataFrame({'id': ids,
+                          'blend_aums': (rng.random(n_funds) < 0.1).astype('int64'),
+                          'blend_returns': (rng.random(n_funds) < 0.1).astype('int64'),
+                          'fund_name': ['fund '+str(i) for i in ids]})
+    mapped = ids[rng.random(n_funds) < 0.9]
+    albourne = ids[rng.random(n_funds) < 0.3]
+    mapping = pd.concat([pd.DataFrame({'id': mapped, 'external_source': 'hfr'}),
+                         pd.DataFrame({'id': albourne, 'external_source': 'albourne'})], ignore_index=True)
+    mapping['external_id'] = mapping['external_source']+'_'+mapping['id'].astype(str)
+    mapping['mapping_status'] = np.where(rng.random(len(mapping.index)) < 0.95, 'Live', 'Dead')
+    mapping['is_shareclass'] = (rng.random(len(mapping.index)) < 0.05).astype('int64')
+    mapping = mapping[TABLES['external_entity_mapping']]
+
+    # a value for every fund and month, the database holds the first <months>, the vendor the last <months>
+    returns = rng.normal(0.005, 0.03, (n_funds, months+1)).round(6)
+    assets = rng.lognormal(18, 1.5, (n_funds, 1)).round(0)*np.cumprod(1+returns, axis=1).round(0)
+    fund_grid = np.repeat(ids, months)
+    date_grid = np.tile(dates[:-1].to_numpy(), n_funds)
+    source_grid = np.repeat(fund_source, months)
+    returns_ts = pd.DataFrame({'id': fund_grid, 'asof_date': date_grid, 'return_value': returns[:, :-1].ravel(),
+                               'source': source_grid, 'type': 'monthly'})
+    aum_ts = pd.DataFrame({'id': fund_grid, 'asof_date': date_grid, 'asset_value': assets[:, :-1].ravel(),
+                           'source': source_grid})
+    old_returns_ts = returns_ts.sample(frac=0.1, random_state=seed).assign(
+        return_value=lambda df: (df['return_value']+0.001).round(6))
+    old_aum_ts = aum_ts.sample(frac=0.1, random_state=seed).assign(asset_value=lambda df: df['asset_value']*1.01)
+
+    # the vendor restates 5% of the history it shares with the database
+    vendor_grid = np.tile(dates[1:].to_numpy(), n_funds)
+    restated = rng.random(n_funds*months) < 0.05
+    returns_df = pd.DataFrame({'id': fund_grid, 'asof_date': vendor_grid,
+                               'return_value': np.where(restated, returns[:, 1:].ravel()+0.0001,
+                                                        returns[:, 1:].ravel()).round(6),
+                               'source': 'hfr', 'type': 'monthly'})
+    aum_df = pd.DataFrame({'id': fund_grid, 'asof_date': vendor_grid,
+                           'asset_value': np.where(restated, assets[:, 1:].ravel()+1000, assets[:, 1:].ravel()),
+                           'source': 'hfr'})
+
+    fees = pd.DataFrame({'id': ids, 'management_fee': rng.choice([0.01, 0.015, 0.02], n_funds),
+                         'performance_fee': rng.choice([0.1, 0.15, 0.2], n_funds), 'hurdle_rate': np.nan,
+                         'high_water_mark': 1.0, 'source': fund_source})
+    fees_df = fees.assign(management_fee=np.where(rng.random(n_funds) < 0.1, 0.0175, fees['management_fee']),
+                          source='hfr')
+    liquidity = pd.DataFrame({'id': ids, 'redemption_notice_days': rng.choice([30.0, 45.0, 60.0, 90.0], n_funds),
+                              'redemption_frequency': rng.choice(['Monthly', 'Quarterly', 'Annually'], n_funds),
+                              'redemption_gate': rng.choice([np.nan, 0.25], n_funds),
+                              'lock_up': rng.choice([0, 12], n_funds),
+                              'subscription_frequency': rng.choice(['Monthly', 'Quarterly'], n_funds),
+                              'source': fund_source})
+    liquidity_df = liquidity.assign(redemption_notice_days=np.where(rng.random(n_funds) < 0.1, 65.0,
+                                                                    liquidity['redemption_notice_days']),
+                                    source='hfr')
+    statuses = ['Active', 'Closed', 'Liquidated', 'Unknown']
+    status = pd.DataFrame({'id': ids, 'current_status': rng.choice(statuses, n_funds, p=[0.7, 0.1, 0.1, 0.1]),
+                           'status_source': rng.choice(['hfr', 'albourne', 'manual'], n_funds),
+                           'included': 1, 'included_source': 'manual'})
+    status_df = pd.DataFrame({'id': ids, 'current_status': rng.choice(statuses, n_funds, p=[0.6, 0.2, 0.1, 0.1]),
+                              'included': 1})
+
+    return {'funds': funds,
+            'external_entity_mapping': mapping,
+            'returns_ts': returns_ts,
+            'old_returns_ts': old_returns_ts,
+            'aum_ts': aum_ts,
+            'old_aum_ts': old_aum_ts,
+            'fees': fees,
+            'fund_liquidity': liquidity,
+            'fund_status': status,
+            'returns_df': returns_df,
+            'aum_df': aum_df,
+            'fees_df': fees_df,
+            'liquidity_df': liquidity_df,
+            'status_df': status_df}
+
+
+def create_schema(engine):
+    """
+    Drops and re-creates every table in TABLES on a sqlite, duckdb or sql server engine
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        for table_name, columns in TABLES.items():
+            conn.exec_driver_sql('DROP TABLE IF EXISTS '+table_name)
+            definitions = [col+' '+COLUMN_TYPES.get(col, 'BIGINT') for col in columns]
+            if dialect == 'mssql':
+                # TIMESTAMP is a rowversion on sql server
+                definitions = [definition.replace(' TIMESTAMP', ' DATETIME') for definition in definitions]
+            if columns[0] not in COLUMN_TYPES:
+                # identity row id
+                if dialect == 'sqlite':
+                    definitions[0] = columns[0]+' INTEGER PRIMARY KEY AUTOINCREMENT'
+                elif dialect == 'mssql':
+                    definitions[0] = columns[0]+' BIGINT IDENTITY(1, 1) PRIMARY KEY'
+                else:
+                    conn.exec_driver_sql('DROP SEQUENCE IF EXISTS seq_'+table_name)
+                    conn.exec_driver_sql('CREATE SEQUENCE seq_'+table_name)
+                    definitions[0] = columns[0]+" BIGINT PRIMARY KEY DEFAULT nextval('seq_"+table_name+"')"
+            conn.exec_driver_sql('CREATE TABLE '+table_name+' ('+', '.join(definitions)+')')
+
+
+def load_universe(engine, universe):
+    """
+    Creates the schema and loads the database tables of a universe from make_universe
+    """
+    create_schema(engine)
+    for table_name in TABLES:
+        sc.bulk_insert(universe[table_name], table_name, engine)
+
+
+def _bench_returns(engine, universe):
+    sc.get_returns('hfr', universe['returns_df'], ['manual', 'albourne'], engine=engine)
+    return len(universe['returns_df'].index)
+
+
+def _bench_assets(engine, universe):
+    sc.get_assets('hfr', universe['aum_df'], ['manual', 'albourne'], engine=engine)
+    return len(universe['aum_df'].index)
+
+
+def _bench_fees(engine, universe):
+    sc.get_fees('hfr', universe['fees_df'], ['manual', 'albourne'], engine=engine)
+    return len(universe['fees_df'].index)
+
+
+def _bench_liquidity(engine, universe):
+    sc.get_liquidity('hfr', universe['liquidity_df'], ['manual', 'albourne'], engine=engine)
+    return len(universe['liquidity_df'].index)
+
+
+def _bench_status(engine, universe):
+    sc.get_status(universe['status_df'].copy(), 'hfr', ['albourne'], engine=engine)
+    return len(universe['status_df'].index)
+
+
+def _bench_batch_delete(engine, universe):
+    # every 10th row of returns_ts
+    keys = list(range(1, len(universe['returns_ts'].index)+1, 10))
+    sc.batch_delete(keys, 'returns_ts', 'ret_ts_id', engine=engine)
+    return len(keys)
+
+
+# {name: function(engine, universe) -> number of input rows}
+BENCHMARKS = {'get_returns': _bench_returns,
+              'get_assets': _bench_assets,
+              'get_fees': _bench_fees,
+              'get_liquidity': _bench_liquidity,
+              'get_status': _bench_status,
+              'batch_delete': _bench_batch_delete}
+
+
+@contextmanager
+def _working_directory(path):
+    # the loaders write their backup csvs to the working directory
+    import os
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+
+
+def run_benchmarks(row_counts=(10000, 100000, 1000000), url=None, functions=None, seed=0, measure_memory=True):
+    """
+    Runs each benchmark on a freshly loaded database at each row count
+
+    Parameters
+    ---------
+    row_counts : list
+        sizes of the universes to benchmark (see make_universe)
+    url : str, optional
+        sqlalchemy url of the stand-in database, e.g. 'duckdb:///bench.duckdb'. its tables are dropped and re-created
+        defaults to a sqlite file in a temp directory
+    functions : list, optional
+        names of the benchmarks to run (keys of BENCHMARKS), defaults to all of them
+    seed : int
+        seed for make_universe
+    measure_memory : bool
+        trace python allocations to report peak memory. this slows the functions down, so times are
+        only comparable between runs with the same setting
+
+    Returns
+    -------
+    results : list of dict
+        one dict per function and row count: function, rows (input rows), seconds, rows_per_second, peak_mb
+    """
+    import os
+    import tempfile
+    import tracemalloc
+    from time import perf_counter
+    from sqlalchemy import create_engine
+
+    functions = list(BENCHMARKS) if functions is None else functions
+    for name in functions:
+        if name not in BENCHMARKS:
+            raise ValueError('unknown benchmark: '+str(name))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, _working_directory(tmp):
+        for n_rows in row_counts:
+            universe = make_universe(n_rows, seed=seed)
+            for name in functions:
+                db_url = url
+                if db_url is None:
+                    db_path = os.path.join(tmp, 'sc_benchmark.db')
+                    if os.path.exists(db_path):
+                        os.remove(db_path)
+                    db_url = 'sqlite:///'+db_path
+                engine = create_engine(db_url)
+                try:
+                    load_universe(engine, universe)
+                    if measure_memory:
+                        tracemalloc.start()
+                    start = perf_counter()
+                    rows = BENCHMARKS[name](engine, universe)
+                    seconds = perf_counter()-start
+                    peak = tracemalloc.get_traced_memory()[1] if measure_memory else None
+                finally:
+                    if tracemalloc.is_tracing():
+                        tracemalloc.stop()
+                    engine.dispose()
+                result = {'function': name,
+                          'universe_rows': n_rows,
+                          'rows': rows,
+                          'seconds': seconds,
+                          'rows_per_second': rows/seconds if seconds > 0 else None,
+                          'peak_mb': peak/2**20 if peak is not None else None}
+                LOGGER.info(str(result))
+                results.append(result)
+    return results
+
+
+def format_results(results):
+    """
+    Formats the output of run_benchmarks as a text table
+    """
+    lines = ['{:<14} {:>12} {:>10} {:>10} {:>14} {:>10}'.format('function', 'universe', 'rows', 'seconds',
+                                                                 'rows/sec', 'peak MB')]
+    for r in results:
+        lines.append('{:<14} {:>12,} {:>10,} {:>10.2f} {:>14} {:>10}'.format(
+            r['function'], r['universe_rows'], r['rows'], r['seconds'],
+            '{:,.0f}'.format(r['rows_per_second']) if r['rows_per_second'] is not None else '-',
+            '{:.1f}'.format(r['peak_mb']) if r['peak_mb'] is not None else '-'))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='benchmark the sc_fxns database functions on synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='approximate rows per time series table, one run per value')
+    parser.add_argument('--url', default=None, help='sqlalchemy url of the stand-in database (default: temp sqlite)')
+    parser.add_argument('--functions', nargs='+', default=None, choices=list(BENCHMARKS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip peak memory tracing (faster, truer times)')
+    parser.add_argument('--json', default=None, help='also write the results to this json file')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.rows, url=args.url, functions=args.functions, seed=args.seed,
+                             measure_memory=not args.no_memory)
+    print(format_results(results))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    return results
+
+
+if __name__ == '__main__':
+    main()
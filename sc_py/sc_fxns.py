@@ -1,20 +1,482 @@
 import sys
 current_module = sys.modules[__name__]
 import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
 LOGGER = logging.getLogger(__name__)
 
-def convert_id(row):
+# engines are expensive to build (odbc connect + tls handshake to azure) so we keep one pooled engine
+# per connection url for the life of the process and hand it to every function in this module
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+# what differs between the databases the loaders can run on, keyed by sqlalchemy dialect name
+#   param_limit     : bound parameters we put in one statement (sql server allows 2100, we keep a margin)
+#   max_values_rows : rows allowed in one INSERT ... VALUES list
+#   bulk_insert     : the bulk_insert method 'auto' picks
+#   temp_tables     : sql server #temp tables, used to stage large key sets, by merge mode and for application locks
+BACKENDS = {'mssql': {'param_limit': 2090, 'max_values_rows': 1000, 'bulk_insert': 'executemany',
+                      'temp_tables': True},
+            # 32766 since sqlite 3.32, see get_backend for older versions
+            'sqlite': {'param_limit': 32000, 'max_values_rows': 32000, 'bulk_insert': 'executemany',
+                       'temp_tables': False},
+            'duckdb': {'param_limit': 32000, 'max_values_rows': 32000, 'bulk_insert': 'dataframe',
+                       'temp_tables': False},
+            # anything else gets conservative limits
+            'default': {'param_limit': 999, 'max_values_rows': 1000, 'bulk_insert': 'executemany',
+                        'temp_tables': False}}
+
+
+def get_backend(con=None):
     """
-    Tries to convert data to a float
+    Returns the BACKENDS settings of the database behind an engine or connection
 
     Parameters
     ---------
-    row : float
+    con : sqlalchemy engine, connection or str, optional
+        an engine or connection (or a dialect name). defaults to the shared engine
 
     Returns
     -------
-    new_id : int
+    backend : dict
+        the BACKENDS entry of the dialect, plus 'name' (the dialect name)
     """
+    if con is None:
+        con = get_engine()
+    name = con if isinstance(con, str) else con.dialect.name
+    backend = dict(BACKENDS.get(name, BACKENDS['default']), name=name)
+    if name == 'sqlite':
+        import sqlite3
+        if sqlite3.sqlite_version_info < (3, 32, 0):
+            backend['param_limit'] = 999
+    return backend
+
+
+def connection_string():
+    """
+    Builds the odbc connection string for the Silver Creek database from the DASH_* environment variables
+        The odbc driver defaults to {SQL Server} and can be changed with DASH_ODBC_DRIVER
+
+    Returns
+    -------
+    connection_string : str
+    """
+    from os import environ
+    return "Driver="+environ.get('DASH_ODBC_DRIVER', '{SQL Server}')+";" + \
+        f"Server={environ['DASH_AZURE_DB_SERVER']};Database={environ['DASH_SC_DB_NAME']};UID={environ['DASH_AZURE_DB_RW_USER']};PWD={environ['DASH_AZURE_DB_RW_USER_PWD']}"
+
+
+def connection_url():
+    """
+    Returns the sqlalchemy url of the database the shared engine connects to
+        SC_DATABASE_URL if it is set (any sqlalchemy url, e.g. sqlite:///replica.db or duckdb:///replica.duckdb
+        for offline reprocessing), otherwise sql server over odbc using connection_string()
+
+    Returns
+    -------
+    url : sqlalchemy URL
+    """
+    from os import environ
+    from sqlalchemy.engine import URL, make_url
+    if environ.get('SC_DATABASE_URL'):
+        return make_url(environ['SC_DATABASE_URL'])
+    return URL.create("mssql+pyodbc", query={"odbc_connect": connection_string()})
+
+
+def get_engine(engine=None, pool_size=5, max_overflow=10, pool_recycle=1800):
+    """
+    Returns the shared, pooled sqlalchemy engine for the Silver Creek database
+        The engine is created on first use and then reused by every caller in the process.
+        Connections are pre-pinged before being handed out so dropped azure connections are replaced transparently.
+
+    Parameters
+    ---------
+    engine : sqlalchemy engine, optional
+        if given, it is returned unchanged. this lets every function take an optional engine argument
+    pool_size : int
+        number of connections kept open in the pool
+    max_overflow : int
+        number of extra connections allowed above pool_size under load
+    pool_recycle : int
+        seconds after which a pooled connection is recycled (azure drops idle connections after ~30 minutes)
+
+    Returns
+    -------
+    engine : sqlalchemy engine
+    """
+    if engine is not None:
+        return engine
+    url = connection_url()
+    key = url.render_as_string(hide_password=False)
+    with _ENGINES_LOCK:
+        if key not in _ENGINES:
+            from sqlalchemy import create_engine
+            pool_args = {}
+            if url.get_backend_name() == 'mssql':
+                pool_args = {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_recycle': pool_recycle}
+            _ENGINES[key] = create_engine(url, pool_pre_ping=True, **pool_args)
+            LOGGER.info('created pooled database engine ('+url.get_backend_name()+')')
+        return _ENGINES[key]
+
+
+def dispose_engines():
+    """
+    Closes every pooled connection held by the shared engine registry
+        Call this at the end of a job (or before forking worker processes)
+    """
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+def _connectable(engine=None, connection=None):
+    """
+    Returns the connection if one was given, otherwise the shared (or given) engine
+        only for looking at the dialect (get_backend). nothing may be executed on it: on a caller's connection
+        with no open transaction sqlalchemy would begin one that nobody commits (see _begin)
+    """
+    if connection is not None:
+        return connection
+    return get_engine(engine)
+
+
+@contextmanager
+def _begin(engine=None, connection=None):
+    """
+    Yields a connection inside a transaction which is committed on exit
+        If the caller passed a connection that already has an open transaction we join it
+        and leave the commit to the caller
+
+        This is the only way the module runs statements, reads included. Because nothing is executed on a caller's
+        connection outside _begin, an open transaction on it is always one the caller (or an enclosing _begin)
+        opened, never one sqlalchemy auto-began for one of our own reads, which nobody would commit
+    """
+    if connection is not None:
+        if connection.in_transaction():
+            yield connection
+        else:
+            with connection.begin():
+                yield connection
+    else:
+        with get_engine(engine).begin() as conn:
+            yield conn
+
+
+# the function every finished span is passed to (see set_span_sink), None logs it as json
+_SPAN_SINK = {'sink': None}
+# fields added to every span started on this thread (see span_context)
+_SPAN_CONTEXT = threading.local()
+
+
+def set_span_sink(sink=None):
+    """
+    Sets where instrumentation spans go
+        The loaders time each phase of a run (eligibility, snapshot, diff, archive, delete, insert, ...)
+        and pass one dict per phase to the sink: span (the phase name), table, source, run_id, mode,
+        started_at (epoch seconds), seconds, status ('ok' or 'error') and the phase's row counts
+
+    Parameters
+    ---------
+    sink : function, optional
+        called with each span dict. None (the default) logs each span as one line of json
+        on the 'sc_py.sc_fxns.spans' logger
+
+    Returns
+    -------
+
+    """
+    _SPAN_SINK['sink'] = sink
+
+
+def _log_span(record):
+    import json
+    logging.getLogger(__name__+'.spans').info(json.dumps(record, default=str))
+
+
+@contextmanager
+def span_context(**fields):
+    """
+    Adds fields (e.g. table, source, run_id) to every span started on this thread inside the with block
+    """
+    previous = getattr(_SPAN_CONTEXT, 'fields', {})
+    _SPAN_CONTEXT.fields = dict(previous, **fields)
+    try:
+        yield _SPAN_CONTEXT.fields
+    finally:
+        _SPAN_CONTEXT.fields = previous
+
+
+def _start_span(name, **fields):
+    from time import perf_counter, time
+    record = dict(getattr(_SPAN_CONTEXT, 'fields', {}), span=name, started_at=time(), **fields)
+    record['_start'] = perf_counter()
+    return record
+
+
+def _finish_span(record, status='ok', **fields):
+    from time import perf_counter
+    record.update(fields)
+    record['seconds'] = perf_counter()-record.pop('_start')
+    record['status'] = status
+    try:
+        (_SPAN_SINK['sink'] or _log_span)(record)
+    except Exception:
+        # instrumentation must never break a load
+        LOGGER.exception('span sink failed')
+    return record
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Times the with block as one instrumentation span and sends it to the span sink (see set_span_sink)
+        Yields the span dict, row counts set on it inside the block are reported with it
+    """
+    record = _start_span(name, **fields)
+    try:
+        yield record
+    except BaseException as e:
+        _finish_span(record, status='error', error=repr(e))
+        raise
+    _finish_span(record)
+
+
+# opt-in statement profiler (see enable_profiler): the engines it listens on, and per
+# (run_id, normalized statement, caller) the calls, time, parameters and rows
+_PROFILER = {'engines': [], 'stats': {}, 'top': 10, 'directory': None}
+_PROFILER_LOCK = threading.Lock()
+# raw statement text -> normalized text
+_STATEMENTS = {}
+
+
+def enable_profiler(engine=None, top=10, directory=None):
+    """
+    Profiles every statement run through an engine
+        Listens on the engine's execute events and records, per normalized statement (literals, IN lists and
+        VALUES rows collapsed) and chain of calling functions (e.g. get_returns > reconcile > plan_reconciliation >
+        read_table_for_ids): calls, total/max seconds, bound parameters, rows fetched and rows affected. At the
+        end of each reconcile run the top statements of the run by total time are logged as json on the
+        'sc_py.sc_fxns.profile' logger (and written to a csv if directory is given).
+        Statements run on a raw DBAPI cursor (the pyodbc fast path of bulk_insert) bypass the events
+
+    Parameters
+    ---------
+    engine : sqlalchemy engine, optional
+        engine to profile instead of the shared pooled engine
+    top : int
+        number of statements in each run summary
+    directory : str, optional
+        folder the run summaries are written to as <table>_<source>_<run_id>_profile.csv
+
+    Returns
+    -------
+    engine : sqlalchemy engine
+        the profiled engine
+    """
+    import os
+    from sqlalchemy import event
+    engine = get_engine(engine)
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    with _PROFILER_LOCK:
+        _PROFILER.update(top=top, directory=directory)
+        if not any(engine is profiled for profiled in _PROFILER['engines']):
+            event.listen(engine, 'before_cursor_execute', _profile_before)
+            event.listen(engine, 'after_cursor_execute', _profile_after)
+            event.listen(engine, 'after_execute', _profile_result)
+            _PROFILER['engines'].append(engine)
+    return engine
+
+
+def disable_profiler():
+    """
+    Stops profiling every engine and drops the recorded statistics
+    """
+    from sqlalchemy import event
+    with _PROFILER_LOCK:
+        for engine in _PROFILER['engines']:
+            event.remove(engine, 'before_cursor_execute', _profile_before)
+            event.remove(engine, 'after_cursor_execute', _profile_after)
+            event.remove(engine, 'after_execute', _profile_result)
+        _PROFILER.update(engines=[], stats={})
+
+
+def profile_summary(run_id=None, top=None):
+    """
+    Returns the profiled statements ordered by total time
+
+    Parameters
+    ---------
+    run_id : str, optional
+        only the statements of this reconcile run (see set_span_sink). default all statements recorded
+    top : int, optional
+        number of statements to return. default all
+
+    Returns
+    -------
+    summary : dataframe
+        statement, caller, calls, total_seconds, mean_seconds, max_seconds, params, rows_fetched, rows_affected
+    """
+    import pandas as pd
+    columns = ['statement', 'caller', 'calls', 'total_seconds', 'max_seconds', 'params', 'rows_fetched',
+               'rows_affected']
+    with _PROFILER_LOCK:
+        rows = [dict(entry, statement=statement, caller=caller)
+                for (run, statement, caller), entry in _PROFILER['stats'].items()
+                if run_id is None or run == run_id]
+    summary = pd.DataFrame(rows, columns=columns)
+    summary = summary.groupby(['statement', 'caller'], as_index=False, sort=False).agg(
+        {'calls': 'sum', 'total_seconds': 'sum', 'max_seconds': 'max', 'params': 'sum', 'rows_fetched': 'sum',
+         'rows_affected': 'sum'})
+    summary.insert(4, 'mean_seconds', summary['total_seconds']/summary['calls'])
+    summary = summary.sort_values('total_seconds', ascending=False, ignore_index=True)
+    return summary if top is None else summary.head(top)
+
+
+def _profile_report(run_id, label):
+    import json
+    import os
+    if not _PROFILER['engines']:
+        return
+    summary = profile_summary(run_id, top=_PROFILER['top'])
+    logger = logging.getLogger(__name__+'.profile')
+    for record in summary.to_dict('records'):
+        logger.info(json.dumps(dict(record, run_id=run_id), default=str))
+    if _PROFILER['directory'] is not None:
+        summary.to_csv(os.path.join(_PROFILER['directory'], label+'_'+run_id+'_profile.csv'), index=False)
+
+
+def _normalize_statement(statement):
+    import re
+    # the events fire on every thread running statements (e.g. run_sources workers)
+    with _PROFILER_LOCK:
+        if statement in _STATEMENTS:
+            return _STATEMENTS[statement]
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    normalized = re.sub(r'(?<![\w#@.])-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b', '?', normalized)
+    normalized = re.sub(r'\s+', ' ', normalized).strip()
+    # a batch of 10 ids and a batch of 2000 are the same statement
+    normalized = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', normalized)
+    normalized = re.sub(r'\(\?\)(?:\s*,\s*\(\?\))+', '(?)', normalized)
+    with _PROFILER_LOCK:
+        if len(_STATEMENTS) > 10000:
+            _STATEMENTS.clear()
+        _STATEMENTS[statement] = normalized
+    return normalized
+
+
+def _profile_caller():
+    # the chain of functions in this module that ran the statement, outermost first
+    # (e.g. get_returns > reconcile > plan_reconciliation > read_table_for_ids), so time spent in the shared
+    # i/o helpers is split by the loader and stage that called them. statements run from outside the module
+    # are attributed to the innermost named function outside sqlalchemy/pandas
+    frame = sys._getframe(2)
+    chain = []
+    outside = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        name = frame.f_code.co_name
+        if module == __name__:
+            if not name.startswith('<') and name not in ('_profile_before', '_profile_after', '_profile_result'):
+                chain.append(name)
+        elif outside is None and len(chain) == 0 and not name.startswith('<') and \
+                not module.startswith(('sqlalchemy', 'pandas', 'contextlib')):
+            outside = name+' ('+module+':'+str(frame.f_lineno)+')'
+        frame = frame.f_back
+    if len(chain) > 0:
+        return ' > '.join(reversed(chain))
+    return outside
+
+
+def _profile_before(conn, cursor, statement, parameters, context, executemany):
+    from time import perf_counter
+    conn.info.setdefault('_sc_profile_start', []).append(perf_counter())
+
+
+def _profile_after(conn, cursor, statement, parameters, context, executemany):
+    from time import perf_counter
+    seconds = perf_counter()-conn.info['_sc_profile_start'].pop()
+    if executemany:
+        params = sum(len(row) for row in parameters)
+    else:
+        params = len(parameters) if parameters else 0
+    affected = cursor.rowcount if cursor.description is None and cursor.rowcount > 0 else 0
+    key = (getattr(_SPAN_CONTEXT, 'fields', {}).get('run_id'), _normalize_statement(statement), _profile_caller())
+    with _PROFILER_LOCK:
+        entry = _PROFILER['stats'].setdefault(key, {'calls': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                                                    'params': 0, 'rows_fetched': 0, 'rows_affected': 0})
+        entry['calls'] += 1
+        entry['total_seconds'] += seconds
+        entry['max_seconds'] = max(entry['max_seconds'], seconds)
+        entry['params'] += params
+        entry['rows_affected'] += affected
+    conn.info['_sc_profile_entry'] = entry
+
+
+def _profile_result(conn, clauseelement, multiparams, params, execution_options, result):
+    entry = conn.info.pop('_sc_profile_entry', None)
+    if entry is not None and result.returns_rows:
+        result.cursor_strategy = _CountingFetch(result.cursor_strategy, entry)
+
+
+class _CountingFetch(object):
+    # wraps a result's fetch strategy to add the rows the caller fetches to the statement's profile entry
+
+    def __init__(self, strategy, entry):
+        self.strategy = strategy
+        self.entry = entry
+
+    def __getattr__(self, name):
+        return getattr(self.strategy, name)
+
+    def _count(self, n):
+        with _PROFILER_LOCK:
+            self.entry['rows_fetched'] += n
+
+    def fetchone(self, result, dbapi_cursor, hard_close=False):
+        row = self.strategy.fetchone(result, dbapi_cursor, hard_close)
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, result, dbapi_cursor, size=None):
+        rows = self.strategy.fetchmany(result, dbapi_cursor, size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self, result, dbapi_cursor):
+        rows = self.strategy.fetchall(result, dbapi_cursor)
+        self._count(len(rows))
+        return rows
+
+
+def convert_id(row, nullable=False):
+    """
+    Tries to convert data to an integer ID
+        Works on a single value, or on a whole Series at once (vectorized, linear in the number of rows)
+
+    Parameters
+    ---------
+    row : float, str or Series
+        a single value or a Series of values
+    nullable : bool
+        Series only. if True, a column whose non-null values are all numeric is returned as a nullable Int64 column
+        instead of an object column of ints and nans
+
+    Returns
+    -------
+    new_id : int or Series
+        for a single value, int(float(row)) if that works, otherwise row unchanged
+        for a Series, the same conversion applied element-wise. the result is int64 when every value converts
+        (the same as Series.apply(int) would give), otherwise an object Series holding ints and the unconvertible values.
+        ids outside the int64 range are never cast, they come back as python ints in an object Series
+    """
+    from pandas import Series
+    if isinstance(row, Series):
+        return _convert_id_series(row, nullable=nullable)
     try:
         new_id = int(float(row))
     except:
@@ -22,807 +484,2583 @@ def convert_id(row):
     return new_id
 
 
-def batch_delete(list_to_delete, table_name, delete_column_name):
+def _convert_id_series(s, nullable=False):
+    """
+    Vectorized convert_id for a Series, see convert_id
+    """
+    import numpy as np
+    import pandas as pd
+    if len(s) == 0:
+        return s
+    if pd.api.types.is_bool_dtype(s.dtype) or (pd.api.types.is_integer_dtype(s.dtype) and not s.isna().any()):
+        if pd.api.types.is_unsigned_integer_dtype(s.dtype) and s.max() > np.iinfo('int64').max:
+            # would wrap around to negative ids, keep them as python ints
+            return s.astype(object)
+        return s.astype('int64')
+
+    if pd.api.types.is_float_dtype(s.dtype):
+        numeric = s.astype('float64')
+        all_ints = True
+    else:
+        numeric = pd.to_numeric(s, errors='coerce').astype('float64')
+        # Series.apply(int) only succeeds when every string is an integer literal ('12' but not '12.0')
+        is_str = s.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+        all_ints = (not is_str.any()) or bool(
+            s[is_str].astype(str).str.fullmatch(r'\s*[+-]?\d+\s*').all())
+    values = numeric.to_numpy()
+    convertible = np.isfinite(values)
+    # ids outside the int64 range would wrap around in the cast, they stay python ints in an object column
+    fits = convertible & (values >= -2.0**63) & (values < 2.0**63)
+    ints = np.trunc(values[fits]).astype('int64')
+
+    if fits.all() and all_ints:
+        return pd.Series(ints, index=s.index, name=s.name)
+    if nullable and (fits | s.isna().to_numpy()).all():
+        out = pd.Series(pd.array([pd.NA]*len(s), dtype='Int64'), index=s.index, name=s.name)
+        out[fits] = ints
+        return out
+    out = s.to_numpy(dtype=object, copy=True)
+    # assigning a list keeps python ints in the object array, matching int(float(x))
+    out[fits] = ints.tolist()
+    out[convertible & ~fits] = [int(value) for value in values[convertible & ~fits]]
+    return pd.Series(out, index=s.index, name=s.name, dtype=object)
+
+
+def _check_identifier(name):
+    """
+    Raises a ValueError if name is not a plain (optionally schema-qualified) sql identifier
+        table and column names cannot be bound as parameters, so we validate them before they go into sql text
+    """
+    import re
+    if not isinstance(name, str) or re.fullmatch(r'[A-Za-z_#][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?', name) is None:
+        raise ValueError('invalid sql identifier: '+str(name))
+    return name
+
+
+def _key_sql_type(keys):
+    """
+    Picks a sql server column type able to hold every value in keys (used for staging tables)
+        Null keys, and keys mixing strings with numbers, raise a ValueError
+    """
+    import pandas as pd
+    strings = [isinstance(k, str) for k in keys]
+    if any(not is_str and pd.isna(k) for k, is_str in zip(keys, strings)):
+        raise ValueError('staging keys must not be null')
+    if len(keys) > 0 and all(strings):
+        return 'NVARCHAR('+str(max([len(k) for k in keys]+[1]))+')'
+    if any(strings):
+        raise ValueError('staging keys must be all strings or all numbers, not a mix of both')
+    if all(float(k).is_integer() for k in keys):
+        return 'BIGINT'
+    return 'FLOAT'
+
+
+def _stage_keys(conn, keys, staging_table='#sc_delete_keys'):
+    """
+    Creates a temp table with a single key_value column on conn and bulk loads keys into it
+        The keys are bound through executemany (fast_executemany on pyodbc), never interpolated into the sql text
+        The temp table lives as long as conn, callers should drop it when they are done
+
+    Parameters
+    ---------
+    conn : sqlalchemy connection
+        the connection the temp table is created on
+    keys : list
+        unique, non-null key values
+    staging_table : str
+        name of the temp table
+
+    Returns
+    -------
+    staging_table : str
+    """
+    _check_identifier(staging_table)
+    key_type = _key_sql_type(keys)
+    if key_type == 'BIGINT':
+        keys = [int(k) for k in keys]
+    conn.exec_driver_sql("IF OBJECT_ID('tempdb.."+staging_table+"') IS NOT NULL DROP TABLE "+staging_table)
+    conn.exec_driver_sql('CREATE TABLE '+staging_table+' (key_value '+key_type+' NOT NULL PRIMARY KEY)')
+    if len(keys) == 0:
+        # fast_executemany refuses an empty parameter list
+        return staging_table
+    cursor = conn.connection.cursor()
+    try:
+        cursor.fast_executemany = True
+        cursor.executemany('INSERT INTO '+staging_table+' (key_value) VALUES (?)', [(k,) for k in keys])
+    finally:
+        cursor.close()
+    return staging_table
+
+
+def _stage_frame(conn, df, staging_table, column_types):
+    """
+    Creates a temp table on conn with the given typed columns and bulk loads those columns of df into it
+        Values are bound through executemany (fast_executemany on pyodbc), nulls are sent as NULL
+        The temp table lives as long as conn, callers should drop it when they are done
+
+    Parameters
+    ---------
+    conn : sqlalchemy connection
+        the connection the temp table is created on
+    df : dataframe
+        the rows to load
+    staging_table : str
+        name of the temp table
+    column_types : dict
+        {column name: sql server type} of the columns to create and load
+
+    Returns
+    -------
+    staging_table : str
+    """
+    _check_identifier(staging_table)
+    cols = [_check_identifier(col) for col in column_types]
+    conn.exec_driver_sql("IF OBJECT_ID('tempdb.."+staging_table+"') IS NOT NULL DROP TABLE "+staging_table)
+    conn.exec_driver_sql('CREATE TABLE '+staging_table+' (' +
+                         ', '.join(col+' '+column_types[col] for col in cols)+')')
+    rows = _frame_rows(df, column_types)
+    if len(rows) > 0:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.fast_executemany = True
+            cursor.executemany('INSERT INTO '+staging_table+' ('+', '.join(cols)+') VALUES (' +
+                               ', '.join('?' for col in cols)+')', rows)
+        finally:
+            cursor.close()
+    return staging_table
+
+
+def _to_datetime(value):
+    return value.to_pydatetime() if hasattr(value, 'to_pydatetime') else value
+
+
+def _to_date(value):
+    return value.date() if hasattr(value, 'to_pydatetime') else value
+
+
+# sql server types bulk_insert/_stage_frame know how to bind:
+#   name : (sqlalchemy type, python conversion applied to non-null values, odbc sql type for pyodbc setinputsizes)
+_SQL_TYPES = {'BIGINT': ('BigInteger', int, -5),
+              'INT': ('Integer', int, 4),
+              'BIT': ('Boolean', bool, -7),
+              'FLOAT': ('Float', float, 8),
+              'DATETIME': ('DateTime', _to_datetime, 93),
+              'DATETIME2': ('DateTime', _to_datetime, 93),
+              'DATE': ('Date', _to_date, 91),
+              'NVARCHAR': ('Unicode', str, -9),
+              'VARCHAR': ('String', str, 12)}
+
+
+def _column_type(type_string):
+    """
+    Splits a sql server type string such as 'NVARCHAR(255)' into its name and length (None if there is no length)
+    """
+    import re
+    match = re.fullmatch(r'\s*([A-Za-z0-9]+)\s*(?:\(\s*(\w+)\s*\))?\s*', str(type_string))
+    if match is None or match.group(1).upper() not in _SQL_TYPES:
+        raise ValueError('unsupported column type: '+str(type_string))
+    length = match.group(2)
+    return match.group(1).upper(), int(length) if length is not None and length.isdigit() else None
+
+
+def _infer_column_type(s):
+    """
+    Picks a sql server type string for a Series from its dtype, None for object columns (left to the driver)
+    """
+    import pandas as pd
+    if pd.api.types.is_bool_dtype(s.dtype):
+        return 'BIT'
+    if pd.api.types.is_integer_dtype(s.dtype):
+        return 'BIGINT'
+    if pd.api.types.is_float_dtype(s.dtype):
+        return 'FLOAT'
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return 'DATETIME'
+    return None
+
+
+def _frame_rows(df, column_types):
+    """
+    Returns the given columns of df as a list of tuples of python values ready to bind
+        nulls become None and non-null values are converted to the python type of their column type
+        (a column type of None leaves the values as they are)
+    """
+    cols = list(column_types)
+    frame = df[cols].astype(object)
+    frame = frame.where(df[cols].notnull(), None)
+    converters = [_SQL_TYPES[_column_type(column_types[col])[0]][1] if column_types[col] is not None else None
+                  for col in cols]
+    if all(convert is None for convert in converters):
+        return list(frame.itertuples(index=False, name=None))
+    return [tuple(v if v is None or convert is None else convert(v) for v, convert in zip(row, converters))
+            for row in frame.itertuples(index=False, name=None)]
+
+
+# summary of one batch_delete call. rows_deleted comes from the cursor rowcount of each delete statement
+# verified_rows_deleted is only filled in (from before/after count scans) when batch_delete is called with verify=True
+DeleteResult = namedtuple('DeleteResult', ['table_name', 'column_name', 'method', 'rows_requested',
+                                           'rows_deleted', 'chunks', 'elapsed_seconds', 'verified_rows_deleted'])
+
+
+def batch_delete(list_to_delete, table_name, delete_column_name, engine=None, connection=None,
+                 method='auto', staging_threshold=None, verify=False):
+    """
+    Deletes a list of records from a given database table, given a column name
+        Keys are always bound as parameters. Small lists are deleted with parameterized IN (...) batches,
+        large lists are bulk loaded into a temp table and removed with one joined DELETE.
+        The number of deleted rows is taken from the cursor rowcount of each statement
+
+    Parameters
+    ---------
+    list_to_delete : list
+        a list of items, each denoting one row, that will be deleted
+        each item in the list should be one unique row
+    table_name: string
+        the name of the table to delete from
+    delete_column_name: string
+        the name of the column in <table_name> to delete the items from <list_to_delete>
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run the deletes on. if it already has an open transaction the caller is responsible for committing
+    method : str
+        'chunked' deletes in IN (...) batches of the database's parameter limit (2090 on sql server)
+        with one commit per batch
+        'staging' loads the keys into a temp table and runs a single joined DELETE (sql server only)
+        'auto' uses 'chunked' when there are at most <staging_threshold> keys, or the database has no temp tables,
+        'staging' otherwise
+    staging_threshold : int, optional
+        number of keys above which 'auto' switches to the staging table, defaults to the parameter limit
+    verify : bool
+        if True, also counts <delete_column_name> in the whole table before and after the delete
+        this is two full scans of the table so it is off by default
+
+    Returns
+    -------
+    result : DeleteResult
+        rows requested, rows deleted, number of statements (chunks) and elapsed seconds
+    """
+    from math import ceil
+    from time import perf_counter
+    import pandas as pd
+    from sqlalchemy import text, bindparam
+
+    import logging
+    LOGGER = logging.getLogger(__name__)
+
+    if type(list_to_delete) is not list:
+        raise ValueError("""'list_to_delete' must be of type list """)
+    if method not in ['auto', 'chunked', 'staging']:
+        raise ValueError("""method must be one of 'auto', 'chunked' or 'staging' """)
+    _check_identifier(table_name)
+    _check_identifier(delete_column_name)
+    start = perf_counter()
+    if len(list_to_delete) == 0:
+        LOGGER.info('no records to delete from: '+table_name)
+        return DeleteResult(table_name, delete_column_name, None, 0, 0, 0, perf_counter()-start, None)
+
+    count_sql = """select count("""+delete_column_name+""") as ct from """+table_name
+    if verify:
+        # get initial record count
+        with _begin(engine, connection) as conn:
+            no_records = pd.read_sql_query(count_sql, conn).loc[0, 'ct']
+
+    backend = get_backend(_connectable(engine, connection))
+    chunk_size = backend['param_limit']
+    if staging_threshold is None:
+        staging_threshold = chunk_size
+    if method == 'auto':
+        method = 'chunked' if len(list_to_delete) <= staging_threshold or not backend['temp_tables'] \
+            else 'staging'
+    if method == 'staging' and not backend['temp_tables']:
+        raise ValueError("""method 'staging' needs sql server temp tables """)
+
+    rows_deleted = 0
+    if method == 'staging':
+        LOGGER.info('staging '+str(len(list_to_delete)) +
+                    ' keys to delete from '+table_name)
+        # de-duplicate and drop nulls since the staging key is a primary key
+        keys = [k for k in dict.fromkeys(list_to_delete) if isinstance(k, str) or not pd.isna(k)]
+        # a list of nothing but nulls has nothing to stage
+        num_iterations = 0
+        if len(keys) > 0:
+            num_iterations = 1
+            with _begin(engine, connection) as conn:
+                staging_table = _stage_keys(conn, keys)
+                result = conn.exec_driver_sql('DELETE t FROM '+table_name+' t JOIN '+staging_table +
+                                              ' k ON t.'+delete_column_name+' = k.key_value')
+                rows_deleted += max(result.rowcount, 0)
+                conn.exec_driver_sql('DROP TABLE '+staging_table)
+    else:
+        # each database limits the parameters per statement (sql server allows 2100)
+        # if number of records>chunk_size, we have to beak it up
+        delete_stmt = text('DELETE FROM '+table_name+' WHERE '+delete_column_name+' IN :keys').bindparams(
+            bindparam('keys', expanding=True))
+        num_iterations = ceil(len(list_to_delete)/chunk_size)
+        if num_iterations > 1:
+            LOGGER.info('need to batch delete to accomodate database limits')
+        for i in range(num_iterations):
+            if num_iterations > 1:
+                LOGGER.info('deleting rows '+str(i*chunk_size)+' to ' +
+                            str(min(chunk_size*(i+1), len(list_to_delete))))
+            sub_list_to_delete = list_to_delete[chunk_size*(i):chunk_size*(i+1)]
+            with _begin(engine, connection) as conn:
+                result = conn.execute(delete_stmt, {'keys': sub_list_to_delete})
+                rows_deleted += max(result.rowcount, 0)
+
+    verified_rows_deleted = None
+    if verify:
+        # get updated record count
+        with _begin(engine, connection) as conn:
+            end_no_records = pd.read_sql_query(count_sql, conn).loc[0, 'ct']
+        verified_rows_deleted = int(no_records-end_no_records)
+        if verified_rows_deleted != rows_deleted:
+            LOGGER.warning('rowcount reported '+str(rows_deleted)+' deleted rows but the table count dropped by ' +
+                           str(verified_rows_deleted))
+    elapsed = perf_counter()-start
+    LOGGER.info('deleted '+str(rows_deleted)+' number of records from table: ' +
+                table_name+', based on column: ' + delete_column_name +
+                ' in '+str(num_iterations)+' statement(s), '+'{:.2f}'.format(elapsed)+'s')
+    return DeleteResult(table_name, delete_column_name, method, len(list_to_delete), rows_deleted,
+                        num_iterations, elapsed, verified_rows_deleted)
+
+
+# summary of one bulk_insert call
+InsertResult = namedtuple('InsertResult', ['table_name', 'method', 'rows_inserted', 'batches',
+                                           'elapsed_seconds', 'rows_per_second'])
+
+
+def bulk_insert(df, table_name, engine=None, connection=None, column_types=None, method='auto',
+                param_limit=None, chunksize=100000):
+    """
+    Appends a dataframe to a table, replacing DataFrame.to_sql(..., if_exists='append')
+        Every column is bound with an explicit type (given, or inferred from its dtype),
+        and rows go through executemany (pyodbc fast_executemany on sql server), multi-row INSERT ... VALUES batches
+        sized to stay under the parameter limit, or (duckdb) a direct insert from the dataframe.
+        All batches run in one transaction
+
+    Parameters
+    ---------
+    df : dataframe
+        the rows to insert. the index is not inserted
+    table_name : str
+        the table to insert into, optionally schema-qualified
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run the insert on. if it already has an open transaction the caller is responsible for committing
+    column_types : dict, optional
+        {column name: sql server type string}, e.g. {'id': 'BIGINT', 'asof_date': 'DATETIME'}
+        columns not given here are typed from their dtype
+    method : str
+        'executemany' binds every row in one parameter array (fast_executemany on pyodbc), <chunksize> rows per call
+        'values' sends multi-row INSERT ... VALUES statements of at most <param_limit> parameters
+        'dataframe' (duckdb only) registers df with the connection and runs one INSERT ... SELECT
+        'auto' uses the database's bulk_insert entry in BACKENDS
+    param_limit : int, optional
+        maximum bound parameters per statement for 'values', defaults to the database's limit
+    chunksize : int
+        rows per executemany call for 'executemany'
+
+    Returns
+    -------
+    result : InsertResult
+        rows inserted, number of statements (batches), elapsed seconds and rows per second
+    """
+    from math import ceil
+    from time import perf_counter
+    import sqlalchemy
+    from sqlalchemy import column, insert, table
+
+    import logging
+    LOGGER = logging.getLogger(__name__)
+
+    if method not in ['auto', 'executemany', 'values', 'dataframe']:
+        raise ValueError("""method must be one of 'auto', 'executemany', 'values' or 'dataframe' """)
+    _check_identifier(table_name)
+    start = perf_counter()
+    if len(df.index) == 0:
+        LOGGER.info('no records to insert to: '+table_name)
+        return InsertResult(table_name, None, 0, 0, perf_counter()-start, 0.0)
+
+    column_types = dict(column_types or {})
+    types = {_check_identifier(col): column_types[col] if col in column_types else _infer_column_type(df[col])
+             for col in df.columns}
+    cols = list(types)
+    num_rows = len(df.index)
+
+    with _begin(engine, connection) as conn:
+        backend = get_backend(conn)
+        if method == 'auto':
+            method = backend['bulk_insert']
+        if method == 'dataframe':
+            if backend['name'] != 'duckdb':
+                raise ValueError("""method 'dataframe' needs duckdb """)
+            # duckdb reads the dataframe's arrays directly, no rows are bound one by one
+            view = '_sc_bulk_insert_'+str(threading.get_ident())
+            driver_connection = conn.connection.driver_connection
+            driver_connection.register(view, df[cols])
+            try:
+                conn.exec_driver_sql('INSERT INTO '+table_name+' ('+', '.join(cols)+') SELECT ' +
+                                     ', '.join(cols)+' FROM '+view)
+            finally:
+                driver_connection.unregister(view)
+            num_batches = 1
+        elif method == 'executemany' and conn.dialect.driver == 'pyodbc':
+            rows = _frame_rows(df, types)
+            batch_rows = max(int(chunksize), 1)
+            num_batches = ceil(len(rows)/batch_rows)
+            insert_sql = 'INSERT INTO '+table_name+' ('+', '.join(cols)+') VALUES (' + \
+                ', '.join('?' for col in cols)+')'
+            cursor = conn.connection.cursor()
+            try:
+                cursor.fast_executemany = True
+                if all(types[col] is not None for col in cols):
+                    sizes = [_column_type(types[col]) for col in cols]
+                    cursor.setinputsizes([(_SQL_TYPES[name][2], length or 0, 0) for name, length in sizes])
+                for i in range(num_batches):
+                    cursor.executemany(insert_sql, rows[batch_rows*i:batch_rows*(i+1)])
+            finally:
+                cursor.close()
+        else:
+            rows = _frame_rows(df, types)
+            sql_types = {}
+            for col in cols:
+                if types[col] is not None:
+                    name, length = _column_type(types[col])
+                    sql_type = getattr(sqlalchemy, _SQL_TYPES[name][0])
+                    sql_types[col] = sql_type(length) if length is not None and name in ('NVARCHAR', 'VARCHAR') \
+                        else sql_type()
+            schema, _, name = table_name.rpartition('.')
+            target = table(name, *[column(col, sql_types.get(col)) for col in cols], schema=schema or None)
+            if method == 'executemany':
+                # the driver's own executemany, in its paramstyle
+                batch_rows = max(int(chunksize), 1)
+            else:
+                batch_rows = max(min((param_limit or backend['param_limit'])//len(cols),
+                                     backend['max_values_rows']), 1)
+            num_batches = ceil(len(rows)/batch_rows)
+            for i in range(num_batches):
+                batch = [dict(zip(cols, row)) for row in rows[batch_rows*i:batch_rows*(i+1)]]
+                if method == 'executemany':
+                    conn.execute(insert(target), batch)
+                else:
+                    conn.execute(insert(target).values(batch))
+
+    elapsed = perf_counter()-start
+    rows_per_second = num_rows/elapsed if elapsed > 0 else float(num_rows)
+    LOGGER.info('inserted '+str(num_rows)+' rows to table: '+table_name+' in '+str(num_batches) +
+                ' '+method+' batch(es), '+'{:.2f}'.format(elapsed)+'s ('+'{:,.0f}'.format(rows_per_second) +
+                ' rows/s)')
+    return InsertResult(table_name, method, num_rows, num_batches, elapsed, rows_per_second)
+
+
+def read_table_for_ids(table_name, ids, engine=None, connection=None, id_column='id', columns=None,
+                       date_column=None, start_date=None, end_date=None, filters=None,
+                       staging_threshold=None, **read_kwargs):
+    """
+    Reads only the rows of a table belonging to a given set of ids (and optionally a date range)
+        instead of pulling the whole table and filtering with isin in pandas.
+        Small id sets are bound as IN (...) parameters, large ones are staged in a temp table and joined server-side
+
+    Parameters
+    ---------
+    table_name : str
+        the table to read
+    ids : list-like
+        the ids to read rows for. nulls and duplicates are ignored
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run the read on
+    id_column : str
+        the column in <table_name> the ids are matched against
+    columns : list, optional
+        columns to select, defaults to every column
+    date_column : str, optional
+        column to apply start_date/end_date to
+    start_date, end_date : datetime, optional
+        inclusive bounds on <date_column>. either can be left as None
+    filters : dict, optional
+        extra equality conditions, {column name: value}, bound as parameters
+    staging_threshold : int, optional
+        number of ids above which the ids are staged in a temp table rather than bound in an IN list
+        (sql server only, other databases read in IN (...) batches). defaults to the parameter limit
+    read_kwargs :
+        passed on to pd.read_sql_query (dtype, parse_dates, ...)
+
+    Returns
+    -------
+    df : dataframe
+    """
+    import pandas as pd
+    from sqlalchemy import text, bindparam, DateTime
+
+    _check_identifier(table_name)
+    _check_identifier(id_column)
+    if columns is None:
+        select_list = 't.*'
+    else:
+        select_list = ', '.join('t.'+_check_identifier(col) for col in columns)
+    # numpy scalars (e.g. from Series.unique()) can't be bound by every driver, so use python types
+    ids = [i.item() if hasattr(i, 'item') else i
+           for i in dict.fromkeys(pd.Series(ids, dtype=object).dropna().to_list())]
+    if len(ids) > 0 and all(isinstance(i, float) and i.is_integer() for i in ids):
+        # ids that went through a merge come back as floats
+        ids = [int(i) for i in ids]
+
+    params = {}
+    where = []
+    # typed so each dialect converts the dates to the format it stores them in
+    date_binds = [bindparam('start_date', type_=DateTime()), bindparam('end_date', type_=DateTime())]
+    if date_column is not None:
+        _check_identifier(date_column)
+        if start_date is not None and not pd.isnull(start_date):
+            where.append('t.'+date_column+' >= :start_date')
+            params['start_date'] = pd.Timestamp(start_date).to_pydatetime()
+        if end_date is not None and not pd.isnull(end_date):
+            where.append('t.'+date_column+' <= :end_date')
+            params['end_date'] = pd.Timestamp(end_date).to_pydatetime()
+
+    if len(ids) == 0:
+        # still run a query so the frame has the table's columns
+        with _begin(engine, connection) as conn:
+            return pd.read_sql_query(text('SELECT '+select_list+' FROM '+table_name+' t WHERE 1=0'),
+                                     conn, **read_kwargs)
+    date_binds = [b for b in date_binds if b.key in params]
+    for i, (col, value) in enumerate((filters or {}).items()):
+        where.append('t.'+_check_identifier(col)+' = :filter_'+str(i))
+        params['filter_'+str(i)] = value
+
+    backend = get_backend(_connectable(engine, connection))
+    if staging_threshold is None:
+        staging_threshold = backend['param_limit']
+    if len(ids) <= staging_threshold or not backend['temp_tables']:
+        sql = 'SELECT '+select_list+' FROM '+table_name+' t WHERE t.'+id_column+' IN :ids'
+        if len(where) > 0:
+            sql = sql+' AND '+' AND '.join(where)
+        stmt = text(sql).bindparams(bindparam('ids', expanding=True), *date_binds)
+        # without temp tables, read in IN (...) batches that leave room for the other parameters
+        batch_size = max(backend['param_limit']-len(params), 1)
+        batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+        with _begin(engine, connection) as conn:
+            frames = [pd.read_sql_query(stmt, conn, params=dict(params, ids=batch), **read_kwargs)
+                      for batch in batches]
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    # temp tables only live on one connection, so the staging and the read have to share it
+    with _begin(engine, connection) as conn:
+        staging_table = _stage_keys(conn, ids, '#sc_read_keys')
+        sql = 'SELECT '+select_list+' FROM '+table_name+' t JOIN '+staging_table + \
+            ' k ON t.'+id_column+' = k.key_value'
+        if len(where) > 0:
+            sql = sql+' WHERE '+' AND '.join(where)
+        df = pd.read_sql_query(text(sql).bindparams(*date_binds), conn, params=params, **read_kwargs)
+        conn.exec_driver_sql('DROP TABLE '+staging_table)
+    return df
+
+
+# opt-in local cache of slowly changing reference tables (see enable_reference_cache)
+_REFERENCE_CACHE = {'directory': None, 'ttl_seconds': 3600, 'check_columns': {}}
+# frames already loaded in this process, {table name: (signature, fetched_at, dataframe)}
+_REFERENCE_FRAMES = {}
+_REFERENCE_LOCK = threading.Lock()
+
+
+def enable_reference_cache(directory, ttl_seconds=3600, check_columns=None):
+    """
+    Turns on the local cache for reference tables (funds, external_entity_mapping) read by the reconciliation functions
+        Each table is stored as <directory>/<table>.parquet with a small <table>.json of when it was fetched
+        and its change signature. Every read runs one cheap query (row count, plus the max of the table's check column
+        if it has one) and only re-reads the table if the signature changed or the copy is older than ttl_seconds
+
+    Parameters
+    ---------
+    directory : str
+        folder to keep the cached files in, created if it does not exist
+    ttl_seconds : int
+        age after which a cached table is re-read even if its signature did not change
+        (a row count does not see in-place updates, a rowversion check column does)
+    check_columns : dict, optional
+        {table name: column} whose max is part of the change signature, e.g. a rowversion column
+        tables not listed are checked on row count only
+
+    Returns
+    -------
+
+    """
+    import os
+    os.makedirs(directory, exist_ok=True)
+    with _REFERENCE_LOCK:
+        _REFERENCE_CACHE['directory'] = directory
+        _REFERENCE_CACHE['ttl_seconds'] = ttl_seconds
+        _REFERENCE_CACHE['check_columns'] = dict(check_columns or {})
+        _REFERENCE_FRAMES.clear()
+
+
+def disable_reference_cache():
+    """
+    Turns the reference table cache off again, reads go straight to the database. The files are left on disk
+    """
+    with _REFERENCE_LOCK:
+        _REFERENCE_CACHE['directory'] = None
+        _REFERENCE_FRAMES.clear()
+
+
+def clear_reference_cache(table_name=None):
+    """
+    Removes the cached copy of one table (or of every table) so that the next read goes to the database
+    """
+    import glob
+    import os
+    with _REFERENCE_LOCK:
+        directory = _REFERENCE_CACHE['directory']
+        if table_name is None:
+            _REFERENCE_FRAMES.clear()
+        else:
+            _REFERENCE_FRAMES.pop(table_name, None)
+        if directory is None:
+            return
+        names = ['*'] if table_name is None else [table_name]
+        for name in names:
+            for path in glob.glob(os.path.join(directory, name+'.parquet')) + \
+                    glob.glob(os.path.join(directory, name+'.json')):
+                os.remove(path)
+
+
+def _reference_signature(conn, table_name):
+    """
+    The cheap change check of a reference table: its row count and the max of its check column (if it has one)
+    """
+    check_column = _REFERENCE_CACHE['check_columns'].get(table_name)
+    sql = 'SELECT COUNT(*) AS row_count'
+    if check_column is not None:
+        sql += ', MAX('+_check_identifier(check_column)+') AS max_version'
+    row = conn.exec_driver_sql(sql+' FROM '+table_name).fetchone()
+    # rowversion comes back as bytes, keep the signature json-friendly
+    return [v.hex() if isinstance(v, (bytes, bytearray)) else v if v is None or isinstance(v, (int, float, str))
+            else str(v) for v in row]
+
+
+def read_reference_table(table_name, engine=None, connection=None):
+    """
+    Reads a whole reference table, through the local cache when it is enabled (see enable_reference_cache)
+
+    Parameters
+    ---------
+    table_name : str
+        the table to read
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run the reads on
+
+    Returns
+    -------
+    df : dataframe
+        every row and column of <table_name>
+    """
+    import json
+    import os
+    import time
+    import pandas as pd
+
+    import logging
+    LOGGER = logging.getLogger(__name__)
+
+    _check_identifier(table_name)
+    directory = _REFERENCE_CACHE['directory']
+    if directory is None:
+        with _begin(engine, connection) as conn:
+            return pd.read_sql_query('SELECT * FROM '+table_name, conn)
+
+    data_path = os.path.join(directory, table_name+'.parquet')
+    meta_path = os.path.join(directory, table_name+'.json')
+    with _begin(engine, connection) as conn:
+        signature = _reference_signature(conn, table_name)
+        now = time.time()
+        with _REFERENCE_LOCK:
+            cached = _REFERENCE_FRAMES.get(table_name)
+            if cached is None and os.path.exists(data_path) and os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                cached = (meta['signature'], meta['fetched_at'], None)
+            if cached is not None and cached[0] == signature and now-cached[1] < _REFERENCE_CACHE['ttl_seconds']:
+                if cached[2] is None:
+                    cached = (cached[0], cached[1], pd.read_parquet(data_path))
+                    _REFERENCE_FRAMES[table_name] = cached
+                return cached[2].copy()
+
+        LOGGER.info('refreshing cached reference table: '+table_name)
+        df = pd.read_sql_query('SELECT * FROM '+table_name, conn)
+    with _REFERENCE_LOCK:
+        # write to temp files and swap them in so a concurrent reader never sees half a file
+        df.to_parquet(data_path+'.tmp', index=False)
+        os.replace(data_path+'.tmp', data_path)
+        with open(meta_path+'.tmp', 'w') as f:
+            json.dump({'table': table_name, 'fetched_at': now, 'signature': signature}, f)
+        os.replace(meta_path+'.tmp', meta_path)
+        _REFERENCE_FRAMES[table_name] = (signature, now, df)
+    return df.copy()
+
+
+def _read_reference_for_ids(table_name, ids, connection, columns, filters=None, **read_kwargs):
+    """
+    read_table_for_ids for a reference table: served from the reference cache (filtered in pandas) when it is enabled
+    """
+    if _REFERENCE_CACHE['directory'] is None:
+        return read_table_for_ids(table_name, ids, connection=connection, columns=columns, filters=filters,
+                                  **read_kwargs)
+    df = read_reference_table(table_name, connection=connection)
+    keep = df['id'].isin(ids)
+    for col, value in (filters or {}).items():
+        keep = keep & (df[col] == value)
+    df = df.loc[keep, columns].reset_index(drop=True)
+    if 'dtype' in read_kwargs:
+        df = df.astype(read_kwargs['dtype'])
+    return df
+
+
+# opt-in local replica of the time series tables (see enable_replica)
+_REPLICA = {'directory': None, 'version_columns': {}}
+# replicas already loaded in this process, {table name: (meta, dataframe)}
+_REPLICA_FRAMES = {}
+_REPLICA_LOCK = threading.Lock()
+
+
+def enable_replica(directory, tables=('returns_ts', 'aum_ts'), version_columns=None):
+    """
+    Keeps a local replica of time series tables so that reconciliation only fetches what changed since the last run
+        Each table is stored as <directory>/<table>.parquet with a <table>.json high-water mark: the max row id
+        (or the max of a rowversion column) and the row count. A refresh fetches the rows above the mark,
+        then compares the server row count with the replica's and only if they differ scans the row ids
+        to drop deleted rows (and fetch any that are missing)
+
+    Parameters
+    ---------
+    directory : str
+        folder to keep the replicas in, created if it does not exist
+    tables : list
+        tables to replicate. each must have a spec in RECONCILE_SPECS (for its row id)
+    version_columns : dict, optional
+        {table name: rowversion column}. with a version column rows updated in place (merge mode) are picked up too.
+        without one the watermark is the row id, which only sees inserts and deletes: a merge-mode load run through
+        this module flags the replica and the next refresh reads the whole table again, but rows updated in place
+        by anything else are never picked up
+
+    Returns
+    -------
+
+    """
+    import os
+    for table_name in tables:
+        _replica_row_id(table_name)
+    import logging
+    LOGGER = logging.getLogger(__name__)
+    os.makedirs(directory, exist_ok=True)
+    version_columns = dict(version_columns or {})
+    for table_name in tables:
+        if version_columns.get(table_name) is None:
+            LOGGER.warning('replica of '+table_name+' has no rowversion column: rows updated in place are only '
+                           'picked up by a full refresh after a merge-mode load')
+    with _REPLICA_LOCK:
+        _REPLICA['directory'] = directory
+        _REPLICA['version_columns'] = {table_name: version_columns.get(table_name) for table_name in tables}
+        _REPLICA_FRAMES.clear()
+
+
+def disable_replica():
+    """
+    Turns the replica off again, reconciliation reads go straight to the database. The files are left on disk
+    """
+    with _REPLICA_LOCK:
+        _REPLICA['directory'] = None
+        _REPLICA['version_columns'] = {}
+        _REPLICA_FRAMES.clear()
+
+
+def _replica_row_id(table_name):
+    for spec in RECONCILE_SPECS.values():
+        if spec['table'] == table_name:
+            return spec['row_id']
+    raise ValueError('no reconciliation spec for table: '+str(table_name))
+
+
+def _replica_enabled(table_name):
+    return _REPLICA['directory'] is not None and table_name in _REPLICA['version_columns']
+
+
+def _save_replica(table_name, meta, df):
+    import json
+    import os
+    data_path = os.path.join(_REPLICA['directory'], table_name+'.parquet')
+    meta_path = os.path.join(_REPLICA['directory'], table_name+'.json')
+    # write to temp files and swap them in so a crash never leaves half a replica
+    df.to_parquet(data_path+'.tmp', index=False)
+    os.replace(data_path+'.tmp', data_path)
+    with open(meta_path+'.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path+'.tmp', meta_path)
+    _REPLICA_FRAMES[table_name] = (meta, df)
+
+
+def _load_replica(table_name):
+    import json
+    import os
+    import pandas as pd
+    if table_name in _REPLICA_FRAMES:
+        return _REPLICA_FRAMES[table_name]
+    data_path = os.path.join(_REPLICA['directory'], table_name+'.parquet')
+    meta_path = os.path.join(_REPLICA['directory'], table_name+'.json')
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None, None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    _REPLICA_FRAMES[table_name] = (meta, pd.read_parquet(data_path))
+    return _REPLICA_FRAMES[table_name]
+
+
+def _watermark(value):
+    # rowversion comes back as bytes, keep the watermark json-friendly
+    if isinstance(value, (bytes, bytearray)):
+        return {'hex': value.hex()}
+    return None if value is None else int(value)
+
+
+def _watermark_value(mark):
+    if isinstance(mark, dict):
+        return bytes.fromhex(mark['hex'])
+    return mark
+
+
+def refresh_replica(table_name, engine=None, connection=None, full=False):
+    """
+    Brings the local replica of a table up to date (see enable_replica) and returns it
+
+    Parameters
+    ---------
+    table_name : str
+        a table passed to enable_replica
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run the reads on
+    full : bool
+        if True, throw the replica away and read the whole table again
+
+    Returns
+    -------
+    df : dataframe
+        every row of <table_name> as of this refresh
+    """
+    import pandas as pd
+    from sqlalchemy import text
+
+    import logging
+    LOGGER = logging.getLogger(__name__)
+
+    if not _replica_enabled(table_name):
+        raise ValueError('no replica enabled for table: '+str(table_name))
+    row_id = _check_identifier(_replica_row_id(table_name))
+    version_column = _REPLICA['version_columns'][table_name]
+    mark_column = _check_identifier(version_column) if version_column is not None else row_id
+
+    def read(sql, conn, params=None):
+        df = pd.read_sql_query(text(sql), conn, params=params)
+        if 'asof_date' in df.columns:
+            df['asof_date'] = pd.to_datetime(df['asof_date'])
+        return df
+
+    with _REPLICA_LOCK, _begin(engine, connection) as conn:
+        meta, replica = (None, None) if full else _load_replica(table_name)
+        if meta is not None and meta.get('merged'):
+            # rows were updated in place and the row id watermark can't see them
+            LOGGER.warning('merge-mode load updated '+table_name+' in place, rebuilding its replica '
+                           '(set a rowversion column in enable_replica to avoid this)')
+            meta, replica = None, None
+            full = True
+        server_count, server_mark = conn.exec_driver_sql(
+            'SELECT COUNT(*), MAX('+mark_column+') FROM '+table_name).fetchone()
+        if replica is None:
+            LOGGER.info('building local replica of '+table_name)
+            replica = read('SELECT * FROM '+table_name, conn)
+        else:
+            changed = replica.iloc[:0]
+            if meta['watermark'] is None:
+                changed = read('SELECT * FROM '+table_name, conn)
+            elif server_mark is not None and _watermark(server_mark) != meta['watermark']:
+                changed = read('SELECT * FROM '+table_name+' WHERE '+mark_column+' > :mark', conn,
+                               {'mark': _watermark_value(meta['watermark'])})
+            # rows updated in place (version column) replace their old copy
+            replica = pd.concat([replica[~replica[row_id].isin(changed[row_id])], changed], ignore_index=True)
+            if len(replica.index) != server_count:
+                # something was deleted (or is missing locally), only now pay for a scan of the row ids
+                server_ids = pd.read_sql_query('SELECT '+row_id+' FROM '+table_name, conn)[row_id]
+                missing = server_ids[~server_ids.isin(replica[row_id])]
+                replica = replica[replica[row_id].isin(server_ids)]
+                if len(missing) > 0:
+                    replica = pd.concat([replica, read_table_for_ids(table_name, missing, connection=conn,
+                                                                     id_column=row_id, parse_dates=['asof_date']
+                                                                     if 'asof_date' in replica.columns else None)],
+                                        ignore_index=True)
+            LOGGER.info('refreshed local replica of '+table_name+': '+str(len(changed.index)) +
+                        ' changed rows fetched, '+str(len(replica.index))+' rows')
+        new_meta = {'table': table_name, 'watermark': _watermark(server_mark), 'row_count': int(server_count)}
+        if meta != new_meta or full:
+            _save_replica(table_name, new_meta, replica.reset_index(drop=True))
+        return _REPLICA_FRAMES[table_name][1]
+
+
+def _replica_merged(table_name):
+    """
+    Flags a replica without a version column after rows were updated in place, so the next refresh is a full one
+    """
+    import json
+    import os
+    if not _replica_enabled(table_name) or _REPLICA['version_columns'][table_name] is not None:
+        return
+    with _REPLICA_LOCK:
+        meta, replica = _load_replica(table_name)
+        if replica is None:
+            return
+        meta = dict(meta, merged=True)
+        meta_path = os.path.join(_REPLICA['directory'], table_name+'.json')
+        with open(meta_path+'.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path+'.tmp', meta_path)
+        _REPLICA_FRAMES[table_name] = (meta, replica)
+
+
+def _replica_forget(table_name, row_ids):
+    """
+    Drops rows we deleted ourselves from the replica so the next refresh does not need to scan for them
+    """
+    if not _replica_enabled(table_name) or len(row_ids) == 0:
+        return
+    with _REPLICA_LOCK:
+        meta, replica = _load_replica(table_name)
+        if replica is None:
+            return
+        row_id = _replica_row_id(table_name)
+        keep = ~replica[row_id].isin(row_ids)
+        meta = dict(meta, row_count=meta['row_count']-int((~keep).sum()))
+        _save_replica(table_name, meta, replica[keep].reset_index(drop=True))
+
+
+def _read_replica_for_ids(table_name, ids, connection, columns, dtype=None):
+    """
+    read_table_for_ids for a replicated table: refreshes the replica and filters it in pandas
+    """
+    df = refresh_replica(table_name, connection=connection)
+    df = df.loc[df['id'].isin(ids), columns].reset_index(drop=True)
+    if dtype is not None:
+        df = df.astype(dtype)
+    return df
+
+
+# memory-mapped returns stores (see refresh_returns_store), keyed by directory: the open version's arrays
+_RETURNS_STORES = {}
+_RETURNS_STORE_LOCK = threading.Lock()
+
+
+def refresh_returns_store(directory, table_name='returns_ts', engine=None, connection=None, version_column=None,
+                          full=False):
+    """
+    Builds or refreshes a local columnar store of a time series table for analytics that should not hit the database
+        The rows are kept sorted by fund and date in flat numpy arrays (ids.npy, offsets.npy, dates.npy, values.npy)
+        that read_returns_store memory-maps, so each fund's series is one contiguous slice found through the
+        id-to-offset index. A refresh only re-reads the funds with rows above the store's high-water mark
+        (max row id, or of version_column) or whose row count on the server differs from the store's.
+        Each refresh writes a new version folder and then swaps store.json to it, so open readers keep
+        a consistent (older) copy
+
+    Parameters
+    ---------
+    directory : str
+        folder to keep the store in, created if it does not exist
+    table_name : str
+        the table to store, one with a spec in RECONCILE_SPECS. its first value column is stored
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run every statement on
+    version_column : str, optional
+        rowversion column, so rows updated in place (merge mode) are picked up too
+    full : bool
+        rebuild the store from the whole table
+
+    Returns
+    -------
+    meta : dict
+        table, version, watermark, funds, rows and funds_refreshed of the store
+    """
+    import json
+    import os
+    import numpy as np
+    import pandas as pd
+    from sqlalchemy import text
+
+    import logging
+    LOGGER = logging.getLogger(__name__)
+
+    spec = _get_spec(table_name)
+    table = _check_identifier(spec['table'])
+    row_id = _check_identifier(spec['row_id'])
+    value_column = _check_identifier(spec['value_columns'][0])
+    mark_column = _check_identifier(version_column) if version_column is not None else row_id
+    os.makedirs(directory, exist_ok=True)
+
+    with _RETURNS_STORE_LOCK:
+        store = None if full else _open_returns_store(directory)
+        if store is not None and store['table'] != table:
+            raise ValueError(directory+' holds a store of '+store['table']+', not '+table)
+        with _begin(engine, connection) as conn:
+            # the mark is taken first: rows written while we read are fetched again next time
+            server_mark = conn.exec_driver_sql('SELECT MAX('+mark_column+') FROM '+table).scalar()
+            if store is None:
+                LOGGER.info('building local returns store of '+table)
+                rows = pd.read_sql_query('SELECT id, asof_date, '+value_column+' FROM '+table, conn)
+                changed = None
+            else:
+                counts = pd.read_sql_query('SELECT id, COUNT(*) AS n FROM '+table+' GROUP BY id', conn)
+                stored = pd.DataFrame({'id': store['ids'], 'stored': np.diff(store['offsets'])})
+                counts = counts.merge(stored, on='id', how='outer')
+                changed = counts[counts['n'] != counts['stored']]['id']
+                if store['watermark'] is not None and server_mark is not None:
+                    added = pd.read_sql_query(text('SELECT DISTINCT id FROM '+table+' WHERE '+mark_column+' > :mark'),
+                                              conn, params={'mark': _watermark_value(store['watermark'])})['id']
+                    changed = pd.concat([changed, added])
+                changed = changed.drop_duplicates().to_numpy(dtype='int64')
+                if len(changed) == 0:
+                    LOGGER.info('local returns store of '+table+' is up to date')
+                    meta = {key: store[key] for key in ['table', 'version', 'watermark', 'funds', 'rows']}
+                    return dict(meta, funds_refreshed=0)
+                rows = read_table_for_ids(table, changed, connection=conn, columns=['id', 'asof_date', value_column])
+        rows['asof_date'] = pd.to_datetime(rows['asof_date'])
+        ids = rows['id'].to_numpy(dtype='int64')
+        dates = rows['asof_date'].to_numpy(dtype='datetime64[D]')
+        values = rows[value_column].to_numpy(dtype='float64')
+        if changed is not None:
+            # keep the unchanged funds' rows as they are
+            fund_of_row = np.repeat(store['ids'], np.diff(store['offsets']))
+            keep = ~np.isin(fund_of_row, changed)
+            ids = np.concatenate([fund_of_row[keep], ids])
+            dates = np.concatenate([store['dates'][keep], dates])
+            values = np.concatenate([store['values'][keep], values])
+        order = np.lexsort((dates, ids))
+        ids, dates, values = ids[order], dates[order], values[order]
+        fund_ids, starts = np.unique(ids, return_index=True)
+        offsets = np.append(starts, len(ids)).astype('int64')
+
+        meta = {'table': table,
+                'version': (store['version'] if store is not None else 0)+1,
+                'watermark': _watermark(server_mark),
+                'funds': int(len(fund_ids)),
+                'rows': int(len(ids)),
+                'funds_refreshed': int(len(fund_ids) if changed is None else len(changed))}
+        version_dir = os.path.join(directory, 'v'+str(meta['version']))
+        os.makedirs(version_dir, exist_ok=True)
+        for name, array in [('ids', fund_ids), ('offsets', offsets), ('dates', dates), ('values', values)]:
+            np.save(os.path.join(version_dir, name+'.npy'), array)
+        with open(os.path.join(directory, 'store.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(directory, 'store.json.tmp'), os.path.join(directory, 'store.json'))
+        _RETURNS_STORES.pop(directory, None)
+        _remove_old_store_versions(directory, meta['version'])
+    LOGGER.info('refreshed local returns store of '+table+': '+str(meta['funds_refreshed'])+' funds read, ' +
+                str(meta['rows'])+' rows')
+    return meta
+
+
+def _remove_old_store_versions(directory, version):
+    import os
+    import shutil
+    for name in os.listdir(directory):
+        if name.startswith('v') and name[1:].isdigit() and int(name[1:]) < version:
+            # a reader may still have an old version mapped (windows refuses the delete), a later refresh retries
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def _open_returns_store(directory):
+    import json
+    import os
+    import numpy as np
+    path = os.path.join(directory, 'store.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        meta = json.load(f)
+    store = _RETURNS_STORES.get(directory)
+    if store is None or store['version'] != meta['version']:
+        version_dir = os.path.join(directory, 'v'+str(meta['version']))
+        store = dict(meta, **{name: np.load(os.path.join(version_dir, name+'.npy'), mmap_mode='r')
+                              for name in ['ids', 'offsets', 'dates', 'values']})
+        _RETURNS_STORES[directory] = store
+    return store
+
+
+def read_returns_store(directory, ids=None, start_date=None, end_date=None):
+    """
+    Returns each fund's dates and values from a local returns store (see refresh_returns_store) without copying
+        The arrays are read-only views into the memory-mapped store, sliced to the date range
+
+    Parameters
+    ---------
+    directory : str
+        the store's folder
+    ids : list, optional
+        fund ids to return. default every fund in the store. ids not in the store are left out
+    start_date : date-like, optional
+        first date to return (inclusive)
+    end_date : date-like, optional
+        last date to return (inclusive)
+
+    Returns
+    -------
+    series : dict
+        {fund id: (dates, values)}, dates as datetime64[D] and values as float64 numpy arrays
+    """
+    import numpy as np
+    import pandas as pd
+    with _RETURNS_STORE_LOCK:
+        store = _open_returns_store(directory)
+    if store is None:
+        raise ValueError('no returns store in '+str(directory)+', run refresh_returns_store first')
+    fund_ids, offsets, dates, values = store['ids'], store['offsets'], store['dates'], store['values']
+    if ids is None:
+        positions = np.arange(len(fund_ids))
+    else:
+        # the index is sorted by id, ids not in the store are dropped
+        wanted = np.asarray(list(ids), dtype='int64')
+        positions = np.searchsorted(fund_ids, wanted)
+        positions = positions[positions < len(fund_ids)]
+        positions = positions[np.isin(fund_ids[positions], wanted)]
+    start = None if start_date is None else np.datetime64(pd.Timestamp(start_date).date(), 'D')
+    end = None if end_date is None else np.datetime64(pd.Timestamp(end_date).date(), 'D')
+    series = {}
+    for position in positions:
+        first, last = offsets[position], offsets[position+1]
+        # each fund's dates are sorted, so the date range is a binary search inside its slice
+        if start is not None:
+            first += np.searchsorted(dates[first:last], start, side='left')
+        if end is not None:
+            last = first+np.searchsorted(dates[first:last], end, side='right')
+        series[int(fund_ids[position])] = (dates[first:last], values[first:last])
+    return series
+
+
+def _date_bounds(df, date_column='asof_date'):
+    """
+    Returns the (min, max) of a date column, or (None, None) if the frame has no usable dates
+    """
+    import pandas as pd
+    if date_column not in df.columns or len(df) == 0:
+        return None, None
+    dates = pd.to_datetime(df[date_column])
+    if dates.isnull().all():
+        return None, None
+    return dates.min(), dates.max()
+
+
+def adj_dataframe(df, nullable_ids=False):
+    """
+    Ensures that a dataframes columns are consistent for merging and for sql datatypes
+
+    Parameters
+    ---------
+    df : dataframe
+        a dataframe whose columns you want to adjust
+    nullable_ids : bool
+        if True, id columns holding numeric ids and nulls become nullable Int64 columns instead of object columns
+
+    Returns
+    df : dataframe
+        a dataframe with adjusted columns
+    -------
+
+    """
+    import numpy as np
+    import pandas as pd
+    df = df.replace('NaN', np.nan)
+    df = df.fillna(value=np.nan)
+    for col in df.columns:
+        if col in ['asof_date', 'Date', 'date', 'dates']:
+            df[col] = pd.to_datetime(df[col])
+        if col in ['id', 'external_id', 'fundId', 'Fund_ID', 'Index_ID', 'external_strategy_id', 'strategy_code', 'strategy_fund_id', 'Fund ID', 'Firm_ID', 'Firm ID', 'ret_ts_id', 'aum_ts_id', 'id_record_number', 'risk_ts_id']:
+            # column-wise conversion, columns with np.nan's or non-numeric ids come back as object columns
+            df[col] = convert_id(df[col], nullable=nullable_ids)
+    return df
+
+
+# every get_* loader runs the same source-hierarchy reconciliation, only the tables and columns differ.
+#   table            : the table being loaded
+#   frame_name       : name of the incoming dataframe argument, used in error messages
+#   required         : columns the incoming dataframe must have
+#   keys             : columns an incoming row is matched to an existing row on
+#   value_columns    : columns compared to decide whether an existing row has changed
+#   columns          : columns inserted to <table>
+#   optional_columns : columns also inserted when the incoming dataframe has them
+#   row_id           : the table's unique row id, used for deletes
+#   source_column    : column holding the source of each row
+#   categories       : low-cardinality columns held as pandas categoricals in the snapshot (and in the incoming
+#                      dataframe, unless they are keys, value columns or the source column)
+#   archive_table    : table superseded rows are copied to before they are deleted (None for no archive)
+#   blend_flag       : column in funds marking funds that blend sources (None if the dataset never blends)
+#   blend_keeps_own_source : for blended funds, never replace the given source's own rows
+#   eligibility      : only load funds mapped to the source that have no other source's data,
+#                      and remove worse sources for the rest. False loads every incoming fund
+#   nulls_equal      : two nulls are not a change (otherwise null != null counts as a break)
+#   dropna_all       : drop incoming rows where all of these columns are null
+#   round            : {column: decimals} rounding applied to incoming and existing values before comparing
+#   adjust_snapshot  : run adj_dataframe over the existing rows
+#   drop_duplicates  : drop duplicate rows from the insert
+#   backup_suffix    : the worse-source rows are written to <source><backup_suffix> before they are removed
+#   diff             : function(merge_df, spec, source, better_sources) -> (new, breaks), defaults to _diff_values
+#   merge_mode       : the table can be loaded server-side with merge_reconciliation
+#   keep_source      : keep the source column the incoming dataframe already has (filled with the source where
+#                      null) instead of stamping every inserted row with the source
+#   column_types     : sql server types of the columns, used for staging tables and bulk_insert
+#                      (columns not listed are typed from their dtype)
+RECONCILE_SPECS = {
+    'aum_ts': {'table': 'aum_ts',
+               'frame_name': 'aum_df',
+               'required': ['id', 'asset_value', 'asof_date', 'source'],
+               'keys': ['id', 'asof_date'],
+               'value_columns': ['asset_value'],
+               'columns': ['id', 'asof_date', 'asset_value', 'source'],
+               'optional_columns': [],
+               'row_id': 'aum_ts_id',
+               'source_column': 'source',
+               'categories': ['source'],
+               'archive_table': 'old_aum_ts',
+               'blend_flag': 'blend_aums',
+               'blend_keeps_own_source': True,
+               'eligibility': True,
+               'nulls_equal': False,
+               'dropna_all': [],
+               'round': {},
+               'adjust_snapshot': False,
+               'drop_duplicates': False,
+               'backup_suffix': '_aum_backup.csv',
+               'diff': None,
+               'merge_mode': True,
+               'keep_source': False,
+               'column_types': {'id': 'BIGINT', 'asof_date': 'DATETIME', 'asset_value': 'FLOAT',
+                                'source': 'NVARCHAR(255)'}},
+    'returns_ts': {'table': 'returns_ts',
+                   'frame_name': 'returns_df',
+                   'required': ['id', 'return_value', 'asof_date', 'source'],
+                   'keys': ['id', 'asof_date'],
+                   'value_columns': ['return_value'],
+                   'columns': ['id', 'asof_date', 'return_value', 'source'],
+                   'optional_columns': ['type'],
+                   'row_id': 'ret_ts_id',
+                   'source_column': 'source',
+                   'categories': ['source', 'type'],
+                   'archive_table': 'old_returns_ts',
+                   'blend_flag': 'blend_returns',
+                   'blend_keeps_own_source': False,
+                   'eligibility': True,
+                   'nulls_equal': False,
+                   'dropna_all': [],
+                   'round': {},
+                   'adjust_snapshot': False,
+                   'drop_duplicates': False,
+                   'backup_suffix': '_backup.csv',
+                   'diff': None,
+                   'merge_mode': True,
+                   'keep_source': False,
+                   'column_types': {'id': 'BIGINT', 'asof_date': 'DATETIME', 'return_value': 'FLOAT',
+                                    'source': 'NVARCHAR(255)', 'type': 'NVARCHAR(255)'}},
+    'fees': {'table': 'fees',
+             'frame_name': 'fees_df',
+             'required': ['id', 'management_fee', 'performance_fee', 'hurdle_rate', 'high_water_mark', 'source'],
+             'keys': ['id'],
+             'value_columns': ['performance_fee', 'management_fee', 'high_water_mark', 'hurdle_rate'],
+             'columns': ['id', 'management_fee', 'performance_fee', 'hurdle_rate', 'high_water_mark', 'source'],
+             'optional_columns': [],
+             'row_id': 'id_record_number',
+             'source_column': 'source',
+             'categories': ['source'],
+             'archive_table': None,
+             'blend_flag': None,
+             'blend_keeps_own_source': False,
+             'eligibility': True,
+             'nulls_equal': True,
+             'dropna_all': ['management_fee', 'performance_fee'],
+             'round': {'management_fee': 8, 'performance_fee': 8},
+             'adjust_snapshot': False,
+             'drop_duplicates': True,
+             'backup_suffix': None,
+             'diff': None,
+             'merge_mode': False,
+             'keep_source': False,
+             'column_types': {'id': 'BIGINT', 'management_fee': 'FLOAT', 'performance_fee': 'FLOAT',
+                              'source': 'NVARCHAR(255)'}},
+    'fund_liquidity': {'table': 'fund_liquidity',
+                       'frame_name': 'liquidity_df',
+                       'required': ['id', 'redemption_notice_days', 'redemption_frequency', 'redemption_gate',
+                                    'lock_up', 'subscription_frequency', 'source'],
+                       'keys': ['id'],
+                       'value_columns': ['redemption_notice_days', 'redemption_frequency', 'redemption_gate',
+                                         'lock_up', 'subscription_frequency'],
+                       'columns': ['id', 'redemption_notice_days', 'redemption_frequency', 'redemption_gate',
+                                   'lock_up', 'subscription_frequency', 'source'],
+                       'optional_columns': [],
+                       'row_id': 'id_record_number',
+                       'source_column': 'source',
+                       'categories': ['source'],
+                       'archive_table': None,
+                       'blend_flag': None,
+                       'blend_keeps_own_source': False,
+                       'eligibility': True,
+                       'nulls_equal': True,
+                       'dropna_all': ['redemption_notice_days', 'redemption_frequency', 'redemption_gate',
+                                      'lock_up', 'subscription_frequency'],
+                       'round': {},
+                       'adjust_snapshot': True,
+                       'drop_duplicates': True,
+                       'backup_suffix': None,
+                       'diff': None,
+                       'merge_mode': False,
+                       'keep_source': False,
+                       'column_types': {'id': 'BIGINT', 'source': 'NVARCHAR(255)'}},
+    'fund_status': {'table': 'fund_status',
+                    'frame_name': 'df',
+                    'required': ['id', 'current_status', 'included', 'included_source', 'status_source'],
+                    'keys': ['id'],
+                    'value_columns': ['current_status'],
+                    'columns': ['id', 'current_status', 'status_source', 'included', 'included_source'],
+                    'optional_columns': [],
+                    'row_id': 'id',
+                    'source_column': 'status_source',
+                    'categories': ['status_source', 'current_status'],
+                    'archive_table': None,
+                    'blend_flag': None,
+                    'blend_keeps_own_source': False,
+                    'eligibility': False,
+                    'nulls_equal': False,
+                    'dropna_all': [],
+                    'round': {},
+                    'adjust_snapshot': False,
+                    'drop_duplicates': False,
+                    'backup_suffix': None,
+                    'diff': '_diff_status',
+                    'merge_mode': False,
+                    'keep_source': True,
+                    'column_types': {'id': 'BIGINT', 'current_status': 'NVARCHAR(255)',
+                                     'status_source': 'NVARCHAR(255)', 'included_source': 'NVARCHAR(255)'}},
+}
+
+
+def _get_spec(spec):
+    """
+    Returns the reconciliation spec for a table name (or the spec itself if a dict was passed)
+    """
+    if isinstance(spec, dict):
+        return spec
+    if spec not in RECONCILE_SPECS:
+        raise ValueError('no reconciliation spec for table: '+str(spec))
+    return RECONCILE_SPECS[spec]
+
+
+def _prepare_frame(spec, df, better_sources):
+    """
+    Validates the incoming dataframe against the spec and applies the spec's dropna/rounding
+    """
+    if type(better_sources) is not list:
+        raise ValueError("""'better_sources' must be of type list """)
+    for col in spec['required']:
+        if col not in df.columns.to_list():
+            raise ValueError(col+' must be a column in '+spec['frame_name']+' ')
+
+    if len(spec['dropna_all']) > 0:
+        df = df.dropna(subset=spec['dropna_all'], how='all').copy()
+    for col, decimals in spec['round'].items():
+        df.loc[:, col] = df[col].round(decimals=decimals)
+    return df
+
+
+def _compact_frame(spec, df, categories=None):
+    """
+    Shrinks the dtypes of a frame before it is merged: fund and row ids become int32 when every value fits
+    (int64 otherwise) and the spec's low-cardinality columns (or the given categories) become categoricals.
+    asof_date is left as it is, pandas has no day resolution and its coarsest unit (seconds) is as wide as
+    nanoseconds
+    """
+    import numpy as np
+    import pandas as pd
+    int32 = np.iinfo('int32')
+    for col in dict.fromkeys(['id', spec['row_id']]):
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col].dtype) and \
+                (len(df.index) == 0 or (df[col].min() >= int32.min and df[col].max() <= int32.max)):
+            df[col] = df[col].astype('int32')
+    for col in spec.get('categories', []) if categories is None else categories:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _diff_values(merge_df, spec, source, better_sources):
+    """
+    Splits incoming rows left-merged onto the existing rows into new rows and breaks
+        rows whose existing source is a better source are dropped,
+        rows with no existing row are new, and rows where any value column differs are breaks
+    """
+    import pandas as pd
+    merge_df = merge_df[~merge_df[spec['source_column']+' existing'].isin(better_sources)]
+    new = merge_df[merge_df['_row_id'].isnull()]
+    existing = merge_df[~merge_df['_row_id'].isnull()]
+    changed = pd.Series(False, index=existing.index)
+    for col in spec['value_columns']:
+        differs = existing[col] != existing[col+' existing']
+        if spec['nulls_equal']:
+            # we are not deleting and re-inserting records where both sides are null
+            differs = differs & (~existing[col].isnull() | ~existing[col+' existing'].isnull())
+        changed = changed | differs
+    return new, existing[changed]
+
+
+def _diff_status(merge_df, spec, source, better_sources):
+    """
+    fund_status comparison: a changed status replaces the existing one if the existing status is 'Unknown',
+    or if the existing status source is not a better source. the existing included/included_source are kept
+    """
+    import pandas as pd
+    update = merge_df[merge_df['current_status']
+                      != merge_df['current_status existing']].copy()
+    # always update 'Unknown' status
+    update1 = update[update['current_status existing'] == 'Unknown'].copy()
+    update1 = update1.drop(columns=['included', 'included_source'])
+    # set the old included data as new to preseve it
+    update1 = update1.rename(columns={'included existing': 'included',
+                                      'included_source existing': 'included_source'})
+
+    # exclude better sources (including manual) as the source
+    # this would also include new records
+    update2 = update[~update['status_source existing'].isin(
+        better_sources)].copy()
+    # fill missing records with data from df (these will be nulls)
+    update2.loc[:, 'included existing'] = update2['included existing'].fillna(
+        update2['included'])
+    update2.loc[:, 'included_source existing'] = update2['included_source existing'].fillna(
+        update2['included_source'])
+    update2 = update2.drop(columns=['included', 'included_source'])
+    # set the old included data as new to preseve it
+    update2 = update2.rename(columns={'included existing': 'included',
+                                      'included_source existing': 'included_source'})
+
+    # drop any funds we already caught to prevent dupes
+    update1 = update1[~update1['id'].isin(update2['id'])]
+
+    status_update = pd.concat([update1, update2])
+    status_update = status_update.reset_index(drop=True)
+    # every status that changes is deleted (by id) and re-inserted, including ones with no existing row
+    return status_update.iloc[:0], status_update
+
+
+def plan_reconciliation(spec, source, df, better_sources, engine=None, connection=None):
+    """
+    Works out every change needed to load a source's data into a table, without writing anything
+        Reads one snapshot of the relevant funds, mappings and existing rows (only for the funds in df),
+        then computes in memory:
+            1) the rows of worse sources to remove, for funds the source can't load directly
+            2) new rows and breaks for non-blended funds the source is allowed to load
+            3) new rows and breaks for blended funds
+            4) which archive rows the superseded rows replace
+
+    Parameters
+    ---------
+    spec : str or dict
+        a key of RECONCILE_SPECS (the table name) or a spec dict
+    source : str
+        the name of the source of the data
+    df : dataframe
+        the source's data
+    better_sources : list
+        sources we would NOT want to overwrite
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run the reads on
+
+    Returns
+    -------
+    plan : dict
+        'spec': the spec dict
+        'source': the source
+        'backup': the existing rows of worse sources being removed
+        'archive_delete': row ids in the archive table replaced by the rows being archived
+        'archive_insert': rows to insert to the archive table
+        'delete': row ids to delete from the table
+        'insert': rows to insert to the table
+        'merged': the rows to insert as they were merged with the existing rows (the incoming columns
+                  plus '<column> existing'), not kept by save_plan
+        'counts': row counts per step, for logging
+    """
+    import pandas as pd
+
+    spec = _get_spec(spec)
+    df = _prepare_frame(spec, df, better_sources)
+
+    table = spec['table']
+    row_id = spec['row_id']
+    source_col = spec['source_column']
+    # the incoming frame is held compact too, apart from the columns that are compared or overwritten
+    # (categoricals only compare to the same categories and only take values they already have)
+    fixed = spec['keys']+spec['value_columns']+[source_col]
+    df = _compact_frame(spec, df.copy(deep=False),
+                        categories=[col for col in spec['categories'] if col not in fixed])
+    blend_flag = spec['blend_flag']
+    snapshot_cols = list(dict.fromkeys([row_id]+spec['columns']))
+    snapshot_dtype = {'id': 'int64', row_id: 'int64'}
+    parse_dates = [col for col in snapshot_cols if col == 'asof_date']
+    input_ids = df['id'].unique()
+
+    with _begin(engine, connection) as conn:
+        if spec['eligibility']:
+            with span('eligibility', input_rows=len(df.index), input_funds=len(input_ids)) as s:
+                # funds table flags and the live, non-shareclass mappings of the given source for the incoming funds
+                funds = _read_reference_for_ids('funds', input_ids, conn,
+                                                columns=['id']+([blend_flag] if blend_flag else []),
+                                                dtype={'id': 'int64'})
+                mapped = _read_reference_for_ids('external_entity_mapping', input_ids, conn, columns=['id'],
+                                                 filters={'mapping_status': 'Live', 'is_shareclass': 0,
+                                                          'external_source': source})
+                s.update(funds=len(funds.index), mapped=len(mapped.index))
+        with span('snapshot', replica=_replica_enabled(table)) as s:
+            # every date is needed: eligibility depends on whether a fund has any data from another source
+            if _replica_enabled(table):
+                db = _read_replica_for_ids(table, input_ids, conn, snapshot_cols, dtype=snapshot_dtype)
+            else:
+                db = read_table_for_ids(table, input_ids, connection=conn, columns=snapshot_cols,
+                                        dtype=snapshot_dtype, parse_dates=parse_dates)
+            s['rows'] = len(db.index)
+    with span('diff') as s:
+        if spec['adjust_snapshot']:
+            db = adj_dataframe(db)
+        for col, decimals in spec['round'].items():
+            # round to match the incoming df
+            db[col] = db[col].round(decimals=decimals)
+        # the snapshot is only ever projected to the spec's columns, and is held in compact dtypes
+        # so the merge frames below stay small
+        db = _compact_frame(spec, db)
+        db['_row_id'] = db[row_id]
+
+        if spec['eligibility']:
+            mapped_funds = funds[funds['id'].isin(mapped['id'])]
+            unblended = mapped_funds[mapped_funds[blend_flag] == 0] if blend_flag else mapped_funds
+
+            def eligible_ids(snapshot):
+                # funds mapped to the given source (without blending) with no data from another source
+                # (either no data at all, or only the given source's data)
+                other = snapshot[snapshot[source_col].notnull() & (snapshot[source_col] != source)]['id']
+                return unblended[~unblended['id'].isin(other)]['id']
+
+            # check which internal IDs are in df but not in the list of funds we should be updating
+            # these are funds with other sources in the database
+            # strip out sources that are higher in our hierarchy
+            # filter out funds with blended data
+            # then delete the data of funds with non-blended data
+            other_sources = df[~df['id'].isin(eligible_ids(db))]['id'].unique()
+            funds_to_delete = funds[funds['id'].isin(other_sources)]
+            if blend_flag:
+                funds_to_delete = funds_to_delete[funds_to_delete[blend_flag] == 0]
+            worse = db[db['id'].isin(funds_to_delete['id'])]
+            worse = worse[~worse[source_col].isin(better_sources)]
+            # the rest of the plan works off the snapshot as it will be once the worse sources are gone
+            db = db[~db['_row_id'].isin(worse['_row_id'])]
+            load_ids = eligible_ids(db)
+            blend_ids = mapped_funds[mapped_funds[blend_flag] == 1]['id'] if blend_flag else []
+        else:
+            worse = db.iloc[:0]
+            load_ids = input_ids
+            blend_ids = []
+
+        diff = spec['diff'] or _diff_values
+        if isinstance(diff, str):
+            diff = getattr(current_module, diff)
+        # existing rows only carry the columns we compare, so the incoming frame's other columns keep their names
+        existing = db.drop(columns=[row_id]) if row_id not in spec['keys'] else db
+
+        # check to only update funds with existing source's data or missing data
+        rows = df[df['id'].isin(load_ids)].reset_index(drop=True)
+        merge_df = rows.merge(existing, how='left', on=spec['keys'], suffixes=('', ' existing'))
+        new, breaks = diff(merge_df, spec, source, better_sources)
+
+        blend_rows = df[df['id'].isin(blend_ids)].reset_index(drop=True)
+        merge_blend_df = blend_rows.merge(existing, how='left', on=spec['keys'], suffixes=('', ' existing'))
+        blend_new, blend_breaks = diff(merge_blend_df, spec, source, better_sources)
+        if spec['blend_keeps_own_source']:
+            # we dont want to overwrite given source's data
+            blend_breaks = blend_breaks[blend_breaks[source_col+' existing'] != source]
+        s.update(inferior=len(worse.index), new=len(new.index), breaks=len(breaks.index),
+                 blend_new=len(blend_new.index), blend_breaks=len(blend_breaks.index))
+
+    archive_cols = spec['keys']+[col for col in spec['columns'] if col not in spec['keys']]
+    archive = pd.DataFrame(columns=archive_cols)
+    archive_delete = []
+    if spec['archive_table'] is not None:
+        with span('archive lookup') as s:
+            # current process is to move old rows out of the primary table and into the archive table
+            # we do this as a backup in case any funds data needs to be restored
+            # this only has to be done on the rows we're about to delete
+            existing_cols = {col+' existing': col for col in archive_cols if col not in spec['keys']}
+            archive = pd.concat([worse[archive_cols],
+                                 breaks[spec['keys']+list(existing_cols)].rename(columns=existing_cols),
+                                 blend_breaks[spec['keys']+list(existing_cols)].rename(columns=existing_cols)])
+            archive = archive.reset_index(drop=True)
+            if len(archive['id']) > 0:
+                start_date, end_date = _date_bounds(archive)
+                db_old = read_table_for_ids(spec['archive_table'], archive['id'], engine, connection,
+                                            columns=list(dict.fromkeys([row_id]+spec['keys']+[source_col])),
+                                            date_column='asof_date' if 'asof_date' in spec['keys'] else None,
+                                            start_date=start_date, end_date=end_date,
+                                            dtype=snapshot_dtype, parse_dates=parse_dates)
+                # match on source here to ensure we are retaining records from various sources in case we need to
+                # fallback
+                # archived rows replace any older archived copy of the same keys and source
+                superseded = db_old.merge(archive[spec['keys']+[source_col]].drop_duplicates(),
+                                          on=spec['keys']+[source_col])
+                archive_delete = superseded[row_id].to_list()
+            s.update(rows=len(archive.index), replaced=len(archive_delete))
+
+    insert_cols = spec['columns']+[col for col in spec['optional_columns'] if col in df.columns]
+    upload = pd.concat([new, breaks, blend_new, blend_breaks])
+    if spec.get('keep_source'):
+        upload.loc[:, source_col] = upload[source_col].astype(object).fillna(source)
+    else:
+        upload.loc[:, source_col] = source
+    merged = upload.drop(columns=['_row_id']).reset_index(drop=True)
+    upload = upload[insert_cols].reset_index(drop=True)
+    if spec['drop_duplicates']:
+        upload = upload.drop_duplicates(keep='first').reset_index(drop=True)
+
+    to_delete = pd.concat([worse['_row_id'], breaks['_row_id'], blend_breaks['_row_id']])
+    to_delete = to_delete.dropna().drop_duplicates().to_list()
+
+    return {'spec': spec,
+            'source': source,
+            'backup': worse[archive_cols+([row_id] if row_id not in archive_cols else [])],
+            'archive_delete': archive_delete,
+            'archive_insert': archive,
+            'delete': to_delete,
+            'insert': upload,
+            'merged': merged,
+            'counts': {'inferior': len(worse['id']),
+                       'new': len(new['id']),
+                       'breaks': len(breaks['id']),
+                       'blend new': len(blend_new['id']),
+                       'blend breaks': len(blend_breaks['id']),
+                       'archive replaced': len(archive_delete)}}
+
+
+def apply_reconciliation(plan, engine=None, connection=None):
+    """
+    Writes a plan from plan_reconciliation (or load_plan) to the database in one transaction:
+        replaced archive rows are deleted and the superseded rows archived,
+        then the superseded and worse-source rows are deleted and the new rows inserted
+
+    Parameters
+    ---------
+    plan : dict
+        the output of plan_reconciliation or load_plan
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+
+    Returns
+    -------
+
+    """
+    import logging
+    LOGGER = logging.getLogger(__name__)
+
+    spec = plan['spec']
+    table = spec['table']
+    archive_table = spec['archive_table']
+    counts = plan['counts']
+    with _begin(engine, connection) as conn:
+        if archive_table is not None:
+            if len(plan['archive_insert']['id']) > 0:
+                with span('archive', rows=len(plan['archive_insert'].index),
+                          replaced=len(plan['archive_delete'])):
+                    batch_delete(plan['archive_delete'], archive_table, spec['row_id'], connection=conn)
+                    bulk_insert(plan['archive_insert'], archive_table, connection=conn,
+                                column_types=spec.get('column_types'))
+                LOGGER.info('   '+str(len(plan['archive_insert']['id'])-counts['archive replaced']) +
+                            ' new rows inserted to '+archive_table)
+                LOGGER.info('   '+str(counts['archive replaced']) +
+                            ' rows deleted and updated to '+archive_table)
+            else:
+                LOGGER.info('   no records to move to '+archive_table)
+
+        # delete the old records
+        with span('delete', rows_requested=len(plan['delete'])) as s:
+            deleted = batch_delete(plan['delete'], table, spec['row_id'], connection=conn)
+            s['rows'] = deleted.rows_deleted
+        if deleted.rows_deleted != len(plan['delete']):
+            # a saved plan applied later than it was computed may be out of date
+            LOGGER.warning('plan for '+table+' expected to delete '+str(len(plan['delete'])) +
+                           ' rows but '+str(deleted.rows_deleted)+' were deleted')
+        LOGGER.info('   '+str(counts['inferior']) +
+                    ' inferior rows of '+table+' sources deleted from '+table)
+
+        with span('insert', rows=len(plan['insert'].index)) as s:
+            inserted = bulk_insert(plan['insert'], table, connection=conn, column_types=spec.get('column_types'))
+            s['rows_per_second'] = inserted.rows_per_second
+    _replica_forget(table, plan['delete'])
+    LOGGER.info('   '+str(counts['new'])+' new rows inserted to '+table)
+    LOGGER.info('   '+str(counts['breaks']) +
+                ' rows deleted and updated to '+table)
+    if spec['blend_flag']:
+        LOGGER.info('   '+str(counts['blend new'])+' new blended rows inserted to '+table)
+        LOGGER.info('   '+str(counts['blend breaks']) +
+                    ' blended rows deleted and updated to '+table)
+
+
+# the dataframes (and lists of row ids) of a plan, each saved as <name>.parquet by save_plan
+_PLAN_FRAMES = ['backup', 'archive_insert', 'insert']
+_PLAN_ROW_IDS = ['archive_delete', 'delete']
+
+
+def save_plan(plan, directory):
+    """
+    Saves a plan from plan_reconciliation so that it can be applied later (or on another machine) with apply_plan
+        The rows to archive, delete and insert are written as parquet files and the rest of the plan
+        (spec, source, counts) as plan.json
+
+    Parameters
+    ---------
+    plan : dict
+        the output of plan_reconciliation
+    directory : str
+        folder to write the plan to, created if it does not exist
+
+    Returns
+    -------
+    directory : str
+    """
+    import json
+    import os
+    import pandas as pd
+
+    os.makedirs(directory, exist_ok=True)
+    spec = plan['spec']
+    for name in _PLAN_FRAMES:
+        plan[name].reset_index(drop=True).to_parquet(os.path.join(directory, name+'.parquet'), index=False)
+    for name in _PLAN_ROW_IDS:
+        pd.DataFrame({spec['row_id']: pd.Series(plan[name], dtype='int64')}).to_parquet(
+            os.path.join(directory, name+'.parquet'), index=False)
+    # the diff function is only needed to compute a plan, keep its name so the spec stays json
+    diff = spec['diff']
+    json_spec = dict(spec, diff=diff if diff is None or isinstance(diff, str) else diff.__name__)
+    with open(os.path.join(directory, 'plan.json'), 'w') as f:
+        json.dump({'spec': json_spec,
+                   'source': plan['source'],
+                   'counts': {key: int(value) for key, value in plan['counts'].items()}}, f, indent=1)
+    return directory
+
+
+def load_plan(directory):
+    """
+    Reads a plan written by save_plan
+
+    Parameters
+    ---------
+    directory : str
+        folder the plan was saved to
+
+    Returns
+    -------
+    plan : dict
+        the plan, as plan_reconciliation returned it
+    """
+    import json
+    import os
+    import pandas as pd
+
+    with open(os.path.join(directory, 'plan.json')) as f:
+        plan = json.load(f)
+    for name in _PLAN_FRAMES:
+        plan[name] = pd.read_parquet(os.path.join(directory, name+'.parquet'))
+    for name in _PLAN_ROW_IDS:
+        plan[name] = pd.read_parquet(os.path.join(directory, name+'.parquet'))[plan['spec']['row_id']].to_list()
+    return plan
+
+
+def apply_plan(directory, engine=None, connection=None):
+    """
+    Applies a plan saved with save_plan in one transaction (see apply_reconciliation)
+        plan_reconciliation + save_plan can run wherever the heavy diff is cheap, apply_plan then only
+        writes to the database. the plan's delete count is checked against what was actually deleted
+
+    Parameters
+    ---------
+    directory : str
+        folder the plan was saved to
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+
+    Returns
+    -------
+    plan : dict
+        the plan that was applied
+    """
+    import logging
+    LOGGER = logging.getLogger(__name__)
+
+    plan = load_plan(directory)
+    LOGGER.info('applying saved plan to update '+plan['spec']['table']+' from '+plan['source'])
+    apply_reconciliation(plan, engine, connection)
+    LOGGER.info('finished applying saved plan to update '+plan['spec']['table']+' from '+plan['source'])
+    return plan
+
+
+# opt-in store of the worse-source backups (see enable_backup_store): its settings and the single writer thread
+_BACKUP_STORE = {'directory': None, 'keep_runs': 30, 'keep_days': None, 'executor': None}
+_BACKUP_LOCK = threading.Lock()
+
+
+def enable_backup_store(directory, keep_runs=30, keep_days=None):
+    """
+    Writes the worse-source backups of reconcile runs to a store instead of <source><backup_suffix> csv files
+        Each run's backup is a zstd-compressed parquet file <directory>/<table>/<source>/<run time>_<run id>.parquet,
+        sorted by fund id, written by a background thread so the load doesn't wait on it (pending writes are
+        flushed by flush_backups, disable_backup_store and at exit). manifest.json lists every file with its
+        run, row count and id range, so read_backups only opens the files that can hold the funds asked for.
+        After each write the oldest runs of the table and source beyond the retention are deleted
+
+    Parameters
+    ---------
+    directory : str
+        folder to keep the backups in, created if it does not exist
+    keep_runs : int, optional
+        runs kept per table and source. None keeps every run
+    keep_days : float, optional
+        days a run is kept. None keeps runs regardless of age
+
+    Returns
+    -------
+
+    """
+    import atexit
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    os.makedirs(directory, exist_ok=True)
+    disable_backup_store()
+    with _BACKUP_LOCK:
+        _BACKUP_STORE.update(directory=directory, keep_runs=keep_runs, keep_days=keep_days,
+                             executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix='sc_backup'))
+        if not _BACKUP_STORE.get('atexit'):
+            atexit.register(disable_backup_store)
+            _BACKUP_STORE['atexit'] = True
+
+
+def disable_backup_store():
+    """
+    Writes any pending backups and goes back to csv backup files
+    """
+    with _BACKUP_LOCK:
+        executor = _BACKUP_STORE['executor']
+        _BACKUP_STORE.update(directory=None, executor=None)
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def flush_backups():
+    """
+    Waits until every backup queued so far is written
+    """
+    with _BACKUP_LOCK:
+        executor = _BACKUP_STORE['executor']
+    if executor is not None:
+        # the writer runs one task at a time, so this runs after everything queued before it
+        executor.submit(lambda: None).result()
+
+
+def _save_backup(spec, source, backup, run_id, run_at, part=None):
+    """
+    Queues a run's backup rows to the backup store, returns False if the store is not enabled
+    """
+    with _BACKUP_LOCK:
+        if _BACKUP_STORE['executor'] is None:
+            return False
+        future = _BACKUP_STORE['executor'].submit(_write_backup, dict(_BACKUP_STORE), spec['table'], source,
+                                                  backup.copy(), run_id, run_at, part)
+
+    def log_failure(f):
+        if f.exception() is not None:
+            LOGGER.error('failed to write the backup of '+spec['table']+' from '+source+': '+repr(f.exception()))
+    future.add_done_callback(log_failure)
+    return True
+
+
+def _backup_manifest(directory):
+    import json
+    import os
+    path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_backup(settings, table, source, backup, run_id, run_at, part):
+    import json
+    import os
+    from datetime import timedelta
+    directory = settings['directory']
+    folder = os.path.join(directory, table, source)
+    os.makedirs(folder, exist_ok=True)
+    name = run_at.strftime('%Y%m%dT%H%M%S')+'_'+run_id+('_'+str(part) if part is not None else '')+'.parquet'
+    backup = backup.sort_values('id', kind='mergesort').reset_index(drop=True) if 'id' in backup.columns else backup
+    backup.to_parquet(os.path.join(folder, name+'.tmp'), index=False, compression='zstd', row_group_size=100000)
+    os.replace(os.path.join(folder, name+'.tmp'), os.path.join(folder, name))
+
+    manifest = _backup_manifest(directory)
+    ids = backup['id'].dropna() if 'id' in backup.columns else []
+    manifest.append({'table': table, 'source': source, 'run_id': run_id, 'run_at': run_at.isoformat(),
+                     'path': os.path.join(table, source, name), 'rows': len(backup.index),
+                     'min_id': int(ids.min()) if len(ids) > 0 else None,
+                     'max_id': int(ids.max()) if len(ids) > 0 else None})
+    # retention: newest runs first per table and source
+    runs = sorted({entry['run_at']+' '+entry['run_id'] for entry in manifest
+                   if entry['table'] == table and entry['source'] == source}, reverse=True)
+    expired = set(runs[settings['keep_runs']:] if settings['keep_runs'] is not None else [])
+    if settings['keep_days'] is not None:
+        cutoff = (run_at-timedelta(days=settings['keep_days'])).isoformat()
+        expired |= {run for run in runs if run.split(' ')[0] < cutoff}
+    kept = []
+    for entry in manifest:
+        if entry['table'] == table and entry['source'] == source and entry['run_at']+' '+entry['run_id'] in expired:
+            if os.path.exists(os.path.join(directory, entry['path'])):
+                os.remove(os.path.join(directory, entry['path']))
+        else:
+            kept.append(entry)
+    with open(os.path.join(directory, 'manifest.json.tmp'), 'w') as f:
+        json.dump(kept, f)
+    os.replace(os.path.join(directory, 'manifest.json.tmp'), os.path.join(directory, 'manifest.json'))
+
+
+def list_backups(directory=None, table=None, source=None):
+    """
+    Returns the runs in the backup store, newest first
+
+    Parameters
+    ---------
+    directory : str, optional
+        the store's folder. default the enabled backup store
+    table : str, optional
+        only the runs of this table
+    source : str, optional
+        only the runs of this source
+
+    Returns
+    -------
+    runs : dataframe
+        table, source, run_id, run_at, rows, min_id, max_id and path of each backup file
+    """
+    import pandas as pd
+    directory = directory or _BACKUP_STORE['directory']
+    if directory is None:
+        raise ValueError('no backup store enabled, pass its directory')
+    flush_backups()
+    runs = pd.DataFrame(_backup_manifest(directory),
+                        columns=['table', 'source', 'run_id', 'run_at', 'rows', 'min_id', 'max_id', 'path'])
+    if table is not None:
+        runs = runs[runs['table'] == table]
+    if source is not None:
+        runs = runs[runs['source'] == source]
+    runs['run_at'] = pd.to_datetime(runs['run_at'])
+    return runs.sort_values('run_at', ascending=False, ignore_index=True)
+
+
+def read_backups(ids=None, table=None, source=None, run_id=None, start=None, end=None, directory=None):
+    """
+    Returns backed-up rows from the backup store, e.g. to restore a fund's data as it was before a run
+        Only files whose id range can hold the ids are opened, and only the row groups holding them are read
+
+    Parameters
+    ---------
+    ids : list, optional
+        fund ids to return. default every fund
+    table : str, optional
+        only backups of this table
+    source : str, optional
+        only backups from runs of this source
+    run_id : str, optional
+        only the backup of this run (see list_backups)
+    start : datetime-like, optional
+        only runs at or after this time
+    end : datetime-like, optional
+        only runs at or before this time
+    directory : str, optional
+        the store's folder. default the enabled backup store
+
+    Returns
+    -------
+    backups : dataframe
+        the backed-up rows (source is the source of the row) with the table, run_source, run_id and run_at
+        of the run they were removed in
+    """
+    import os
+    import pandas as pd
+    runs = list_backups(directory, table, source)
+    directory = directory or _BACKUP_STORE['directory']
+    if run_id is not None:
+        runs = runs[runs['run_id'] == run_id]
+    if start is not None:
+        runs = runs[runs['run_at'] >= pd.Timestamp(start)]
+    if end is not None:
+        runs = runs[runs['run_at'] <= pd.Timestamp(end)]
+    filters = None
+    if ids is not None:
+        ids = [int(x) for x in ids]
+        if len(ids) == 0:
+            runs = runs.iloc[:0]
+        else:
+            runs = runs[(runs['rows'] > 0) & (runs['min_id'] <= max(ids)) & (runs['max_id'] >= min(ids))]
+            filters = [('id', 'in', ids)]
+    frames = []
+    for run in runs.itertuples(index=False):
+        frame = pd.read_parquet(os.path.join(directory, run.path), filters=filters)
+        frames.append(frame.assign(table=run.table, run_source=run.source, run_id=run.run_id, run_at=run.run_at))
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['table', 'run_source', 'run_id', 'run_at'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def merge_reconciliation(spec, source, df, better_sources, engine=None, connection=None):
+    """
+    Applies the same source hierarchy as plan_reconciliation/apply_reconciliation entirely on the server
+        df is bulk loaded into a temp table, the worse-source rows and breaks are picked out with set-based queries,
+        then one DELETE ... OUTPUT INTO archives and removes the worse-source rows and one MERGE ... OUTPUT
+        updates breaks in place, inserts new rows and captures the superseded values for the archive table.
+        Only df and the worse-source backup rows cross the network.
+        Differences to the pandas path: breaks keep their row id (they are updated, not deleted and re-inserted),
+        and duplicate keys in df are loaded once (MERGE only allows one source row per target row)
+
+    Parameters
+    ---------
+    spec : str or dict
+        a key of RECONCILE_SPECS (the table name) or a spec dict with merge_mode set
+    source : str
+        the name of the source of the data
+    df : dataframe
+        the source's data
+    better_sources : list
+        sources we would NOT want to overwrite
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+
+    Returns
+    -------
+    result : dict
+        'spec', 'source', 'backup' (the worse-source rows removed) and 'counts' as in plan_reconciliation
+    """
+    import logging
+    import pandas as pd
+    from sqlalchemy import bindparam, text
+    LOGGER = logging.getLogger(__name__)
+
+    spec = _get_spec(spec)
+    if not spec.get('merge_mode'):
+        raise ValueError(str(spec['table'])+' cannot be loaded with a server-side merge')
+    if not get_backend(_connectable(engine, connection))['temp_tables']:
+        raise ValueError("""mode 'merge' needs sql server """)
+    df = _prepare_frame(spec, df, better_sources)
+
+    table = _check_identifier(spec['table'])
+    archive_table = _check_identifier(spec['archive_table']) if spec['archive_table'] is not None else None
+    row_id = _check_identifier(spec['row_id'])
+    src = _check_identifier(spec['source_column'])
+    keys = [_check_identifier(col) for col in spec['keys']]
+    values = [_check_identifier(col) for col in spec['value_columns']]
+    optional = [col for col in spec['optional_columns'] if col in df.columns]
+    stage_cols = keys+values+optional
+    archive_cols = keys+[col for col in spec['columns'] if col not in keys]
+    blend = 'f.'+_check_identifier(spec['blend_flag']) if spec['blend_flag'] else '0'
+
+    # MERGE allows one source row per target row
+    stage = df.drop_duplicates(subset=keys, keep='first')
+    on = ' AND '.join('t.'+col+' = s.'+col for col in keys)
+    if spec['nulls_equal']:
+        differs = ' OR '.join('t.'+col+' <> s.'+col+' OR (t.'+col+' IS NULL AND s.'+col+' IS NOT NULL)'
+                              ' OR (t.'+col+' IS NOT NULL AND s.'+col+' IS NULL)' for col in values)
+    else:
+        differs = ' OR '.join('t.'+col+' <> s.'+col+' OR t.'+col+' IS NULL OR s.'+col+' IS NULL' for col in values)
+    not_better = '(t.'+src+' IS NULL OR t.'+src+' NOT IN :better)'
+    own_source = ' AND (l.blend = 0 OR t.'+src+' IS NULL OR t.'+src+' <> :source)' \
+        if spec['blend_keeps_own_source'] else ''
+    superseded = '(SELECT row_id FROM #sc_merge_worse UNION ALL SELECT row_id FROM #sc_merge_breaks)'
+
+    def params(statement):
+        if ':better' not in statement:
+            return text(statement)
+        return text(statement).bindparams(bindparam('better', expanding=True))
+
+    binds = {'source': source, 'better': list(better_sources)}
+    temp_tables = ['#sc_merge_stage', '#sc_merge_funds', '#sc_merge_worse', '#sc_merge_load',
+                   '#sc_merge_breaks', '#sc_merge_output']
+    with _begin(engine, connection) as conn:
+        with span('stage', rows=len(stage.index)):
+            _stage_frame(conn, stage, '#sc_merge_stage', {col: spec['column_types'][col] for col in stage_cols})
+        for temp_table in temp_tables[1:]:
+            conn.exec_driver_sql("IF OBJECT_ID('tempdb.."+temp_table+"') IS NOT NULL DROP TABLE "+temp_table)
+        with span('eligibility', input_rows=len(df.index)):
+            # the incoming funds, their blend flag and whether they are mapped (live, non-shareclass) to the source
+            conn.execute(params(
+                'SELECT f.id, '+blend+' AS blend, '
+                'CASE WHEN EXISTS (SELECT 1 FROM external_entity_mapping m WHERE m.id = f.id '
+                "AND m.mapping_status = 'Live' AND m.is_shareclass = 0 AND m.external_source = :source) "
+                'THEN 1 ELSE 0 END AS mapped '
+                'INTO #sc_merge_funds FROM funds f WHERE f.id IN (SELECT DISTINCT id FROM #sc_merge_stage)'), binds)
+            # rows of worse sources for non-blended funds the source can't load directly
+            # (not mapped, or another source already has data)
+            conn.execute(params(
+                'SELECT t.'+row_id+' AS row_id INTO #sc_merge_worse '
+                'FROM '+table+' t JOIN #sc_merge_funds f ON f.id = t.id '
+                'WHERE f.blend = 0 AND NOT (f.mapped = 1 AND NOT EXISTS (SELECT 1 FROM '+table+' o '
+                'WHERE o.id = f.id AND o.'+src+' IS NOT NULL AND o.'+src+' <> :source)) '
+                'AND '+not_better), binds)
+            # funds we load: blended mapped funds, and non-blended mapped funds with no other source's data
+            # once the worse rows are gone
+            conn.execute(params(
+                'SELECT f.id, f.blend INTO #sc_merge_load FROM #sc_merge_funds f '
+                'WHERE f.mapped = 1 AND (f.blend = 1 OR (f.blend = 0 AND NOT EXISTS (SELECT 1 FROM '+table+' o '
+                'WHERE o.id = f.id AND o.'+src+' IS NOT NULL AND o.'+src+' <> :source '
+                'AND o.'+row_id+' NOT IN (SELECT row_id FROM #sc_merge_worse))))'), binds)
+        # existing rows of the same or worse sources whose values differ
+        with span('diff'):
+            conn.execute(params(
+                'SELECT t.'+row_id+' AS row_id INTO #sc_merge_breaks '
+                'FROM #sc_merge_stage s JOIN #sc_merge_load l ON l.id = s.id JOIN '+table+' t ON '+on+' '
+                'WHERE '+not_better+' AND ('+differs+')'+own_source+' '
+                'AND t.'+row_id+' NOT IN (SELECT row_id FROM #sc_merge_worse)'), binds)
+
+        backup = pd.read_sql_query('SELECT '+', '.join('t.'+col for col in archive_cols+[row_id]) +
+                                   ' FROM '+table+' t JOIN #sc_merge_worse w ON w.row_id = t.'+row_id, conn)
+        archive_replaced = 0
+        if archive_table is not None:
+            with span('archive') as s:
+                # archived rows replace any older archived copy of the same keys and source
+                archive_replaced = conn.exec_driver_sql(
+                    'DELETE a FROM '+archive_table+' a JOIN '+table+' t ON ' +
+                    ' AND '.join('a.'+col+' = t.'+col for col in keys+[src]) +
+                    ' WHERE t.'+row_id+' IN '+superseded).rowcount
+                s['replaced'] = archive_replaced
+        output = ' OUTPUT '+', '.join('deleted.'+col for col in archive_cols) + \
+            ' INTO '+archive_table+' ('+', '.join(archive_cols)+')' if archive_table is not None else ''
+        with span('delete') as s:
+            inferior = conn.exec_driver_sql(
+                'DELETE t'+output+' FROM '+table+' t JOIN #sc_merge_worse w ON w.row_id = t.'+row_id).rowcount
+            s['rows'] = inferior
+
+        with span('merge', rows=len(stage.index)) as s:
+            conn.exec_driver_sql('CREATE TABLE #sc_merge_output (merge_action NVARCHAR(10), ' +
+                                 ', '.join(col+' '+spec['column_types'][col] for col in archive_cols)+')')
+            set_cols = values+optional
+            conn.execute(text(
+                'MERGE '+table+' AS t '
+                'USING (SELECT s.* FROM #sc_merge_stage s JOIN #sc_merge_load l ON l.id = s.id) AS s ON '+on+' '
+                'WHEN MATCHED AND t.'+row_id+' IN (SELECT row_id FROM #sc_merge_breaks) THEN UPDATE SET ' +
+                ', '.join('t.'+col+' = s.'+col for col in set_cols)+', t.'+src+' = :source '
+                'WHEN NOT MATCHED BY TARGET THEN INSERT ('+', '.join(stage_cols+[src])+') '
+                'VALUES ('+', '.join('s.'+col for col in stage_cols)+', :source) '
+                'OUTPUT $action, '+', '.join('deleted.'+col for col in archive_cols) +
+                ' INTO #sc_merge_output (merge_action, '+', '.join(archive_cols)+');'), binds)
+            if archive_table is not None:
+                conn.exec_driver_sql('INSERT INTO '+archive_table+' ('+', '.join(archive_cols)+') SELECT ' +
+                                     ', '.join(archive_cols)+" FROM #sc_merge_output WHERE merge_action = 'UPDATE'")
+            actions = dict(conn.exec_driver_sql('SELECT merge_action, COUNT(*) FROM #sc_merge_output '
+                                                'GROUP BY merge_action').fetchall())
+            s.update(inserted=actions.get('INSERT', 0), updated=actions.get('UPDATE', 0))
+        for temp_table in temp_tables:
+            conn.exec_driver_sql('DROP TABLE '+temp_table)
+
+    if actions.get('UPDATE', 0) > 0:
+        _replica_merged(spec['table'])
+    counts = {'inferior': inferior,
+              'new': actions.get('INSERT', 0),
+              'breaks': actions.get('UPDATE', 0),
+              'archive replaced': archive_replaced}
+    LOGGER.info('   '+str(counts['inferior'])+' inferior rows of '+table+' sources deleted from '+table)
+    LOGGER.info('   '+str(counts['new'])+' new rows inserted to '+table)
+    LOGGER.info('   '+str(counts['breaks'])+' rows updated in '+table)
+    if archive_table is not None:
+        LOGGER.info('   '+str(counts['inferior']+counts['breaks']) +
+                    ' superseded rows moved to '+archive_table+', replacing '+str(archive_replaced))
+    return {'spec': spec,
+            'source': source,
+            'backup': backup,
+            'counts': counts}
+
+
+def reconcile(spec, source, df, better_sources, engine=None, connection=None, mode='pandas'):
+    """
+    Loads a source's data into a table following the source hierarchy (see plan_reconciliation),
+    writing the worse-source backup file if the spec has one
+
+    Parameters
+    ---------
+    spec : str or dict
+        a key of RECONCILE_SPECS (the table name) or a spec dict
+    source : str
+        the name of the source of the data
+    df : dataframe or iterator of dataframes
+        the source's data. an iterator of chunks is reconciled one chunk at a time (see reconcile_chunks)
+    better_sources : list
+        sources we would NOT want to overwrite
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+    mode : str
+        'pandas' diffs a snapshot of the existing rows in memory (plan_reconciliation/apply_reconciliation)
+        'merge' runs the whole load on the server (merge_reconciliation), for tables whose spec has merge_mode set
+
+    Returns
+    -------
+    plan : dict
+        the plan that was applied (for 'merge', the result of merge_reconciliation)
+        for an iterator of chunks, the summary returned by reconcile_chunks
+    """
+    import logging
+    import uuid
+    from datetime import datetime
+    import pandas as pd
+    LOGGER = logging.getLogger(__name__)
+
+    spec = _get_spec(spec)
+    if mode not in ('pandas', 'merge'):
+        raise ValueError("""'mode' must be 'pandas' or 'merge' """)
+    if not isinstance(df, pd.DataFrame):
+        return reconcile_chunks(spec, source, df, better_sources, engine, connection, mode=mode)
+    LOGGER.info('starting process to update '+spec['table']+' from '+source)
+    # every span of this run (see set_span_sink) and every profiled statement carries one run id
+    run_id = uuid.uuid4().hex
+    run_at = datetime.now()
+    try:
+        with span_context(table=spec['table'], source=source, run_id=run_id, mode=mode), \
+                span('reconcile', input_rows=len(df.index)) as s:
+            if mode == 'merge':
+                plan = merge_reconciliation(spec, source, df, better_sources, engine, connection)
+            else:
+                plan = plan_reconciliation(spec, source, df, better_sources, engine, connection)
+            if spec['backup_suffix'] is not None:
+                with span('backup', rows=len(plan['backup'].index)):
+                    if not _save_backup(spec, source, plan['backup'], run_id, run_at):
+                        plan['backup'].to_csv(source+spec['backup_suffix'])
+            if mode == 'pandas':
+                apply_reconciliation(plan, engine, connection)
+            s.update(plan['counts'])
+    finally:
+        _profile_report(run_id, spec['table']+'_'+source)
+    LOGGER.info('finished process to update '+spec['table']+' from '+source)
+    return plan
+
+
+def partition_by_fund(chunks, id_column='id'):
     """
-    Deletes a list of records from a given database table, given a column name
-        Validates the data to add proper quotations based on the first item in the list
-        Also checks to see how many records are being deleted and will batch delete if necessary
+    Re-cuts an iterator of dataframe chunks so that every fund's rows end up in exactly one chunk
+        The input must have each fund's rows next to each other (e.g. a file sorted by id read with
+        pd.read_csv(..., chunksize=n)). The rows of the last fund in a chunk are held back and
+        prepended to the next chunk, so memory stays bounded by the chunk size plus one fund
 
     Parameters
     ---------
-    list_to_delete : list
-        a list of items, each denoting one row, that will be deleted
-        each item in the list should be one unique row
-    table_name: string
-        the name of the table to delete from
-    delete_column_name: string
-        the name of the column in <table_name> to delete the items from <list_to_delete>
+    chunks : iterator of dataframes
+        the chunks to re-cut
+    id_column : str
+        the fund id column
 
     Returns
     -------
-
+    chunks : generator of dataframes
     """
-    from sqlalchemy.engine import URL
-    from sqlalchemy import create_engine
-    from math import ceil
-    from pyodbc import connect
     import pandas as pd
-    from os import environ
-    connection_string = "Driver={SQL Server};" + \
-        f"Server={environ['DASH_AZURE_DB_SERVER']};Database={environ['DASH_SC_DB_NAME']};UID={environ['DASH_AZURE_DB_RW_USER']};PWD={environ['DASH_AZURE_DB_RW_USER_PWD']}"
-    connection_url = URL.create(
-        "mssql+pyodbc", query={"odbc_connect": connection_string})
-    engine = create_engine(connection_url)
-    conn = connect(connection_string)
-    cursor = conn.cursor()
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if len(chunk.index) == 0:
+            carry = chunk
+            continue
+        last_id = chunk[id_column].iloc[-1]
+        is_last = (chunk[id_column] == last_id).to_numpy()
+        carry = chunk[is_last]
+        if not is_last.all():
+            yield chunk[~is_last].reset_index(drop=True)
+    if carry is not None and len(carry.index) > 0:
+        yield carry.reset_index(drop=True)
+
+
+def reconcile_chunks(spec, source, chunks, better_sources, engine=None, connection=None, mode='pandas'):
+    """
+    Runs reconcile on each chunk of a source's data in turn, so peak memory is bounded by the chunk size
+        Every chunk reads the existing rows of only its own funds, and its archive moves, deletes and inserts are
+        written before the next chunk is read. Chunks must be partitioned by fund id (a fund's rows all in one chunk,
+        see partition_by_fund), otherwise a fund's eligibility would be decided on part of its data,
+        so a fund id turning up in a second chunk raises a ValueError
 
+    Parameters
+    ---------
+    spec : str or dict
+        a key of RECONCILE_SPECS (the table name) or a spec dict
+    source : str
+        the name of the source of the data
+    chunks : iterator of dataframes
+        the source's data, partitioned by fund id
+    better_sources : list
+        sources we would NOT want to overwrite
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+    mode : str
+        'pandas' or 'merge', see reconcile
+
+    Returns
+    -------
+    summary : dict
+        'spec', 'source', 'chunks' (number of chunks) and 'counts' (the counts of every chunk added up)
+    """
     import logging
+    import uuid
+    from datetime import datetime
     LOGGER = logging.getLogger(__name__)
 
-    if type(list_to_delete) is not list:
-        raise ValueError("""'list_to_delete' must be of type list """)
-    # get initial record count
-    beg_no_records_df = pd.read_sql_query(
-        """select count("""+delete_column_name+""") as ct from """+table_name, engine)
-    no_records = beg_no_records_df.loc[0, 'ct']
-    if len(list_to_delete) > 0:
-        # the database can only delete 2090 records in one go
-        # if number of records>2090, we have to beak it up
-        if len(list_to_delete) > 2090:
-            LOGGER.info('need to batch delete to accomodate database limits')
-            num_iterations = ceil(len(list_to_delete)/2090)
-            for i in range(num_iterations):
-                LOGGER.info('deleting rows '+str(i*2090)+' to ' +
-                            str(min(2090*(i+1), len(list_to_delete))))
-                sub_list_to_delete = list_to_delete[2090*(i):2090*(i+1)]
-                if type(sub_list_to_delete[0]) == str:
-                    # we only check the first element because sql ensures constant datatypes
-                    sub_list_to_delete = "','".join(
-                        (map(str, sub_list_to_delete)))
-                    sub_list_to_delete = "'"+sub_list_to_delete+"'"
-                else:
-                    sub_list_to_delete = ','.join(
-                        (map(str, sub_list_to_delete)))
-                sub_list_to_delete = '('+sub_list_to_delete+')'
-                cursor.execute(''' DELETE FROM '''+table_name+''' where ''' +
-                               delete_column_name+''' in '''+sub_list_to_delete)
+    spec = _get_spec(spec)
+    seen = set()
+    counts = {}
+    num_chunks = 0
+    backup_path = source+spec['backup_suffix'] if spec['backup_suffix'] is not None else None
+    # with a backup store every chunk's backup is a part of one run
+    run_id, run_at = uuid.uuid4().hex, datetime.now()
+    for chunk in chunks:
+        chunk_ids = set(chunk['id'].dropna().unique().tolist())
+        repeated = chunk_ids & seen
+        if len(repeated) > 0:
+            raise ValueError('chunks must be partitioned by fund id, ids found in more than one chunk: ' +
+                             str(sorted(repeated)[:10]))
+        seen |= chunk_ids
+        LOGGER.info('reconciling chunk '+str(num_chunks+1)+' of '+spec['table']+' from '+source +
+                    ' ('+str(len(chunk.index))+' rows)')
+        chunk_spec = dict(spec, backup_suffix=None)
+        plan = reconcile(chunk_spec, source, chunk, better_sources, engine, connection, mode=mode)
+        if backup_path is not None:
+            stored = _save_backup(spec, source, plan['backup'], run_id, run_at, part=num_chunks+1)
+            if not stored:
+                # one backup file for the whole run, appended chunk by chunk
+                plan['backup'].to_csv(backup_path, mode='w' if num_chunks == 0 else 'a', header=num_chunks == 0)
+        for key, value in plan['counts'].items():
+            counts[key] = counts.get(key, 0)+value
+        num_chunks += 1
+        del plan
+    # with no chunks the previous run's backup file is left as it is, only a written chunk replaces it
+    LOGGER.info('finished '+str(num_chunks)+' chunks of '+spec['table']+' from '+source+': '+str(counts))
+    return {'spec': spec,
+            'source': source,
+            'chunks': num_chunks,
+            'counts': counts}
+
+
+@contextmanager
+def _fund_locks(table_name, fund_ids, engine=None, lock=None, lock_timeout=600):
+    """
+    Holds an exclusive lock on each fund id of a table, taken in sorted order so two runs never deadlock
+        None takes no lock
+        'app' uses session sp_getapplock locks on a dedicated connection (serializes every process on the database),
+        acquired and released in batches of one statement per parameter-limit worth of funds.
+        Databases without them (no temp tables, e.g. a local sqlite or duckdb copy) take no lock either
+    """
+    from sqlalchemy import text
+    if lock is None:
+        yield
+        return
+    if not get_backend(get_engine(engine))['temp_tables']:
+        LOGGER.warning('no application locks on '+get_engine(engine).dialect.name+', '+table_name +
+                       ' funds are loaded without a lock')
+        yield
+        return
+    resources = ['sc_py:'+table_name+':'+str(fund_id) for fund_id in sorted(convert_id(f) for f in fund_ids)]
+    batch_size = get_backend(get_engine(engine))['param_limit']-1
+    with get_engine(engine).connect() as conn:
+        held = []
+        try:
+            for start in range(0, len(resources), batch_size):
+                batch = resources[start:start+batch_size]
+                # stops at the first lock it can't get, returning how many it got and that lock's result
+                sql = 'SET NOCOUNT ON; DECLARE @result INT = 0, @acquired INT = 0; ' + ''.join(
+                    "EXEC @result = sp_getapplock @Resource = :r"+str(i)+", @LockMode = 'Exclusive', "
+                    "@LockOwner = 'Session', @LockTimeout = :timeout; IF @result < 0 GOTO done; "
+                    "SET @acquired = "+str(i+1)+"; " for i in range(len(batch))) + 'done: SELECT @acquired, @result'
+                params = dict({'r'+str(i): resource for i, resource in enumerate(batch)},
+                              timeout=int(lock_timeout*1000))
+                acquired, result = conn.execute(text(sql), params).fetchone()
                 conn.commit()
-
-        elif len(list_to_delete) > 0:
-            if type(list_to_delete[0]) == str:
-                # we only check the first element because sql ensures constant datatypes
-                temp_list_to_delete = "','".join((map(str, list_to_delete)))
-                temp_list_to_delete = "'"+temp_list_to_delete+"'"
-            else:
-                temp_list_to_delete = ','.join((map(str, list_to_delete)))
-            temp_list_to_delete = '('+temp_list_to_delete+')'
-            cursor.execute(''' DELETE FROM '''+table_name+''' where ''' +
-                           delete_column_name+''' in '''+temp_list_to_delete)
+                held.extend(batch[:acquired])
+                if acquired < len(batch):
+                    raise TimeoutError('could not get application lock: '+batch[acquired]+' ('+str(result)+')')
+            yield
+        finally:
+            for start in range(0, len(held), batch_size):
+                batch = held[start:start+batch_size]
+                conn.execute(text(''.join("EXEC sp_releaseapplock @Resource = :r"+str(i)+", @LockOwner = 'Session'; "
+                                          for i in range(len(batch)))),
+                             {'r'+str(i): resource for i, resource in enumerate(batch)})
             conn.commit()
-        # get updated record count
-        end_no_records_df = pd.read_sql_query(
-            """select count("""+delete_column_name+""") as ct from """+table_name, engine)
-        end_no_records = end_no_records_df.loc[0, 'ct']
-        LOGGER.info('deleted '+str(no_records-end_no_records)+' number of records from table: ' +
-                    table_name+', based on column: ' + delete_column_name)
-    else:
-        LOGGER.info('no records to delete from: '+table_name)
 
 
-def adj_dataframe(df):
+def run_sources(spec, frames, hierarchy, engine=None, max_workers=4, lock=None, lock_timeout=600,
+                **reconcile_kwargs):
     """
-    Ensures that a dataframes columns are consistent for merging and for sql datatypes
+    Loads several sources' data into one table, running sources that touch different funds at the same time
+        Each source's better_sources are the sources ranked above it in <hierarchy>.
+        Sources are grouped by shared fund ids: a group runs its sources one after another, best ranked first
+        (so worse sources never write rows that are deleted again a moment later), and groups run concurrently
+        on a thread pool. Groups never share a fund, so they need no lock between them; with lock='app' each group
+        also holds a database application lock on every fund it touches, so another job loading the same funds
+        (also with lock='app') waits for it
 
     Parameters
     ---------
-    df : dataframe
-        a dataframe whose columns you want to adjust
+    spec : str or dict
+        a key of RECONCILE_SPECS (the table name) or a spec dict
+    frames : dict
+        {source name: dataframe of that source's data}
+    hierarchy : list
+        every source, best first, e.g. ['manual', 'albourne', 'hfr']. may include sources not in frames
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine. its pool should allow max_workers connections
+    max_workers : int
+        number of groups run at the same time
+    lock : str or None
+        'app' for sql server application locks on each fund (no lock on other databases),
+        None (the default) for no locking
+    lock_timeout : float
+        seconds to wait for each lock
+    reconcile_kwargs :
+        passed on to reconcile (e.g. mode='merge')
 
     Returns
-    df : dataframe
-        a dataframe with adjusted columns
     -------
-
+    plans : dict
+        {source name: the plan returned by reconcile}
     """
-    def convert_id(row):
-        try:
-            new_id = int(float(row))
-        except:
-            new_id = row
-        return new_id
-
-    import numpy as np
-    import pandas as pd
-    df = df.replace('NaN', np.nan)
-    df = df.fillna(value=np.nan)
-    for col in df.columns:
-        if col in ['asof_date', 'Date', 'date', 'dates']:
-            df[col] = pd.to_datetime(df[col])
-        if col in ['id', 'external_id', 'fundId', 'Fund_ID', 'Index_ID', 'external_strategy_id', 'strategy_code', 'strategy_fund_id', 'Fund ID', 'Firm_ID', 'Firm ID', 'ret_ts_id', 'aum_ts_id', 'id_record_number', 'risk_ts_id']:
-            try:
-                df[col] = df[col].apply(int)
+    from concurrent.futures import ThreadPoolExecutor
 
-            # if there are np.nan's in the column, apply(int) fails - this is a workaround
-            except:
-                df[col] = df[col].astype('object')
+    import logging
+    LOGGER = logging.getLogger(__name__)
 
-            for index, row in df.iterrows():
-                df.loc[index, col] = convert_id(df.loc[index, col])
-    return df
+    spec = _get_spec(spec)
+    if type(hierarchy) is not list:
+        raise ValueError("""'hierarchy' must be of type list """)
+    for source in frames:
+        if source not in hierarchy:
+            raise ValueError(source+' must be in hierarchy')
+    if lock not in ['app', None]:
+        raise ValueError("""lock must be 'app' or None """)
+
+    ids = {source: set(frames[source]['id'].dropna().unique().tolist()) for source in frames}
+    # group sources that share any fund
+    groups = []
+    for source in sorted(frames, key=hierarchy.index):
+        overlapping = [group for group in groups if any(ids[source] & ids[member] for member in group)]
+        groups = [group for group in groups if group not in overlapping]
+        groups.append(sorted([member for group in overlapping for member in group]+[source], key=hierarchy.index))
+    LOGGER.info('running '+str(len(frames))+' sources of '+spec['table']+' in '+str(len(groups)) +
+                ' independent group(s): '+'; '.join(', '.join(group) for group in groups))
+
+    def run_group(group):
+        fund_ids = {fund_id for source in group for fund_id in ids[source]}
+        plans = {}
+        with _fund_locks(spec['table'], fund_ids, engine, lock, lock_timeout):
+            for source in group:
+                plans[source] = reconcile(spec, source, frames[source], hierarchy[:hierarchy.index(source)],
+                                          engine=engine, **reconcile_kwargs)
+        return plans
+
+    plans = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [(group, pool.submit(run_group, group)) for group in groups]
+        for group, future in futures:
+            try:
+                plans.update(future.result())
+            except Exception as e:
+                LOGGER.error('failed to load '+', '.join(group)+' to '+spec['table']+': '+str(e))
+                errors.append(e)
+    if len(errors) > 0:
+        raise errors[0]
+    return plans
 
 
-def get_assets(source, aum_df, better_sources):
+def get_assets(source, aum_df, better_sources, engine=None, connection=None, mode='pandas'):
     """
     Runs the process to update AUMs given database logic
     Parameters
     ---------
     source : str
         source in question
-    aum_df: dataframe
+    aum_df: dataframe or iterator of dataframes
         dataframe of AUM values with corresponding asof_dates and internal IDs
         the asset_values here will all be in USD
+        can also be an iterator of chunks partitioned by fund id, which are reconciled one at a time
+        (e.g. partition_by_fund(pd.read_csv(path, chunksize=500000)) on a file sorted by id)
     better_sources : list
         list where each element is a better source (one you would not want to overwrite) from aum_df
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine, e.g. to reuse one warm pool for a whole job
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+    mode : str
+        'pandas' (default) diffs the existing rows in memory, 'merge' stages aum_df and runs the whole load
+        on the server with one set-based MERGE (see merge_reconciliation)
 
     Returns
     -------
 
     """
+    reconcile('aum_ts', source, aum_df, better_sources, engine, connection, mode=mode)
 
-    import pandas as pd
-    import numpy as np
-    from sqlalchemy.engine import URL
-    from sqlalchemy import create_engine
-    from sc_py import sc_fxns as sc
-
-    from os import environ
-    connection_string = "Driver={SQL Server};" + \
-        f"Server={environ['DASH_AZURE_DB_SERVER']};Database={environ['DASH_SC_DB_NAME']};UID={environ['DASH_AZURE_DB_RW_USER']};PWD={environ['DASH_AZURE_DB_RW_USER_PWD']}"
-    connection_url = URL.create(
-        "mssql+pyodbc", query={"odbc_connect": connection_string})
-    engine = create_engine(connection_url)
-
-    import logging
-    LOGGER = logging.getLogger(__name__)
-
-    if type(better_sources) is not list:
-        raise ValueError("""'better_sources' must be of type list """)
-    if 'id' not in aum_df.columns.to_list():
-        raise ValueError("""id must be a column in aum_df """)
-    if 'asset_value' not in aum_df.columns.to_list():
-        raise ValueError("""asset_value must be a column in aum_df """)
-    if 'asof_date' not in aum_df.columns.to_list():
-        raise ValueError("""asof_date must be a column in aum_df """)
-    if 'source' not in aum_df.columns.to_list():
-        raise ValueError("""source must be a column in aum_df """)
-
-    quote_char = "'"
-    ids = pd.read_sql_query("""
-    select e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have an AUM source
-        select id from funds where id not in (select id from aum_ts)
-        UNION
-        --query funds that only use given source for AUMs
-        select id from aum_ts where source="""+quote_char+source+quote_char+"""
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+quote_char+source+quote_char+"""
-    and f.blend_aums=0
-    and f.id not in (
-        select id from aum_ts where source!="""+quote_char+source+quote_char+""")
-                            """, engine, dtype={'id': np.int64})
-    # check to only update funds with existing AUMs from given source or missing AUMs
-    assets_id = aum_df[aum_df['id'].isin(ids['id'].to_list())]
-    assets_id = assets_id.reset_index(drop=True)
-
-    db = pd.read_sql_query('SELECT * FROM aum_ts ',
-                           engine,
-                           dtype={'id': np.int64, 'aum_ts_id': np.int64},
-                           parse_dates=['asof_date'])
-
-    # check which internal IDs are in the aum_df but not in the list of funds whose aums we should be updating
-    # these are funds with other sources in the database
-    # strip out sources that are higher in our hierarchy
-    # filter out funds with blended aums
-    # then delete the aums of funds with non-blended aums
-    other_sources = list(aum_df[~aum_df['id'].isin(ids['id'])]['id'].unique())
-    fund_check = pd.read_sql_query("""select * from funds""",
-                                   engine,
-                                   dtype={'id': np.int64, })
-    fund_check = fund_check[fund_check['id'].isin(other_sources)]
-    funds_to_delete = fund_check[fund_check['blend_aums'] == 0]
-    worse_aums = funds_to_delete.merge(
-        db, how='left', on=['id'], suffixes=('', ' existing'))
-    worse_aums = worse_aums[~worse_aums['source'].isin(better_sources)]
-
-    worse_aums = worse_aums[['id', 'asof_date',
-                             'asset_value', 'source', 'aum_ts_id']]
-    worse_aums.to_csv(source+"_aum_backup.csv")
-
-    # current process is to move old aums out of the primary aums database (aumss_ts) and into old_aum_ts
-    # we do this as a backup in case any funds aums need to be restored
-    # this only has to be done on the breaks df because that represents the aums we're about to delete
-    old_upload = worse_aums.copy()
-    # to avoid confusion with which ts_id to delete
-    old_upload = old_upload.drop(columns='aum_ts_id')
-
-    if len(old_upload['id']) > 0:
-        db_old = pd.read_sql_query('SELECT * FROM old_aum_ts',
-                                   engine, dtype={'id': np.int64,
-                                                  'aum_ts_id': np.int64},
-                                   parse_dates=['asof_date'])
-        # merge on source here to ensure we are retaining records from various sources in case we need to fallback
-        old_upload = old_upload.merge(db_old,
-                                      how='left',
-                                      on=['id', 'asof_date', 'source'],
-                                      suffixes=('', ' existing'))
-        # get new records to insert to old_aum_ts
-        old_new_records = old_upload[old_upload['aum_ts_id'].isnull()]
-        # get records to delete from old_aum_ts
-        old_delete_records = old_upload[~old_upload['aum_ts_id'].isnull()]
-        # delete the old records
-        old_to_delete = old_delete_records['aum_ts_id'].to_list()
-        sc.batch_delete(old_to_delete, 'old_aum_ts', 'aum_ts_id')
-        old_upload_combo = pd.concat([old_new_records, old_delete_records])
-        old_upload_combo = old_upload_combo[[
-            'id', 'asof_date', 'asset_value', 'source']]
-        # index=False prevents failure on trying to insert the index column
-        old_upload_combo.to_sql('old_aum_ts', engine,
-                                if_exists='append', index=False)
-        LOGGER.info(str(len(old_new_records['id'])) +
-                    ' new rows inserted to old_aum_ts')
-        LOGGER.info(str(len(old_delete_records['id'])) +
-                    ' rows deleted and updated to old_aum_ts')
-    else:
-        LOGGER.info('no records to move to old_aum_ts')
-
-    # delete the old records
-    to_delete = worse_aums['aum_ts_id'].to_list()
-    sc.batch_delete(to_delete, 'aum_ts', 'aum_ts_id')
-
-    LOGGER.info(str(len(worse_aums['aum_ts_id'])) +
-                ' rows of inferior aum sources deleted from aum_ts')
-
-    ids = pd.read_sql_query("""
-    select e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have an AUM source
-        select id from funds where id not in (select id from aum_ts)
-        UNION
-        --query funds that only use given source for AUMs
-        select id from aum_ts where source="""+quote_char+source+quote_char+"""
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+quote_char+source+quote_char+"""
-    and f.blend_aums=0
-    and f.id not in (
-        select id from aum_ts where source!="""+quote_char+source+quote_char+""")
-    """, engine, dtype={'id': np.int64})
-    # check to only update funds with existing source's AUMs or missing AUMs
-    assets_id = aum_df[aum_df['id'].isin(ids['id'].to_list())]
-    assets_id = assets_id.reset_index(drop=True)
-
-    db = pd.read_sql_query('SELECT * FROM aum_ts',
-                           engine,
-                           dtype={'id': np.int64, 'aum_ts_id': np.int64},
-                           parse_dates=['asof_date'])
-
-    merge_df = assets_id.merge(db, how='left',
-                               on=['id', 'asof_date'],
-                               suffixes=('', ' existing'))
-
-    merge_df = merge_df[~merge_df['source existing'].isin(better_sources)]
-    new = merge_df[merge_df['aum_ts_id'].isnull()]
-    breaks = merge_df[~merge_df['aum_ts_id'].isnull()]
-    breaks = breaks[breaks['asset_value'] != breaks['asset_value existing']]
-
-    # create dataframe to move old 'break' records to old_aum_ts
-    old_upload = breaks[['id',
-                         'asof_date',
-                        'asset_value existing',
-                         'source existing']].rename(columns={'asset_value existing': 'asset_value',
-                                                             'source existing': 'source'})
-    if len(old_upload['id']) > 0:
-        db_old = pd.read_sql_query('SELECT * FROM old_aum_ts',
-                                   engine,
-                                   dtype={'id': np.int64,
-                                          'aum_ts_id': np.int64},
-                                   parse_dates=['asof_date'])
-
-        old_upload = old_upload.merge(db_old,
-                                      on=['id', 'asof_date', 'source'],
-                                      suffixes=('', ' existing'))
-        # get new records to insert to old_aum_ts
-        old_new_records = old_upload[old_upload['aum_ts_id'].isnull()]
-        # get records to delete from old_aum_ts
-        old_delete_records = old_upload[~old_upload['aum_ts_id'].isnull()]
-
-        # delete the old records
-        old_to_delete = old_delete_records['aum_ts_id'].to_list()
-        sc.batch_delete(old_to_delete, 'old_aum_ts', 'aum_ts_id')
-
-        old_upload = pd.concat([old_upload, old_delete_records])
-        old_upload = old_upload[['id', 'asof_date', 'asset_value', 'source']]
-        # index=False prevents failure on trying to insert the index column
-        old_upload.to_sql('old_aum_ts', engine,
-                          if_exists='append', index=False)
-        LOGGER.info(str(len(old_upload['id'])) +
-                    ' new rows inserted to old_aum_ts')
-        LOGGER.info(str(len(old_delete_records['id'])) +
-                    ' rows deleted and updated to old_aum_ts')
-    else:
-        LOGGER.info('no records to move to old_aum_ts')
-
-    to_delete = breaks['aum_ts_id'].to_list()
-    # delete the old records
-    sc.batch_delete(to_delete, 'aum_ts', 'aum_ts_id')
-
-    upload = pd.concat([new, breaks])
-    upload.loc[:, 'source'] = source
-
-    upload = upload[['id', 'asof_date', 'asset_value', 'source']]
-    # index=False prevents failure on trying to insert the index column
-    upload.to_sql('aum_ts', engine, if_exists='append', index=False)
-    LOGGER.info(str(len(upload['id']))+' rows deleted and updated')
-
-    # query funds with blended AUMs allowed
-    blend_ids = pd.read_sql_query("""
-    select e.id,e.external_id 
-    from external_entity_mapping e 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+quote_char+source+quote_char+"""
-    and f.blend_aums=1""", engine, dtype={'id': np.int64})
-    blend_aums = aum_df[aum_df['id'].isin(blend_ids['id'].to_list())]
-    blend_aums = blend_aums.reset_index(drop=True)
-
-    db_blend = pd.read_sql_query('SELECT * FROM aum_ts',
-                                 engine,
-                                 dtype={'id': np.int64, 'aum_ts_id': np.int64},
-                                 parse_dates=['asof_date'])
-
-    merge_blend_df = blend_aums.merge(db_blend,
-                                      how='left',
-                                      on=['id', 'asof_date'],
-                                      suffixes=('', ' existing'))
-    # filter our better sources
-    merge_blend_df = merge_blend_df[~merge_blend_df['source existing'].isin(
-        better_sources)]
-
-    blend_new = merge_blend_df[merge_blend_df['aum_ts_id'].isnull()]
-    blend_breaks = merge_blend_df[~merge_blend_df['aum_ts_id'].isnull()]
-    blend_breaks = blend_breaks[blend_breaks['asset_value']
-                                != blend_breaks['asset_value existing']]
-    # we dont want to overwrite given source's aums
-    blend_breaks = blend_breaks[blend_breaks['source existing'] != source]
-
-    old_blend_upload = blend_breaks[['id',
-                                     'asof_date',
-                                    'asset_value existing',
-                                     'source existing']].rename(columns={'asset_value existing': 'asset_value',
-                                                                         'source existing': 'source'})
-
-    if len(old_blend_upload['id']) > 0:
-        db_blend_old = pd.read_sql_query('SELECT * FROM old_aum_ts',
-                                         engine,
-                                         dtype={'id': np.int64,
-                                                'aum_ts_id': np.int64},
-                                         parse_dates=['asof_date'])
-
-        old_blend_upload = old_upload.merge(db_blend_old,
-                                            on=['id', 'asof_date', 'source'],
-                                            suffixes=('', ' existing'))
-        # get new records to insert to old_aum_ts
-        old_blend_new_records = old_blend_upload[old_blend_upload['aum_ts_id'].isnull(
-        )]
-        # get records to delete from old_aum_ts
-        old_blend_delete_records = old_blend_upload[~old_blend_upload['aum_ts_id'].isnull(
-        )]
-        # delete the old records
-        old_blend_to_delete = old_blend_delete_records['aum_ts_id'].to_list()
-        # delete the old records
-        sc.batch_delete(old_blend_to_delete, 'old_aum_ts', 'aum_ts_id')
-        old_blend_final_upload = pd.concat(
-            [old_blend_new_records, old_blend_delete_records])
-        old_blend_final_upload = old_blend_final_upload[[
-            'id', 'asof_date', 'asset_value', 'source']]
-        # index=False prevents failure on trying to insert the index column
-        old_blend_final_upload.to_sql(
-            'old_aum_ts', engine, if_exists='append', index=False)
-        LOGGER.info(str(len(old_blend_new_records['id'])
-                        )+' new rows inserted to old_aum_ts')
-        LOGGER.info(str(len(old_blend_delete_records['id'])) +
-                    ' rows deleted and updated to old_aum_ts')
-    else:
-        LOGGER.info('no records to move to old_aum_ts')
-
-    to_delete = blend_breaks['aum_ts_id'].to_list()
-    sc.batch_delete(to_delete, 'aum_ts', 'aum_ts_id')
-    blend_upload = pd.concat([blend_new, blend_breaks])
-    if len(blend_upload['id']) > 0:
-        blend_upload.loc[:, 'source'] = source
-        blend_upload = blend_upload[[
-            'id', 'asof_date', 'asset_value', 'source']]
-        # index=False prevents failure on trying to insert the index column
-        blend_upload.to_sql('aum_ts', engine, if_exists='append', index=False)
-        LOGGER.info(str(len(blend_new['id']))+' new rows inserted to aum_ts')
-        LOGGER.info(str(len(blend_breaks['id'])) +
-                    ' rows deleted and updated to aum_ts')
-    else:
-        LOGGER.info('no records to update with blended method')
 
-
-def get_returns(source, returns_df, better_sources):
+def get_returns(source, returns_df, better_sources, engine=None, connection=None, mode='pandas'):
     """
     Runs the process to update returns given database logic
     Parameters
     ---------
     source : str
         source in question
-    returns_df: dataframe
+    returns_df: dataframe or iterator of dataframes
         dataframe of return values with corresponding asof_dates and internal IDs
         the return_values here will all be in USD
+        can also be an iterator of chunks partitioned by fund id, which are reconciled one at a time
+        (e.g. partition_by_fund(pd.read_csv(path, chunksize=500000)) on a file sorted by id)
     better_sources : list
         list where each element is a better source (one you would not want to overwrite) from aum_df
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine, e.g. to reuse one warm pool for a whole job
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+    mode : str
+        'pandas' (default) diffs the existing rows in memory, 'merge' stages returns_df and runs the whole load
+        on the server with one set-based MERGE (see merge_reconciliation)
 
     Returns
     -------
 
     """
-    from sc_py import sc_fxns as sc
-    import pandas as pd
-    import numpy as np
-    from sqlalchemy.engine import URL
-    from sqlalchemy import create_engine
-    from os import environ
-    connection_string = "Driver={SQL Server};" + \
-        f"Server={environ['DASH_AZURE_DB_SERVER']};Database={environ['DASH_SC_DB_NAME']};UID={environ['DASH_AZURE_DB_RW_USER']};PWD={environ['DASH_AZURE_DB_RW_USER_PWD']}"
-    connection_url = URL.create(
-        "mssql+pyodbc", query={"odbc_connect": connection_string})
-    engine = create_engine(connection_url)
-
-    import logging
-    LOGGER = logging.getLogger(__name__)
-    # set this to false as mostly not used
-    use_type = False
-
-    if type(better_sources) is not list:
-        raise ValueError("""'better_sources' must be of type list """)
-
-    if 'id' not in returns_df.columns.to_list():
-        raise ValueError("""id must be a column in returns_df """)
-    if 'return_value' not in returns_df.columns.to_list():
-        raise ValueError("""asset_value must be a column in returns_df """)
-    if 'asof_date' not in returns_df.columns.to_list():
-        raise ValueError("""asof_date must be a column in returns_df """)
-    if 'source' not in returns_df.columns.to_list():
-        raise ValueError("""source must be a column in returns_df """)
-    if 'type' in returns_df.columns.to_list():
-        use_type = True
-
-    quote_char = "'"
-    sql_source = quote_char+source+quote_char
-    # get list of funds that are missing returns or are currently using given source for returns
-    ids = pd.read_sql_query("""
-    select distinct e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have a returns source
-        select id from funds where id not in (select id from returns_ts)
-        UNION
-        --query funds that only use given source for returns
-        select id from returns_ts where source="""+sql_source+"""
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+sql_source+"""
-    and f.blend_returns=0
-    and e.id not in (select id from returns_ts where source!="""+sql_source+""")
-    """, engine, dtype={'id': np.int64})
-
-    db = pd.read_sql_query('SELECT * FROM returns_ts', engine,
-                           parse_dates=['asof_date'],
-                           dtype={'id': np.int64, 'ret_ts_id': np.int64})
-    db = sc.rename_with_additional_string(db, 'existing')
-
-    LOGGER.info('starting process to remove inferior return sources')
-    # check which internal IDs are in the returns_df but not in the list of funds whose returns we should be updating
-    # these are funds with other sources in the database
-    # strip out sources that are higher in our hierarchy
-    # filter out funds with blended returns
-    # then delete the returns of funds with non-blended returns
-    other_sources = list(
-        returns_df[~returns_df['id'].isin(ids['id'])]['id'].unique())
-    fund_check = pd.read_sql_query(
-        """select * from funds""", engine, dtype={'id': np.int64})
-    fund_check = fund_check[fund_check['id'].isin(other_sources)]
-    funds_to_delete = fund_check[fund_check['blend_returns'] == 0]
-    worse_returns = funds_to_delete.merge(
-        db, how='left', left_on=['id'], right_on=['id existing'])
-    # strip out any sources we dont want to overwrite
-    worse_returns = worse_returns[~worse_returns['source existing'].isin(
-        better_sources)]
-    worse_returns = worse_returns[['id existing', 'asof_date existing',
-                                   'return_value existing', 'source existing', 'ret_ts_id existing']]
-    worse_returns.to_csv(source+"_backup.csv")
-
-    # current process is to move old returns out of the primary returns database (returns_ts) and into old_returns_ts
-    # we do this as a backup in case any funds returns need to be restored
-    # this only has to be done on the breaks df because that represents the returns we're about to delete
-    old_upload = worse_returns[['id existing',
-                                'asof_date existing',
-                                'return_value existing',
-                                'source existing']].rename(columns={'id existing': 'id',
-                                                                    'asof_date existing': 'asof_date',
-                                                                    'return_value existing': 'return_value',
-                                                                    'source existing': 'source'})
-
-    if len(old_upload['id']) > 0:
-        db_old = pd.read_sql_query('SELECT * FROM old_returns_ts', engine,
-                                   parse_dates=['asof_date'],
-                                   dtype={'id': np.int64, 'ret_ts_id': np.int64})
-        db_old = sc.rename_with_additional_string(db_old, 'existing')
-        # merge on source here to ensure we are retaining records from various sources in case we need to fallback
-        old_upload = old_upload.merge(db_old,
-                                      how='left',
-                                      left_on=['id', 'asof_date', 'source'],
-                                      right_on=['id existing', 'asof_date existing', 'source existing'])
-        # get new records to insert to old_returns_ts
-        old_new_records = old_upload[old_upload['ret_ts_id existing'].isnull()]
-        # get records to delete from old_returns_ts
-        old_delete_records = old_upload[~old_upload['ret_ts_id existing'].isnull(
-        )]
-        # delete the old records
-        old_to_delete = old_delete_records['ret_ts_id existing'].to_list()
-        # delete the old records
-        sc.batch_delete(old_to_delete, 'old_returns_ts', 'ret_ts_id')
-        old_upload_combo = pd.concat([old_new_records, old_delete_records])
-        old_upload_combo = old_upload_combo[[
-            'id', 'asof_date', 'return_value', 'source']]
-
-        # index=False prevents failure on trying to insert the index column
-        old_upload_combo.to_sql('old_returns_ts', engine,
-                                if_exists='append', index=False)
-        LOGGER.info('   '+str(len(old_new_records['id'])) +
-                    ' new rows inserted to old_returns_ts')
-        LOGGER.info('   '+str(len(old_delete_records['id'])) +
-                    ' rows deleted and updated to old_returns_ts')
-    else:
-        LOGGER.info('   no records to move to old_returns_ts')
-
-    # delete the old records
-    to_delete = worse_returns['ret_ts_id existing'].to_list()
-    sc.batch_delete(to_delete, 'returns_ts', 'ret_ts_id')
-
-    LOGGER.info('   '+str(len(worse_returns['ret_ts_id existing'])) +
-                ' inferior rows of return sources deleted from returns_ts')
-
-    LOGGER.info("""finished process to remove inferior return sources
-
-    """)
-    LOGGER.info("""starting process to update non-blended returns""")
-    # re-query ids and returns to get an updated list of funds to insert and returns to check against
-    # then merge to make sure we're inserting new rows from returns_ts
-    ids = pd.read_sql_query("""
-    select distinct e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have a returns source
-        select id from funds where id not in (select id from returns_ts)
-        UNION
-        --query funds that only use given source for returns
-        select id from returns_ts where source="""+sql_source+"""
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+sql_source+"""
-    and f.blend_returns=0
-    and e.id not in (select id from returns_ts where source!="""+sql_source+""")
-    """, engine, dtype={'id': np.int64})
-    ids = sc.adj_dataframe(ids)
-    rets_ids = returns_df[returns_df['id'].isin(ids['id'].to_list())]
-    rets_ids = rets_ids.reset_index(drop=True)
-
-    db = pd.read_sql_query('SELECT * FROM returns_ts', engine,
-                           parse_dates=['asof_date'],
-                           dtype={'id': np.int64, 'ret_ts_id': np.int64})
-    db = sc.rename_with_additional_string(db, 'existing')
-
-    # check which funds have new returns or return differences
-    # we query the whole database of returns, then left join
-    # this will return only the funds that we are interested in replacing (missing returns or currently using given source's returns)
-    # querying the whole returns_ts database allows us to check existing return sources that might NOT be given source
-    merge_df = rets_ids.merge(db,
-                              how='left',
-                              left_on=['id', 'asof_date'],
-                              right_on=['id existing', 'asof_date existing'])
-    merge_df = sc.adj_dataframe(merge_df)
-    merge_df = merge_df[~merge_df['source existing'].isin(better_sources)]
-    new = merge_df[merge_df['ret_ts_id existing'].isnull()]
-    breaks = merge_df[~merge_df['ret_ts_id existing'].isnull()]
-    breaks = breaks[breaks['return_value'] != breaks['return_value existing']]
-
-    # current process is to move old returns out of the primary returns database (returns_ts) and into old_returns_ts
-    # we do this as a backup in case any funds returns need to be restored
-    # this only has to be done on the breaks df because that represents the returns we're about to delete
-    old_upload = breaks[['id existing',
-                         'asof_date existing',
-                         'return_value existing',
-                         'source existing']].rename(columns={'id existing': 'id',
-                                                             'asof_date existing': 'asof_date',
-                                                             'return_value existing': 'return_value',
-                                                             'source existing': 'source'})
-
-    if len(old_upload['id']) > 0:
-        db_old = pd.read_sql_query('SELECT * FROM old_returns_ts', engine,
-                                   parse_dates=['asof_date'],
-                                   dtype={'id': np.int64, 'ret_ts_id': np.int64})
-        db_old = sc.rename_with_additional_string(db_old, 'existing')
-        # merge on source here to ensure we are retaining records from various sources in case we need to fallback
-        old_upload = old_upload.merge(db_old,
-                                      how='left',
-                                      left_on=['id', 'asof_date', 'source'],
-                                      right_on=['id existing', 'asof_date existing', 'source existing'])
-        # get new records to insert to old_returns_ts
-        old_new_records = old_upload[old_upload['ret_ts_id existing'].isnull()]
-        # get records to delete from old_returns_ts
-        old_delete_records = old_upload[~old_upload['ret_ts_id existing'].isnull(
-        )]
-        # delete the old records
-        old_to_delete = old_delete_records['ret_ts_id existing'].to_list()
-        # delete the old records
-        sc.batch_delete(old_to_delete, 'old_returns_ts', 'ret_ts_id')
-        old_upload_combo = pd.concat([old_new_records, old_delete_records])
-        old_upload_combo = old_upload_combo[[
-            'id', 'asof_date', 'return_value', 'source']]
-        # index=False prevents failure on trying to insert the index column
-        old_upload_combo.to_sql('old_returns_ts', engine,
-                                if_exists='append', index=False)
-        LOGGER.info('   '+str(len(old_new_records['id'])) +
-                    ' new rows inserted to old_returns_ts')
-        LOGGER.info('   '+str(len(old_delete_records['id'])) +
-                    ' rows deleted and updated to old_returns_ts')
-    else:
-        LOGGER.info('   no records to move to old_returns_ts')
-
-    # delete the old records
-    to_delete = breaks['ret_ts_id existing'].to_list()
-    sc.batch_delete(to_delete, 'returns_ts', 'ret_ts_id')
-
-    upload = pd.concat([new, breaks])
-    upload = upload.reset_index(drop=True)
-    upload.loc[:, 'source'] = source
-    if use_type == False:
-        upload = upload[['id', 'asof_date', 'return_value', 'source']]
-    elif use_type == True:
-        upload = upload[['id', 'asof_date', 'return_value', 'source', 'type']]
-
-    # index=False prevents failure on trying to insert the index column
-    upload.to_sql('returns_ts', engine, if_exists='append', index=False)
-    LOGGER.info('   '+str(len(new['id']))+' new rows inserted to returns_ts')
-    LOGGER.info('   '+str(len(breaks['id'])) +
-                ' rows deleted and updated to returns_ts')
-
-    LOGGER.info("""finished process to update non-blended returns
-
-    """)
-    LOGGER.info("""starting process to update blended returns""")
-    # get list of funds that we want to blend returns on
-    blend_ids = pd.read_sql_query("""
-    select distinct e.id,e.external_id 
-    from external_entity_mapping e 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+sql_source+"""
-    and f.blend_returns=1""", engine, dtype={'id': np.int64})
-    # instead of inner mergeing here, we can just use isin to filter only on funds with blended returns
-    blend_rets = returns_df[returns_df['id'].isin(blend_ids['id'].to_list())]
-    blend_rets = blend_rets.reset_index(drop=True)
-
-    db_blend = pd.read_sql_query('SELECT * FROM returns_ts', engine,
-                                 parse_dates=['asof_date'],
-                                 dtype={'id': np.int64, 'ret_ts_id': np.int64})
-    db_blend = sc.rename_with_additional_string(db_blend, 'existing')
-
-    merge_blend_df = blend_rets.merge(db_blend,
-                                      how='left',
-                                      left_on=['id', 'asof_date'],
-                                      right_on=['id existing', 'asof_date existing'])
-    # Since given source is the top source in returns hierarchy, we dont have to strip out any returns sources here
-    # in other words, delete any other source of return
-    merge_blend_df = merge_blend_df[~merge_blend_df['source existing'].isin(
-        better_sources)]
-    blend_new = merge_blend_df[merge_blend_df['ret_ts_id existing'].isnull()]
-    blend_breaks = merge_blend_df[~merge_blend_df['ret_ts_id existing'].isnull(
-    )]
-    blend_breaks = blend_breaks[blend_breaks['return_value']
-                                != blend_breaks['return_value existing']]
-
-    # current process is to move old returns out of the primary returns database (returns_ts) and into ld_returns_ts
-    # we do this as a backup in case any funds returns need to be restored
-    # this only has to be done on the breaks df because that represents the returns we're about to delete
-    old_blend_upload = blend_breaks[['id existing',
-                                     'asof_date existing',
-                                     'return_value existing',
-                                     'source existing']].rename(columns={'id existing': 'id',
-                                                                         'asof_date existing': 'asof_date',
-                                                                         'return_value existing': 'return_value',
-                                                                         'source existing': 'source'})
-
-    if len(old_blend_upload['id']) > 0:
-        db_old_blend = pd.read_sql_query('SELECT * FROM old_returns_ts', engine,
-                                         parse_dates=['asof_date'],
-                                         dtype={'id': np.int64, 'ret_ts_id': np.int64})
-        db_old_blend = sc.rename_with_additional_string(
-            db_old_blend, 'existing')
-        # merge on source to keep all previous versions of each source
-        old_blend_upload = old_blend_upload.merge(db_old_blend,
-                                                  left_on=[
-                                                      'id', 'asof_date', 'source'],
-                                                  right_on=['id existing', 'asof_date existing', 'source existing'])
-        # get new records to insert to old_returns_ts
-        old_blend_new_records = old_blend_upload[old_blend_upload['ret_ts_id existing'].isnull(
-        )]
-        # get records to delete from old_returns_ts
-        old_blend_delete_records = old_blend_upload[~old_blend_upload['ret_ts_id existing'].isnull(
-        )]
-        # delete the old records
-        old_blend_to_delete = old_blend_delete_records['ret_ts_id existing'].to_list(
-        )
-        # delete the old records
-        sc.batch_delete(old_blend_to_delete, 'old_returns_ts', 'ret_ts_id')
-
-        old_blend_upload_combo = pd.concat(
-            [old_blend_new_records, old_blend_delete_records])
-        old_blend_upload_combo = old_blend_upload_combo[[
-            'id', 'asof_date', 'return_value', 'source']]
-        # index=False prevents failure on trying to insert the index column
-        old_blend_upload_combo.to_sql(
-            'old_returns_ts', engine, if_exists='append', index=False)
-        LOGGER.info(
-            '   '+str(len(old_blend_new_records['id']))+' new rows inserted to old_returns_ts')
-        LOGGER.info('   '+str(len(old_blend_delete_records['id'])) +
-                    ' rows deleted and updated to old_returns_ts')
-    else:
-        LOGGER.info('   no records to move to old_returns_ts')
-
-    blend_to_delete = blend_breaks['ret_ts_id existing'].to_list()
-
-    # delete the old records
-    sc.batch_delete(blend_to_delete, 'returns_ts', 'ret_ts_id')
-
-    blend_upload = pd.concat([blend_new, blend_breaks])
-    blend_upload = blend_upload.reset_index(drop=True)
-    if len(blend_upload['id']) > 0:
-        blend_upload.loc[:, 'source'] = source
-        if use_type == False:
-            blend_upload = blend_upload[[
-                'id', 'asof_date', 'return_value', 'source']]
-        elif use_type == True:
-            blend_upload = blend_upload[[
-                'id', 'asof_date', 'return_value', 'source', 'type']]
-        # index=False prevents failure on trying to insert the index column
-        blend_upload.to_sql('returns_ts', engine,
-                            if_exists='append', index=False)
-        LOGGER.info('   '+str(len(blend_new['id'])) +
-                    ' new rows inserted to returns_ts')
-        LOGGER.info('   '+str(len(blend_breaks['id'])) +
-                    ' rows deleted and updated to returns_ts')
-    else:
-        LOGGER.info('   no records to update with blended method')
-    LOGGER.info("""finished process to update blended returns
+    reconcile('returns_ts', source, returns_df, better_sources, engine, connection, mode=mode)
 
-    """)
 
-
-def get_fees(source, fees_df, better_sources):
+def get_fees(source, fees_df, better_sources, engine=None, connection=None):
     """
     evaluates a dataframe to see which records insides the dataframe should be inserted to the fees table.
     The current process checks to ensure that we are not overwriting any better sources of data,
@@ -840,184 +3078,16 @@ def get_fees(source, fees_df, better_sources):
         for example, if we are evaluating HFR's fees, we would NOT want to overwite
         any manually-specified fees or any fees from albourne. therefore better_sources = 
         ['albourne','manual']
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine, e.g. to reuse one warm pool for a whole job
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
 
     Returns
     -------
 
     """
-    import pandas as pd
-    import numpy as np
-    from sqlalchemy.engine import URL
-    from sqlalchemy import create_engine
-    from os import environ
-    connection_string = "Driver={SQL Server};" + \
-        f"Server={environ['DASH_AZURE_DB_SERVER']};Database={environ['DASH_SC_DB_NAME']};UID={environ['DASH_AZURE_DB_RW_USER']};PWD={environ['DASH_AZURE_DB_RW_USER_PWD']}"
-    connection_url = URL.create(
-        "mssql+pyodbc", query={"odbc_connect": connection_string})
-    engine = create_engine(connection_url)
-
-    import logging
-    LOGGER = logging.getLogger(__name__)
-
-    if type(better_sources) is not list:
-        raise ValueError("""'better_sources' must be of type list """)
-    if 'id' not in fees_df.columns.to_list():
-        raise ValueError("""id must be a column in fees_df """)
-    if 'management_fee' not in fees_df.columns.to_list():
-        raise ValueError("""management_fee must be a column in fees_df """)
-    if 'performance_fee' not in fees_df.columns.to_list():
-        raise ValueError("""performance_fee must be a column in fees_df """)
-    if 'source' not in fees_df.columns.to_list():
-        raise ValueError("""source must be a column in fees_df """)
-
-    fees_df = fees_df.dropna(
-        subset=['management_fee', 'performance_fee'], how='all').copy()
-
-    fees_df.loc[:, 'management_fee'] = fees_df['management_fee'].round(
-        decimals=8)
-    fees_df.loc[:, 'performance_fee'] = fees_df['performance_fee'].round(
-        decimals=8)
-
-    quote_char = "'"
-    ids = pd.read_sql_query("""
-    select e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have an fee source
-        select id from funds where id not in (select id from fees)
-        UNION
-        --query funds that only use given source for fees
-        select id from fees where source="""+quote_char+source+quote_char+"""
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+quote_char+source+quote_char+"""
-    and f.id not in (
-        select id from fees where source!="""+quote_char+source+quote_char+""")
-                          """, engine, dtype={'id': np.int64})
-    # check to only update funds with existing fees from given source or missing fees
-    assets_id = fees_df[fees_df['id'].isin(ids['id'].to_list())]
-    assets_id = assets_id.reset_index(drop=True)
-
-    db = pd.read_sql_query('SELECT * FROM fees ',
-                           engine, dtype={'id': np.int64})
-    db = rename_with_additional_string(db, 'existing')
-
-    # check which internal IDs are in the fees_df but not in the list of funds whose fees we should be updating
-    # these are funds with other sources in the database
-    # strip out sources that are higher in our hierarchy
-    other_sources = list(
-        fees_df[~fees_df['id'].isin(ids['id'])]['id'].unique())
-    fund_check = pd.read_sql_query("""select * from funds""", engine)
-    fund_check = fund_check[fund_check['id'].isin(other_sources)]
-    funds_to_delete = fund_check.merge(
-        db, how='left', left_on=['id'], right_on=['id existing'])
-    worse_fee_sources = funds_to_delete[~funds_to_delete['source existing'].isin(
-        better_sources)]
-
-    worse_fee_sources = worse_fee_sources[['id existing',
-                                           'management_fee existing',
-                                           'performance_fee existing',
-                                           'source existing',
-                                           'id_record_number existing',
-                                           'hurdle_rate existing',
-                                           'high_water_mark existing']]
-
-    # delete the old records
-    to_delete = worse_fee_sources['id_record_number existing'].to_list()
-    LOGGER.info('deleting '+str(len(to_delete))+' based on worse sources')
-    batch_delete(to_delete, 'fees', 'id_record_number')
-
-    ids = pd.read_sql_query("""
-    select e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have an fee source
-        select id from funds where id not in (select id from fees)
-        UNION
-        --query funds that only use given source for fees
-        select id from fees where source="""+quote_char+source+quote_char+"""
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+quote_char+source+quote_char+"""
-    and f.id not in (
-        select id from fees where source!="""+quote_char+source+quote_char+""")
-    """, engine, dtype={'id': np.int64})
-    # check to only update funds with existing source's fees or missing fees
-    assets_id = fees_df[fees_df['id'].isin(ids['id'].to_list())]
-    assets_id = assets_id.reset_index(drop=True)
-
-    db = pd.read_sql_query('SELECT * FROM fees ',
-                           engine, dtype={'id': np.int64})
-    # round to match existing df
-    db['management_fee'] = db['management_fee'].round(decimals=8)
-    db['performance_fee'] = db['performance_fee'].round(decimals=8)
-
-    db = rename_with_additional_string(db, 'existing')
-
-    merge_df = assets_id.merge(db, how='left',
-                               left_on='id',
-                               right_on='id existing')
-    # get only records with sources we would want to overwrite
-    merge_df = merge_df[~merge_df['source existing'].isin(better_sources)]
-    # get all new records (which we would insert no matter what)
-    new = merge_df[merge_df['id_record_number existing'].isnull()]
-    breaks = merge_df[~merge_df['id_record_number existing'].isnull()].copy()
-
-    def updated_records(df, colname1, colname2):
-        """
-        Evalautes a dataframe across colname1 and colname2 to ensure that:
-            1) both are not null
-            2) the values in colname1 and colname2 differ
-        then the function returns the dataframe.
-        This is to ensure that we are not deleting and re-inserting records with nulls,
-        or where the data is unchanged.
-
-        Parameters
-        ---------
-        df : dataframe
-            the dataframe to evaluate
-        colname1: string
-            the name of the first column inside df to evaluate
-        colname2: string
-            the name of the second column inside df to evaluate
-
-        Returns
-        -------
-        df : dataframe
-            the original dataframe
-        """
-        df = df[~df[colname1].isnull() | ~df[colname2].isnull()]
-        df = df[df[colname1] != df[colname2]]
-        df.reset_index(drop=True, inplace=True)
-        return df
-
-    perf_check = updated_records(
-        breaks, 'performance_fee', 'performance_fee existing')
-    mgmt_check = updated_records(
-        breaks, 'management_fee', 'management_fee existing')
-    hwm_check = updated_records(
-        breaks, 'high_water_mark', 'high_water_mark existing')
-    hurdle_check = updated_records(
-        breaks, 'hurdle_rate', 'hurdle_rate existing')
-    final_breaks = pd.concat([perf_check, mgmt_check, hwm_check, hurdle_check])
-    final_breaks = final_breaks.drop_duplicates(keep='first')
-    final_breaks = final_breaks.reset_index(drop=True)
-
-    to_delete = final_breaks['id_record_number existing'].to_list()
-    # delete the old records
-    batch_delete(to_delete, 'fees', 'id_record_number')
-
-    upload = pd.concat([new, final_breaks])
-    upload.loc[:, 'source'] = source
-    upload = upload.drop_duplicates(keep='first')
-
-    upload = upload[['id', 'management_fee', 'performance_fee',
-                     'hurdle_rate', 'high_water_mark', 'source']]
-    # index=False prevents failure on trying to insert the index column
-    upload.to_sql('fees', engine, if_exists='append', index=False)
-    LOGGER.info(str(len(upload['id']))+' rows inserted')
+    reconcile('fees', source, fees_df, better_sources, engine, connection)
 
 
 def rename_with_additional_string(df, string_without_leading_space):
@@ -1043,7 +3113,7 @@ def rename_with_additional_string(df, string_without_leading_space):
     return df
 
 
-def get_liquidity(source, liquidity_df, better_sources):
+def get_liquidity(source, liquidity_df, better_sources, engine=None, connection=None, normalize=False):
     """
     evaluates a dataframe to see which records insides the dataframe should be inserted to the fund_liquidity table.
     The current process checks to ensure that we are not overwriting any better sources of data,
@@ -1061,198 +3131,267 @@ def get_liquidity(source, liquidity_df, better_sources):
         for example, if we are evaluating HFR's liquidity data, we would NOT want to overwite
         any manually-specified liqidity data or any liqidity data from albourne. therefore better_sources = 
         ['albourne','manual']
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine, e.g. to reuse one warm pool for a whole job
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
+    normalize : bool
+        clean the liquidity fields with normalize_liquidity before comparing
 
     Returns
     -------
     """
-    import pandas as pd
-    import numpy as np
-    from sqlalchemy.engine import URL
-    from sqlalchemy import create_engine
-    from os import environ
-    connection_string = "Driver={SQL Server};" + \
-        f"Server={environ['DASH_AZURE_DB_SERVER']};Database={environ['DASH_SC_DB_NAME']};UID={environ['DASH_AZURE_DB_RW_USER']};PWD={environ['DASH_AZURE_DB_RW_USER_PWD']}"
-    connection_url = URL.create(
-        "mssql+pyodbc", query={"odbc_connect": connection_string})
-    engine = create_engine(connection_url)
+    if normalize:
+        liquidity_df = normalize_liquidity(liquidity_df)
+    reconcile('fund_liquidity', source, liquidity_df, better_sources, engine, connection)
 
-    if type(better_sources) is not list:
-        raise ValueError("""'better_sources' must be of type list """)
-    if 'id' not in liquidity_df.columns.to_list():
-        raise ValueError("""id must be a column in liquidity_df """)
-    if 'redemption_notice_days' not in liquidity_df.columns.to_list():
-        raise ValueError(
-            """redemption_notice_days must be a column in liquidity_df """)
-    if 'redemption_frequency' not in liquidity_df.columns.to_list():
-        raise ValueError(
-            """redemption_frequency must be a column in liquidity_df """)
-    if 'redemption_gate' not in liquidity_df.columns.to_list():
-        raise ValueError(
-            """redemption_gate must be a column in liquidity_df """)
-    if 'lock_up' not in liquidity_df.columns.to_list():
-        raise ValueError("""lock_up must be a column in liquidity_df """)
-    if 'subscription_frequency' not in liquidity_df.columns.to_list():
-        raise ValueError(
-            """subscription_frequency must be a column in liquidity_df """)
-    if 'source' not in liquidity_df.columns.to_list():
-        raise ValueError("""source must be a column in liquidity_df """)
-
-    liquidity_df = liquidity_df.dropna(subset=['redemption_notice_days',
-                                               'redemption_frequency', 'redemption_gate',
-                                               'lock_up', 'subscription_frequency'], how='all').copy()
-
-    quote_char = "'"
-    ids = pd.read_sql_query("""
-    select e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have an fund_liquidity source
-        select id from funds where id not in (select id from fund_liquidity)
-        UNION
-        --query funds that only use given source for fund_liquidity
-        select id from fund_liquidity where source="""+quote_char+source+quote_char+"""
-        UNION
-        select id from fund_liquidity l where 
-            (l.redemption_frequency in ('N/A','Unknown')) or 
-            (redemption_frequency is null) or 
-            (subscription_frequency in ('N/A','Unknown')) or 
-            (subscription_frequency is null) 
-
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+quote_char+source+quote_char+"""
-    and f.id not in (
-        select id from fund_liquidity where source!="""+quote_char+source+quote_char+""")
-                          """, engine, dtype={'id': np.int64})
-    # check to only update funds with existing fund_liquidity from given source or missing fund_liquidity
-    assets_id = liquidity_df[liquidity_df['id'].isin(ids['id'].to_list())]
-    assets_id = assets_id.reset_index(drop=True)
-
-    db = pd.read_sql_query('SELECT * FROM fund_liquidity ', engine)
-    db = adj_dataframe(db)
-    db = rename_with_additional_string(db, 'existing')
-
-    # check which internal IDs are in the liquidity_df but not in the list of funds whose fund_liquidity we should be updating
-    # these are funds with other sources in the database
-    # strip out sources that are higher in our hierarchy
-    other_sources = list(
-        liquidity_df[~liquidity_df['id'].isin(ids['id'])]['id'].unique())
-    fund_check = pd.read_sql_query("""select * from funds""", engine)
-    fund_check = fund_check[fund_check['id'].isin(other_sources)]
-    funds_to_delete = fund_check.merge(
-        db, how='left', left_on=['id'], right_on=['id existing'])
-    worse_liq_sources = funds_to_delete[~funds_to_delete['source existing'].isin(
-        better_sources)]
-
-    worse_liq_sources = worse_liq_sources[['id existing',
-                                           'id_record_number existing']]
-
-    # delete the old records
-    to_delete = worse_liq_sources['id_record_number existing'].to_list()
-    batch_delete(to_delete, 'fund_liquidity', 'id_record_number')
-
-    LOGGER.info(str(len(to_delete)) +
-                ' rows of inferior fund_liquidity sources deleted from fund_liquidity table')
-
-    ids = pd.read_sql_query("""
-    select e.id,e.external_id 
-    from external_entity_mapping e join (
-        --query funds that do not have an fund_liquidity source
-        select id from funds where id not in (select id from fund_liquidity)
-        UNION
-        --query funds that only use given source for fund_liquidity
-        select id from fund_liquidity where source="""+quote_char+source+quote_char+"""
-    ) i on i.id=e.id 
-    join funds f on f.id=e.id
-    where e.mapping_status='Live'
-    and e.is_shareclass=0
-    and e.external_source="""+quote_char+source+quote_char+"""
-    and f.id not in (
-        select id from fund_liquidity where source!="""+quote_char+source+quote_char+""")
-    """, engine, dtype={'id': np.int64})
-    # check to only update funds with existing source's fund_liquidity or missing fund_liquidity
-    assets_id = liquidity_df[liquidity_df['id'].isin(ids['id'].to_list())]
-    assets_id = assets_id.reset_index(drop=True)
-
-    db = pd.read_sql_query('SELECT * FROM fund_liquidity ',
-                           engine, dtype={'id': np.int64})
-    db = adj_dataframe(db)
-
-    db = rename_with_additional_string(db, 'existing')
-
-    merge_df = assets_id.merge(db, how='left',
-                               left_on='id',
-                               right_on='id existing')
-
-    merge_df = merge_df[~merge_df['source existing'].isin(better_sources)]
-    new = merge_df[merge_df['id_record_number existing'].isnull()]
-    breaks = merge_df[~merge_df['id_record_number existing'].isnull()].copy()
-
-    def updated_records(df, colname1, colname2):
-        """
-        Evalautes a dataframe across colname1 and colname2 to ensure that:
-            1) both are not null
-            2) the values in colname1 and colname2 differ
-        then the function returns the dataframe.
-        This is to ensure that we are not deleting and re-inserting records with nulls,
-        or where the data is unchanged.
-
-        Parameters
-        ---------
-        df : dataframe
-            the dataframe to evaluate
-        colname1: string
-            the name of the first column inside df to evaluate
-        colname2: string
-            the name of the second column inside df to evaluate
-
-        Returns
-        -------
-        df : dataframe
-            the original dataframe
-        """
-        df = df[~df[colname1].isnull() | ~df[colname2].isnull()]
-        df = df[df[colname1] != df[colname2]]
-        df.reset_index(drop=True, inplace=True)
-        return df
 
-    red_not_check = updated_records(
-        breaks, 'redemption_notice_days', 'redemption_notice_days existing')
-    red_freq_check = updated_records(
-        breaks, 'redemption_frequency', 'redemption_frequency existing')
-    red_gate_check = updated_records(
-        breaks, 'redemption_gate', 'redemption_gate existing')
-    lu_check = updated_records(breaks, 'lock_up', 'lock_up existing')
-    sub_check = updated_records(
-        breaks, 'subscription_frequency', 'subscription_frequency existing')
+# the background mailer (see start_mailer): its settings, queue and worker thread
+_MAILER = {'smtp_server': 'webmail.silvercreekcapital.com', 'port': 25, 'retries': 3, 'retry_wait': 5,
+           'idle_timeout': 60, 'timeout': 30, 'wait': False, 'queue': None, 'thread': None, 'atexit': False}
+_MAILER_LOCK = threading.Lock()
+
+
+def start_mailer(smtp_server='webmail.silvercreekcapital.com', port=25, retries=3, retry_wait=5,
+                 idle_timeout=60, timeout=30, wait=False):
+    """
+    Starts the background mailer that sends every email of the process over one reused SMTP connection
+        Messages are queued and sent in order by one worker thread, so callers don't wait on the mail server.
+        The connection is opened on the first message, kept open between messages and closed (QUIT)
+        after idle_timeout seconds without mail. A failed send is retried on a fresh connection
+        for connection errors and temporary (4xx) server replies. Queued messages are flushed at exit.
+        send_email_with_attachment starts the mailer with the defaults if it is not running
+
+    Parameters
+    ---------
+    smtp_server : str
+        the mail server (e.g. 'localhost' for a local SMTP stand-in when testing)
+    port : int
+        the mail server's port
+    retries : int
+        times a failed message is retried
+    retry_wait : float
+        seconds before the first retry, doubled for every further retry
+    idle_timeout : float
+        seconds without mail after which the connection is closed
+    timeout : float
+        socket timeout of the SMTP connection
+    wait : bool
+        default of send_email_with_attachment's wait. False queues every email without blocking the caller,
+        True makes each call wait until its email is sent (or fails)
+
+    Returns
+    -------
+
+    """
+    with _MAILER_LOCK:
+        if _MAILER['thread'] is not None:
+            raise ValueError('the mailer is already running, call stop_mailer first')
+        _MAILER.update(smtp_server=smtp_server, port=port, retries=retries, retry_wait=retry_wait,
+                       idle_timeout=idle_timeout, timeout=timeout, wait=wait)
+        _start_mailer_thread()
+
+
+def _start_mailer_thread():
+    # called holding _MAILER_LOCK
+    import atexit
+    import queue
+    _MAILER['queue'] = queue.Queue()
+    _MAILER['thread'] = threading.Thread(target=_mailer_loop, args=(dict(_MAILER),), name='sc_mailer', daemon=True)
+    _MAILER['thread'].start()
+    if not _MAILER['atexit']:
+        atexit.register(stop_mailer)
+        _MAILER['atexit'] = True
+
+
+def stop_mailer(wait=True):
+    """
+    Sends every queued message, closes the SMTP connection and stops the background mailer
+
+    Parameters
+    ---------
+    wait : bool
+        wait until the queue is sent
+
+    Returns
+    -------
+
+    """
+    with _MAILER_LOCK:
+        thread = _MAILER['thread']
+        if thread is None:
+            return
+        _MAILER['queue'].put(None)
+        _MAILER['thread'] = None
+    if wait:
+        thread.join()
+
+
+def _smtp_quit(sobj):
+    if sobj is not None:
+        try:
+            sobj.quit()
+        except Exception:
+            sobj.close()
+    return None
+
+
+def _smtp_retryable(e):
+    import smtplib
+    if isinstance(e, smtplib.SMTPResponseException):
+        # 4xx replies are temporary (busy, too many connections, ...)
+        return 400 <= e.smtp_code < 500
+    return isinstance(e, (smtplib.SMTPServerDisconnected, OSError))
 
-    final_breaks = pd.concat(
-        [red_not_check, red_freq_check, red_gate_check, lu_check, sub_check])
-    final_breaks = final_breaks.reset_index(drop=True)
 
-    to_delete = final_breaks['id_record_number existing'].to_list()
-    # delete the old records
-    batch_delete(to_delete, 'fund_liquidity', 'id_record_number')
+def _mailer_loop(settings):
+    import queue
+    import smtplib
+    import time
+    sobj = None
+    while True:
+        try:
+            item = settings['queue'].get(timeout=settings['idle_timeout'])
+        except queue.Empty:
+            sobj = _smtp_quit(sobj)
+            continue
+        if item is None:
+            _smtp_quit(sobj)
+            return
+        sender_email, receiver_email, message, future = item
+        if not future.set_running_or_notify_cancel():
+            continue
+        for attempt in range(settings['retries']+1):
+            try:
+                if sobj is None:
+                    sobj = smtplib.SMTP(settings['smtp_server'], settings['port'], timeout=settings['timeout'])
+                    sobj.ehlo()
+                future.set_result(sobj.sendmail(sender_email, receiver_email, message.as_string()))
+                break
+            except Exception as e:
+                # the connection may be half-broken, the next attempt opens a new one
+                sobj = _smtp_quit(sobj) if not isinstance(e, smtplib.SMTPServerDisconnected) else None
+                if attempt == settings['retries'] or not _smtp_retryable(e):
+                    LOGGER.error('failed to send email "'+str(message['Subject'])+'" to '+str(receiver_email) +
+                                 ': '+repr(e))
+                    future.set_exception(e)
+                    break
+                LOGGER.warning('retrying email "'+str(message['Subject'])+'" after: '+repr(e))
+                time.sleep(settings['retry_wait']*2**attempt)
+
+
+def _attachment_bytes(attachment, name, attachment_format):
+    """
+    Serializes one attachment in memory, returning its filename and bytes
+        dataframes are written as csv.gz (default), parquet, zip (a csv inside) or csv,
+        files (a path or a binary file object) and bytes are attached as they are, or compressed to gz or zip.
+        files are compressed in chunks so they are never held uncompressed in memory
+    """
+    import gzip
+    import io
+    import os
+    import shutil
+    import zipfile
+    import pandas as pd
 
-    # since there can be breaks across multiple fields, keep only the unique records after dropping existing columns
-    final_breaks = final_breaks[['id', 'redemption_notice_days', 'redemption_frequency',
-                                 'redemption_gate', 'lock_up', 'subscription_frequency', 'source']]
-    final_breaks = final_breaks.drop_duplicates(keep='first')
+    if isinstance(attachment, pd.DataFrame):
+        attachment_format = attachment_format or 'csv.gz'
+        name = name or 'data'
+        buffer = io.BytesIO()
+        if attachment_format == 'csv.gz':
+            with gzip.GzipFile(filename=name+'.csv', mode='wb', fileobj=buffer) as f:
+                attachment.to_csv(f, index=False, encoding='utf-8')
+        elif attachment_format == 'parquet':
+            attachment.to_parquet(buffer, index=False)
+        elif attachment_format == 'zip':
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z, z.open(name+'.csv', 'w') as f:
+                attachment.to_csv(f, index=False, encoding='utf-8')
+        elif attachment_format == 'csv':
+            attachment.to_csv(buffer, index=False, encoding='utf-8')
+        else:
+            raise ValueError("""'attachment_format' for a dataframe must be 'csv.gz', 'parquet', 'zip' or 'csv' """)
+        return name+'.'+attachment_format, buffer.getvalue()
+
+    if isinstance(attachment, str):
+        name = name or attachment
+        source = open(attachment, 'rb')
+    elif isinstance(attachment, (bytes, bytearray, memoryview)):
+        name = name or 'attachment'
+        source = io.BytesIO(attachment)
+    elif hasattr(attachment, 'read'):
+        name = name or os.path.basename(str(getattr(attachment, 'name', 'attachment')))
+        source = attachment
+    else:
+        raise ValueError('cannot attach a '+type(attachment).__name__)
+    try:
+        buffer = io.BytesIO()
+        if attachment_format is None:
+            shutil.copyfileobj(source, buffer)
+            return name, buffer.getvalue()
+        if attachment_format == 'gz':
+            with gzip.GzipFile(filename=os.path.basename(name), mode='wb', fileobj=buffer) as f:
+                shutil.copyfileobj(source, f)
+        elif attachment_format == 'zip':
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z, z.open(os.path.basename(name), 'w') as f:
+                shutil.copyfileobj(source, f)
+        else:
+            raise ValueError("""'attachment_format' for a file or bytes must be None, 'gz' or 'zip' """)
+        return name+'.'+attachment_format, buffer.getvalue()
+    finally:
+        if source is not attachment:
+            source.close()
 
-    upload = pd.concat([new, final_breaks])
-    upload.loc[:, 'source'] = source
 
-    upload = upload[['id', 'redemption_notice_days', 'redemption_frequency', 'redemption_gate',
-                     'lock_up', 'subscription_frequency', 'source']]
-    # index=False prevents failure on trying to insert the index column
-    upload.to_sql('fund_liquidity', engine, if_exists='append', index=False)
-    LOGGER.info(str(len(upload['id']))+' rows deleted and updated')
+def _attachment_part(filename, data):
+    import base64
+    from email.mime.base import MIMEBase
+    # Add file as application/octet-stream
+    # Email client can usually download this automatically as attachment
+    part = MIMEBase("application", "octet-stream")
+    # Encode in ASCII characters 57 bytes (one 76 character line) at a time, in blocks,
+    # rather than holding a second full copy of the file
+    block = 57*1024
+    part.set_payload(''.join(base64.encodebytes(data[i:i+block]).decode('ascii')
+                             for i in range(0, len(data), block)))
+    part['Content-Transfer-Encoding'] = 'base64'
+    # Add header as key/value pair to attachment part
+    part.add_header(
+        "Content-Disposition",
+        f"attachment; filename= {filename}",
+    )
+    return part
 
 
-def send_email_with_attachment(receiver_email, sender_email, subject, body, attachment_file):
+def _split_attachment(attachment, filename, data, attachment_name, attachment_format, max_attachment_bytes):
+    """
+    Splits an attachment that is over the size limit into parts that fit:
+    a dataframe into row ranges serialized on their own, anything else into byte ranges (<filename>.part1, ...)
+    """
+    import math
+    import numpy as np
+    import pandas as pd
+    parts = math.ceil(len(data)/max_attachment_bytes)
+    if isinstance(attachment, pd.DataFrame):
+        while True:
+            chunks = [attachment.iloc[rows] for rows in np.array_split(np.arange(len(attachment.index)), parts)]
+            serialized = [_attachment_bytes(chunk, (attachment_name or 'data')+'_part'+str(i+1),
+                                            attachment_format)
+                          for i, chunk in enumerate(chunks)]
+            # compression ratios differ between chunks, try more parts until each fits (or is a single row)
+            if all(len(part) <= max_attachment_bytes for _, part in serialized) or parts >= len(attachment.index):
+                return serialized
+            parts = min(parts*2, len(attachment.index))
+    return [(filename+'.part'+str(i+1), data[start:start+max_attachment_bytes])
+            for i, start in enumerate(range(0, len(data), max_attachment_bytes))]
+
+
+def send_email_with_attachment(receiver_email, sender_email, subject, body, attachment_file=None, wait=None,
+                               attachment_name=None, attachment_format=None, max_attachment_bytes=10*1024*1024,
+                               oversize='warn'):
     """
     This sends an email with given subject, body, and attachment
+        The email goes through the background mailer (see start_mailer), which reuses one SMTP connection.
+        The attachment can be a file, a dataframe or bytes, and is serialized and compressed in memory
 
     Parameters
     ----------
@@ -1264,8 +3403,28 @@ def send_email_with_attachment(receiver_email, sender_email, subject, body, atta
         subject line of the email
     body : string
         body of the email
-    attachment_file : string
-        filename that will be attached
+    attachment_file : string, dataframe, bytes or binary file object, optional
+        filename that will be attached, or the data to attach
+    wait : bool, optional
+        wait until the email is sent (raising the error if it could not be). with False the email is queued
+        and a future is returned (a failed send is logged). defaults to the mailer's wait setting, False unless
+        start_mailer was called with wait=True
+    attachment_name : string, optional
+        filename of the attachment (without the format extension). defaults to the file's name or 'data'
+    attachment_format : string, optional
+        for a dataframe: 'csv.gz' (default), 'parquet', 'zip' or 'csv'.
+        for a file or bytes: None (default, attached as is), 'gz' or 'zip'
+    max_attachment_bytes : int
+        size above which the attachment is handled according to oversize
+    oversize : string
+        'warn' logs a warning and sends it anyway, 'split' sends one email per part that fits
+        (subject ending '(part i of n)'), 'raise' raises a ValueError
+
+    Returns
+    -------
+    refused : dict or future
+        the recipients the server refused (see smtplib.SMTP.sendmail), or a future of it if wait is False.
+        a list of them, one per email, when the attachment was split
 
     -----
     Sample usage: 
@@ -1275,46 +3434,55 @@ def send_email_with_attachment(receiver_email, sender_email, subject, body, atta
                            'this is the body?',
                            't.csv')
     """
-    import email
-    import smtplib
+    import logging
+    from concurrent.futures import Future
     from email.mime.multipart import MIMEMultipart
     from email.mime.text import MIMEText
-    from email.mime.base import MIMEBase
-    from email import encoders
-    import sys
-    import traceback
-
-    port = 25
-    smtp_server = "webmail.silvercreekcapital.com"
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = receiver_email
-    message['Subject'] = subject
-
-    # Add body to email
-    message.attach(MIMEText(body, "plain"))
-
-    # Open file in binary mode
-    with open(attachment_file, "rb") as attachment:
-        # Add file as application/octet-stream
-        # Email client can usually download this automatically as attachment
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(attachment.read())
-
-    # Encode file in ASCII characters to send by email
-    encoders.encode_base64(part)
-
-    # Add header as key/value pair to attachment part
-    part.add_header(
-        "Content-Disposition",
-        f"attachment; filename= {attachment_file}",
-    )
+    LOGGER = logging.getLogger(__name__)
 
-    # Add attachment to message and convert message to string
-    message.attach(part)
-    sobj = smtplib.SMTP(smtp_server, port)
-    sobj.ehlo()
-    sobj.sendmail(sender_email, receiver_email, message.as_string())
+    if oversize not in ('warn', 'split', 'raise'):
+        raise ValueError("""'oversize' must be 'warn', 'split' or 'raise' """)
+    attachments = [None]
+    if attachment_file is not None:
+        filename, data = _attachment_bytes(attachment_file, attachment_name, attachment_format)
+        attachments = [(filename, data)]
+        if len(data) > max_attachment_bytes:
+            if oversize == 'raise':
+                raise ValueError(filename+' is '+str(len(data))+' bytes, over the limit of ' +
+                                 str(max_attachment_bytes))
+            if oversize == 'warn':
+                LOGGER.warning(filename+' is '+str(len(data))+' bytes, over the limit of ' +
+                               str(max_attachment_bytes)+', sending it anyway')
+            else:
+                attachments = _split_attachment(attachment_file, filename, data, attachment_name,
+                                                attachment_format, max_attachment_bytes)
+                LOGGER.info(filename+' is '+str(len(data))+' bytes, sending it in '+str(len(attachments))+' parts')
+
+    if wait is None:
+        wait = _MAILER['wait']
+    futures = []
+    for i, attachment in enumerate(attachments):
+        message = MIMEMultipart()
+        message["From"] = sender_email
+        message["To"] = receiver_email
+        message['Subject'] = subject if len(attachments) == 1 else \
+            subject+' (part '+str(i+1)+' of '+str(len(attachments))+')'
+
+        # Add body to email
+        message.attach(MIMEText(body, "plain"))
+        if attachment is not None:
+            # Add attachment to message
+            message.attach(_attachment_part(*attachment))
+
+        future = Future()
+        with _MAILER_LOCK:
+            if _MAILER['thread'] is None:
+                _start_mailer_thread()
+            _MAILER['queue'].put((sender_email, receiver_email, message, future))
+        futures.append(future)
+    if len(futures) == 1:
+        return futures[0].result() if wait else futures[0]
+    return [future.result() for future in futures] if wait else futures
 
 
 def convert_lockup(row):
@@ -1335,9 +3503,9 @@ def convert_lockup(row):
     import numpy as np
     if type(row) == str:
         row = row.lower()
-        if row in ['no', 'none', 'no lockup', 'no lock up' 'no lock']:
+        if row in _NO_LOCKUP:
             return False
-        elif row in ['n/a', 'na', 'unk', 'unknown']:
+        elif row in _UNKNOWN_LIQUIDITY:
             return np.nan
         else:
             return True
@@ -1348,6 +3516,132 @@ def convert_lockup(row):
                          ' is unnaccounted for in the convert_lockup function. Please investigate.')
 
 
+# vendor spellings of the fund_liquidity fields, matched after lower-casing and stripping.
+# anything unknown becomes null, a lock up not in _NO_LOCKUP is a lock up
+_UNKNOWN_LIQUIDITY = frozenset(['', 'n/a', 'na', 'unk', 'unknown', 'nan', 'none specified', 'not specified', '-'])
+_NO_LOCKUP = frozenset(['no', 'none', 'no lockup', 'no lock up', 'no lock-up', 'no lock', 'n', 'false', '0'])
+# a gate that isn't there has no percentage, these are null without a warning
+_NO_GATE = frozenset(['no', 'none', 'no gate', 'n'])
+LIQUIDITY_FREQUENCIES = {'daily': 'Daily', 'day': 'Daily', 'd': 'Daily',
+                         'weekly': 'Weekly', 'week': 'Weekly', 'w': 'Weekly',
+                         'bi-weekly': 'Bi-Weekly', 'biweekly': 'Bi-Weekly', 'fortnightly': 'Bi-Weekly',
+                         'monthly': 'Monthly', 'month': 'Monthly', 'm': 'Monthly',
+                         'quarterly': 'Quarterly', 'quarter': 'Quarterly', 'q': 'Quarterly',
+                         'semi-annually': 'Semi-Annually', 'semi annually': 'Semi-Annually',
+                         'semiannually': 'Semi-Annually', 'semi-annual': 'Semi-Annually',
+                         'semi annual': 'Semi-Annually', 'bi-annually': 'Semi-Annually',
+                         'half-yearly': 'Semi-Annually', 'half yearly': 'Semi-Annually',
+                         'annually': 'Annually', 'annual': 'Annually', 'yearly': 'Annually', 'a': 'Annually',
+                         'biennially': 'Biennially', 'every 2 years': 'Biennially'}
+# days per unit of a notice period ('30 days', '1 month', '6 weeks', ...)
+_NOTICE_UNITS = {None: 1, 'd': 1, 'day': 1, 'days': 1, 'business days': 1, 'calendar days': 1,
+                 'w': 7, 'week': 7, 'weeks': 7, 'm': 30, 'month': 30, 'months': 30}
+
+
+@lru_cache(maxsize=None, typed=True)
+def _lockup_value(value):
+    import numpy as np
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return bool(value)
+    return convert_lockup(value.strip() if isinstance(value, str) else value)
+
+
+@lru_cache(maxsize=None, typed=True)
+def _frequency_value(value):
+    import numpy as np
+    key = str(value).strip().lower()
+    if key in _UNKNOWN_LIQUIDITY:
+        return np.nan
+    # unrecognized spellings are kept as they are
+    return LIQUIDITY_FREQUENCIES.get(key, str(value).strip())
+
+
+@lru_cache(maxsize=None, typed=True)
+def _notice_days_value(value):
+    import re
+    import numpy as np
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)):
+        return float(value)
+    key = str(value).strip().lower()
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(business days|calendar days|days|day|d|weeks|week|w|months|month|m)?',
+                         key)
+    if match is None:
+        return np.nan
+    return float(match.group(1))*_NOTICE_UNITS[match.group(2)]
+
+
+@lru_cache(maxsize=None, typed=True)
+def _gate_value(value):
+    import re
+    import numpy as np
+    # gates are fractions like every other rate: '25%' is 0.25, 0.25 and '0.25' stay as they are.
+    # a bare number above 1 could be a percent or a mistake, so it is left null rather than guessed
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)):
+        return float(value) if 0 <= value <= 1 else np.nan
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(%?)', str(value).strip().lower())
+    if match is None:
+        return np.nan
+    if match.group(2) == '%':
+        return float(match.group(1))/100
+    return float(match.group(1)) if float(match.group(1)) <= 1 else np.nan
+
+
+# fund_liquidity column -> function normalizing one distinct value
+_LIQUIDITY_NORMALIZERS = {'lock_up': _lockup_value,
+                          'redemption_frequency': _frequency_value,
+                          'subscription_frequency': _frequency_value,
+                          'redemption_notice_days': _notice_days_value,
+                          'redemption_gate': _gate_value}
+
+
+def normalize_liquidity(liquidity_df):
+    """
+    Returns the dataframe with its fund_liquidity fields cleaned in one pass
+        Each column is factorized and only its distinct values are looked up (and cached across calls):
+            lock_up                : True/False/null as convert_lockup (numbers and bools are taken as flags)
+            redemption_frequency,
+            subscription_frequency : canonical names from LIQUIDITY_FREQUENCIES ('monthly', 'month' -> 'Monthly'),
+                                     'N/A'/'Unknown'-style values become null, unrecognized spellings are kept
+            redemption_notice_days : days as a float ('30 days' -> 30, '1 month' -> 30, '6 weeks' -> 42)
+            redemption_gate        : a fraction ('25%' -> 0.25, 0.25 stays 0.25, a bare 25 is ambiguous and null)
+        Values that can't be read as a number become null and are logged
+
+    Parameters
+    ---------
+    liquidity_df : dataframe
+        the liquidity data, any of the columns above that it has are normalized
+
+    Returns
+    -------
+    liquidity_df : dataframe
+        a copy with the columns normalized
+    """
+    import logging
+    import numpy as np
+    import pandas as pd
+    LOGGER = logging.getLogger(__name__)
+
+    liquidity_df = liquidity_df.copy()
+    for col, normalize in _LIQUIDITY_NORMALIZERS.items():
+        if col not in liquidity_df.columns:
+            continue
+        codes, uniques = pd.factorize(liquidity_df[col], use_na_sentinel=True)
+        lookup = np.array([normalize(value) for value in uniques]+[np.nan], dtype=object)
+        # code -1 (null) picks the trailing null
+        normalized = pd.Series(lookup[codes], index=liquidity_df.index, dtype=object)
+        if normalize in (_notice_days_value, _gate_value):
+            unread = [value for value, result in zip(uniques, lookup) if result != result and
+                      str(value).strip().lower() not in _UNKNOWN_LIQUIDITY | _NO_GATE]
+            if len(unread) > 0:
+                LOGGER.warning(str(len(unread))+' values of '+col+' could not be read and are null: ' +
+                               ', '.join(str(value) for value in unread[:10]))
+            normalized = normalized.astype('float64')
+        liquidity_df[col] = normalized
+    return liquidity_df
+
+
 def pct_returns_from_levels(df):
     """
     Returns a dataframe whose levels (values) have been converted to percentage change
@@ -1373,7 +3667,86 @@ def pct_returns_from_levels(df):
     return df_temp
 
 
-def get_status(df, source_name, better_sources_list):
+def pct_returns_from_levels_long(df, level_column='level', method='simple', freq=None, gaps='nan',
+                                 id_column='id', date_column='asof_date'):
+    """
+    Returns each fund's returns from a long dataframe of levels (one row per id and date), in one vectorized pass
+        The rows are sorted by id and date and every level is divided by the previous level of the same fund
+        (a shift masked at the fund boundaries), so the first level of each fund has no return and is dropped
+
+    Parameters
+    ---------
+    df : dataframe
+        the levels, with columns id_column, date_column and level_column
+    level_column : str
+        the column holding the levels
+    method : str
+        'simple' for level / previous level - 1, 'log' for log(level / previous level)
+    freq : str, optional
+        the frequency the levels should have (e.g. 'M', 'Q', 'D'). when given, a return whose previous level is
+        more than one period back is a gap and is handled according to gaps, and a 'periods' column is added.
+        two levels of the same fund in one period raise a ValueError
+    gaps : str
+        'nan' gives gap returns a null value, 'keep' keeps the return over the whole gap, 'drop' drops the row
+    id_column : str
+        the fund id column
+    date_column : str
+        the date column
+
+    Returns
+    -------
+    df : dataframe
+        id_column, date_column and return_value (plus periods when freq is given), sorted by id and date
+    """
+    import numpy as np
+    import pandas as pd
+    if method not in ('simple', 'log'):
+        raise ValueError("""'method' must be 'simple' or 'log' """)
+    if gaps not in ('nan', 'keep', 'drop'):
+        raise ValueError("""'gaps' must be 'nan', 'keep' or 'drop' """)
+    for col in [id_column, date_column, level_column]:
+        if col not in df.columns:
+            raise ValueError(col+' must be a column in df ')
+
+    data = df[[id_column, date_column, level_column]].sort_values([id_column, date_column], kind='mergesort')
+    ids = data[id_column].to_numpy()
+    dates = pd.to_datetime(data[date_column])
+    levels = data[level_column].to_numpy(dtype='float64')
+
+    # first row of each fund
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    if (~first[1:] & (dates.to_numpy()[1:] == dates.to_numpy()[:-1])).any():
+        raise ValueError('df has more than one level for an id and '+date_column+' ')
+    previous = np.empty(len(levels), dtype='float64')
+    previous[:1] = np.nan
+    previous[1:] = levels[:-1]
+    previous[first] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = levels/previous
+        returns = np.log(ratio) if method == 'log' else ratio-1
+    # a zero or negative level (now or before) has no meaningful return
+    returns[~(levels > 0) | ~(previous > 0)] = np.nan
+
+    result = pd.DataFrame({id_column: ids, date_column: dates.to_numpy(), 'return_value': returns})
+    keep = ~first
+    if freq is not None:
+        ordinals = pd.PeriodIndex(dates, freq=freq).asi8
+        periods = np.zeros(len(ordinals), dtype='int64')
+        periods[1:] = ordinals[1:]-ordinals[:-1]
+        periods[first] = 0
+        if (~first & (periods == 0)).any():
+            raise ValueError('df has more than one level for an id in one '+str(freq)+' period ')
+        result['periods'] = periods
+        gap = ~first & (periods > 1)
+        if gaps == 'nan':
+            result.loc[gap, 'return_value'] = np.nan
+        elif gaps == 'drop':
+            keep = keep & ~gap
+    return result[keep].reset_index(drop=True)
+
+
+def get_status(df, source_name, better_sources_list, engine=None, connection=None):
     """
     Updates the fund_status table with given inputs.
 
@@ -1385,6 +3758,10 @@ def get_status(df, source_name, better_sources_list):
         the name of the source for the status records inside df
     better_sources_list: list
         a list containing sources we don't want to overwrite
+    engine : sqlalchemy engine, optional
+        engine to use instead of the shared pooled engine, e.g. to reuse one warm pool for a whole job
+    connection : sqlalchemy connection, optional
+        connection to run every statement on. if it has an open transaction the caller is responsible for committing it
 
     Returns
     -------
@@ -1392,24 +3769,7 @@ def get_status(df, source_name, better_sources_list):
         the df used to update
     """
     import pandas as pd
-    import numpy as np
-    from sqlalchemy.engine import URL
-    from sqlalchemy import create_engine
-    from pyodbc import connect
-    from os import environ
-    connection_string = "Driver={SQL Server};" + \
-        f"Server={environ['DASH_AZURE_DB_SERVER']};Database={environ['DASH_SC_DB_NAME']};UID={environ['DASH_AZURE_DB_RW_USER']};PWD={environ['DASH_AZURE_DB_RW_USER_PWD']}"
-    connection_url = URL.create(
-        "mssql+pyodbc", query={"odbc_connect": connection_string})
-    engine = create_engine(connection_url)
-    conn = connect(connection_string)
-    cursor = conn.cursor()
-
-    import logging
-    LOGGER = logging.getLogger(__name__)
 
-    # include manual here as that is how we override. we dont want to override these records
-    better_sources_list = better_sources_list + ['manual']
     if 'id' not in df.columns:
         raise ValueError('df must have internal IDs')
     if 'current_status' not in df.columns:
@@ -1421,57 +3781,11 @@ def get_status(df, source_name, better_sources_list):
     if 'status_source' not in df.columns:
         df.loc[:, 'status_source'] = source_name
 
-    fs = pd.read_sql_query("""select * from fund_status""", engine)
-
-    status_check = df.merge(
-        fs, on='id', suffixes=('', ' existing'), how='left')
-
-    update = status_check[status_check['current_status']
-                          != status_check['current_status existing']].copy()
-    # always update 'Unknown' status
-    update1 = update[update['current_status existing'] == 'Unknown'].copy()
-    update1 = update1.drop(columns=['included', 'included_source'])
-    # set the old included data as new to preseve it
-    update1 = update1.rename(columns={'included existing': 'included',
-                                      'included_source existing': 'included_source'})
-
-    # exclude albourne or manual as the source
-    # this would also include new records
-    update2 = update[~update['status_source existing'].isin(
-        better_sources_list)].copy()
-    # fill missing records with data from df (these will be nulls)
-    update2.loc[:, 'included existing'] = update2['included existing'].fillna(
-        update2['included'])
-    update2.loc[:, 'included_source existing'] = update2['included_source existing'].fillna(
-        update2['included_source'])
-    update2 = update2.drop(columns=['included', 'included_source'])
-    # set the old included data as new to preseve it
-    update2 = update2.rename(columns={'included existing': 'included',
-                                      'included_source existing': 'included_source'})
-
-    # drop any funds we already caught to prevent dupes
-    update1 = update1[~update1['id'].isin(update2['id'])]
-
-    status_update = pd.concat([update1, update2])
-    status_update = status_update.reset_index(drop=True)
-
-    if len(status_update['id']) > 0:
-
-        sub_list_to_delete = ','.join(
-            (map(str, status_update['id'].to_list())))
-        sub_list_to_delete = '('+sub_list_to_delete+')'
-        cursor.execute(
-            ''' DELETE FROM fund_status where id in '''+sub_list_to_delete)
-        conn.commit()
-
-        LOGGER.info(str(len(status_update['id']))+' no. records deleted')
-        status_update[['id',
-                       'current_status',
-                       'status_source',
-                       'included',
-                       'included_source']].to_sql('fund_status', engine, if_exists='append', index=False)  # index=False prevents failure on trying to insert the index column
-        LOGGER.info(str(len(status_update['id'])) +
-                    ' funds have had their status updated')
-    else:
-        LOGGER.info('no funds need updating')
-    return status_update
+    # include manual here as that is how we override. we dont want to override these records
+    plan = reconcile('fund_status', source_name, df, better_sources_list + ['manual'], engine, connection)
+    # the rows written, merged with the statuses they replaced. the plan holds ids and statuses in compact dtypes
+    status_update = plan['merged']
+    dtypes = {col: status_update[col].cat.categories.dtype for col in status_update.columns
+              if isinstance(status_update[col].dtype, pd.CategoricalDtype)}
+    status_update = status_update.astype(dict(dtypes, id=df['id'].dtype))
+    return status_update
\ No newline at end of file
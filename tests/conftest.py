@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy.dialects.mssql import pyodbc
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    A sqlite copy of the synthetic benchmark universe, with the working directory moved to tmp_path
+    (the loaders write their backup csv files there)
+    """
+    from sqlalchemy import create_engine
+    from sc_py import benchmark
+
+    monkeypatch.chdir(tmp_path)
+    universe = benchmark.make_universe(2000, seed=0, months=24)
+    engines = []
+
+    def build(name='sc.db'):
+        engine = create_engine('sqlite:///'+str(tmp_path/name))
+        benchmark.create_schema(engine)
+        benchmark.load_universe(engine, universe)
+        engines.append(engine)
+        return engine
+
+    yield build, universe
+    for engine in engines:
+        engine.dispose()
+
+
+class _Result(object):
+    rowcount = 0
+
+    def fetchall(self):
+        return []
+
+
+class RecordingConnection(object):
+    """
+    Stands in for a sql server connection: every statement is compiled with the pyodbc dialect and recorded,
+    executemany rows are kept in staged
+    """
+    dialect = pyodbc.dialect(paramstyle='qmark')
+
+    def __init__(self):
+        self.statements = []
+        self.staged = []
+        self.connection = self
+
+    def in_transaction(self):
+        return True
+
+    def exec_driver_sql(self, statement, *args):
+        self.statements.append(statement)
+        return _Result()
+
+    def execute(self, statement, params=None):
+        params = params or {}
+        binds = statement.compile(dialect=self.dialect).binds
+        assert set(binds) <= set(params), 'unbound parameters in '+str(statement)
+        compiled = statement.bindparams(**{name: params[name] for name in binds}).compile(
+            dialect=self.dialect, compile_kwargs={'render_postcompile': True})
+        self.statements.append(compiled.string)
+        return _Result()
+
+    def cursor(self):
+        return self
+
+    def executemany(self, statement, rows):
+        self.statements.append(statement)
+        self.staged.extend(rows)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sql_server():
+    """
+    A RecordingConnection, for the sql server only paths (temp tables, merge) that can't run on sqlite
+    """
+    return RecordingConnection()
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from sc_py import sc_fxns as sc
+
+
+@pytest.fixture
+def backup_store(tmp_path):
+    directory = str(tmp_path/'backups')
+    sc.enable_backup_store(directory, keep_runs=2)
+    yield directory
+    sc.disable_backup_store()
+
+
+def test_backups_of_displaced_rows(database, backup_store):
+    build, universe = database
+    runs = []
+    for i in range(3):
+        # each run starts from the same database, so every run displaces the same worse-source rows
+        engine = build('run'+str(i)+'.db')
+        before = pd.read_sql_query('SELECT * FROM returns_ts', engine, parse_dates=['asof_date'])
+        plan = sc.reconcile('returns_ts', 'hfr', universe['returns_df'], ['manual', 'albourne'], engine=engine)
+        after = pd.read_sql_query('SELECT ret_ts_id FROM returns_ts', engine)
+        runs.append(sc.list_backups(table='returns_ts', source='hfr').loc[0, 'run_id'])
+    assert not os.path.exists('hfr_backup.csv')
+
+    backups = sc.read_backups(table='returns_ts', source='hfr', run_id=runs[-1])
+    assert len(backups.index) == plan['counts']['inferior'] > 0
+    assert 'eurekahedge' in set(backups['source'])
+    assert not backups['ret_ts_id'].isin(after['ret_ts_id']).any()
+    expected = before.set_index('ret_ts_id').loc[backups['ret_ts_id']].reset_index()
+    for column in ['ret_ts_id', 'id', 'asof_date', 'return_value', 'source']:
+        assert backups[column].astype(object).to_list() == expected[column].astype(object).to_list(), column
+    assert (backups['table'] == 'returns_ts').all() and (backups['run_source'] == 'hfr').all()
+
+    # only the ids asked for, from the runs that are kept
+    some = sc.read_backups(ids=backups['id'].iloc[:1], table='returns_ts')
+    assert set(some['id']) == {backups['id'].iloc[0]}
+    assert set(some['run_id']) == set(runs[1:])
+
+    # the oldest run is pruned from the manifest and the folder
+    with open(os.path.join(backup_store, 'manifest.json')) as f:
+        manifest = json.load(f)
+    assert [entry['run_id'] for entry in manifest] == runs[1:]
+    for entry in manifest:
+        assert (entry['table'], entry['source'], entry['rows']) == ('returns_ts', 'hfr', len(backups.index))
+        assert (entry['min_id'], entry['max_id']) == (backups['id'].min(), backups['id'].max())
+    assert sorted(os.listdir(os.path.join(backup_store, 'returns_ts', 'hfr'))) == \
+        sorted(os.path.basename(entry['path']) for entry in manifest)
+    assert sc.list_backups(table='returns_ts')['run_id'].to_list() == runs[:0:-1]
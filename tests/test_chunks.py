@@ -0,0 +1,17 @@
+from sc_py import sc_fxns as sc
+
+
+def test_previous_backup_is_kept_without_chunks(database):
+    build, universe = database
+    engine = build()
+    with open('hfr_backup.csv', 'w') as f:
+        f.write('previous run\n')
+
+    summary = sc.reconcile_chunks('returns_ts', 'hfr', iter([]), ['manual', 'albourne'], engine=engine)
+    assert summary['chunks'] == 0
+    with open('hfr_backup.csv') as f:
+        assert f.read() == 'previous run\n'
+
+    sc.reconcile_chunks('returns_ts', 'hfr', iter([universe['returns_df']]), ['manual', 'albourne'], engine=engine)
+    with open('hfr_backup.csv') as f:
+        assert f.read() != 'previous run\n'
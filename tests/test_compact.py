@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from sc_py import benchmark
+from sc_py import sc_fxns as sc
+
+
+def test_compact_frame_memory():
+    universe = benchmark.make_universe(20000, seed=0, months=24)
+    spec = sc.RECONCILE_SPECS['returns_ts']
+    snapshot = universe['returns_ts'].assign(ret_ts_id=np.arange(1, len(universe['returns_ts'].index)+1))
+
+    compact = sc._compact_frame(spec, snapshot.copy())
+
+    assert compact['id'].dtype == 'int32' and compact['ret_ts_id'].dtype == 'int32'
+    assert isinstance(compact['source'].dtype, pd.CategoricalDtype)
+    assert isinstance(compact['type'].dtype, pd.CategoricalDtype)
+    assert compact.memory_usage(deep=True).sum() < 0.6*snapshot.memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(compact.astype(snapshot.dtypes), snapshot)
+
+
+def test_compact_frame_keeps_wide_ids():
+    df = pd.DataFrame({'id': [1, 2**40], 'source': ['hfr', 'hfr']})
+    assert sc._compact_frame(sc.RECONCILE_SPECS['aum_ts'], df)['id'].dtype == 'int64'
@@ -0,0 +1,40 @@
+import pandas as pd
+
+from sc_py import sc_fxns as sc
+
+
+def _rows(engine, table, columns):
+    return pd.read_sql_query('SELECT '+', '.join(columns)+' FROM '+table, engine) \
+        .sort_values(columns, ignore_index=True)
+
+
+def test_bare_connection_is_committed(database):
+    build, universe = database
+    expected = build('expected.db')
+    sc.get_returns('hfr', universe['returns_df'], ['manual', 'albourne'], engine=expected)
+
+    engine = build()
+    before = _rows(engine, 'returns_ts', ['id', 'asof_date', 'return_value', 'source'])
+    with engine.connect() as conn:
+        sc.get_returns('hfr', universe['returns_df'], ['manual', 'albourne'], connection=conn)
+        # nothing of ours is left open on the caller's connection
+        assert not conn.in_transaction()
+
+    for table, columns in [('returns_ts', ['id', 'asof_date', 'return_value', 'source']),
+                           ('old_returns_ts', ['id', 'asof_date', 'return_value', 'source'])]:
+        after = _rows(engine, table, columns)
+        pd.testing.assert_frame_equal(after, _rows(expected, table, columns))
+    assert not after.equals(before)
+
+
+def test_open_transaction_is_left_to_the_caller(database):
+    build, universe = database
+    engine = build()
+    before = _rows(engine, 'returns_ts', ['id', 'asof_date', 'return_value', 'source'])
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        sc.get_returns('hfr', universe['returns_df'], ['manual', 'albourne'], connection=conn)
+        assert conn.in_transaction()
+        transaction.rollback()
+
+    pd.testing.assert_frame_equal(_rows(engine, 'returns_ts', ['id', 'asof_date', 'return_value', 'source']), before)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sc_py import sc_fxns as sc
+
+
+def test_staging_delete(sql_server):
+    result = sc.batch_delete([3, 1, 3, np.nan, None, 2.0], 'returns_ts', 'ret_ts_id', connection=sql_server,
+                             method='staging')
+
+    assert sql_server.staged == [(3,), (1,), (2,)]
+    assert all(type(key) is int for key, in sql_server.staged)
+    assert 'CREATE TABLE #sc_delete_keys (key_value BIGINT NOT NULL PRIMARY KEY)' in sql_server.statements
+    assert 'DELETE t FROM returns_ts t JOIN #sc_delete_keys k ON t.ret_ts_id = k.key_value' in sql_server.statements
+    assert sql_server.statements[-1] == 'DROP TABLE #sc_delete_keys'
+    assert (result.method, result.rows_requested, result.chunks) == ('staging', 6, 1)
+
+
+def test_staging_delete_string_keys(sql_server):
+    sc.batch_delete(['hfr_1', 'hfr_10'], 'external_entity_mapping', 'external_id', connection=sql_server,
+                    method='staging')
+    assert 'CREATE TABLE #sc_delete_keys (key_value NVARCHAR(6) NOT NULL PRIMARY KEY)' in sql_server.statements
+
+
+def test_staging_delete_of_only_nulls(sql_server):
+    result = sc.batch_delete([np.nan, None], 'returns_ts', 'ret_ts_id', connection=sql_server, method='staging')
+    assert sql_server.statements == []
+    assert (result.rows_deleted, result.chunks) == (0, 0)
+
+
+def test_staging_keys_are_checked(sql_server):
+    with pytest.raises(ValueError, match='mix'):
+        sc.batch_delete(['hfr_1', 2], 'returns_ts', 'ret_ts_id', connection=sql_server, method='staging')
+    with pytest.raises(ValueError, match='null'):
+        sc._stage_keys(sql_server, [1, None])
+    # an empty key set still gets a (typed) staging table to join to
+    sc._stage_keys(sql_server, [], '#sc_read_keys')
+    assert sql_server.statements[-1] == 'CREATE TABLE #sc_read_keys (key_value BIGINT NOT NULL PRIMARY KEY)'
+    assert sql_server.staged == []
+
+
+def test_chunked_delete(database, monkeypatch):
+    build, universe = database
+    engine = build()
+    monkeypatch.setitem(sc.BACKENDS, 'sqlite', dict(sc.BACKENDS['sqlite'], param_limit=100))
+    keys = list(range(1, 251))
+
+    result = sc.batch_delete(keys, 'returns_ts', 'ret_ts_id', engine=engine, verify=True)
+
+    assert (result.method, result.chunks) == ('chunked', 3)
+    assert result.rows_deleted == result.verified_rows_deleted == 250
+    left = pd.read_sql_query('SELECT MIN(ret_ts_id) AS first, COUNT(*) AS n FROM returns_ts', engine)
+    assert left.loc[0, 'first'] == 251
+    assert left.loc[0, 'n'] == len(universe['returns_ts'].index)-250
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+
+from sc_py import sc_fxns as sc
+
+
+def test_ids_beyond_int64_do_not_wrap():
+    big = 2**63
+    for s in [pd.Series([1, 2**64-1], dtype='uint64'),
+              pd.Series(['1', str(big)]),
+              pd.Series([1.0, float(big), np.nan])]:
+        converted = sc.convert_id(s)
+        assert converted.dtype == object
+        assert converted.iloc[1] >= big
+        assert converted.iloc[0] == 1
+    assert sc.convert_id(pd.Series([1.0, float(big)]), nullable=True).iloc[1] == big
+    assert sc.convert_id(pd.Series([1.0, -2.0**63])).dtype == 'int64'
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from sc_py import sc_fxns as sc
+
+COLUMN_TYPES = {'id': 'BIGINT', 'asof_date': 'DATETIME', 'value': 'FLOAT', 'source': 'NVARCHAR(20)',
+                'flag': 'BIT'}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine('sqlite:///'+str(tmp_path/'insert.db'))
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE t (id BIGINT, asof_date DATETIME, value FLOAT, source NVARCHAR(20), '
+                             'flag BIT)')
+    yield engine
+    engine.dispose()
+
+
+def _frame(n):
+    df = pd.DataFrame({'id': np.arange(n, dtype='int64'),
+                       'asof_date': pd.date_range('2024-01-31', periods=n, freq='D'),
+                       'value': np.linspace(0, 1, n),
+                       'source': ['hfr', 'albourne']*(n//2),
+                       'flag': [True, False]*(n//2)})
+    df.loc[3, 'value'] = np.nan
+    df.loc[4, 'source'] = None
+    return df
+
+
+def _read(engine):
+    df = pd.read_sql_query('SELECT * FROM t ORDER BY id', engine, parse_dates=['asof_date'])
+    return df.astype({'flag': bool})
+
+
+# 50 parameters // 5 columns = 10 rows per VALUES statement, 30 rows per executemany call
+@pytest.mark.parametrize('method, kwargs, batches', [('values', {'param_limit': 50}, 10),
+                                                     ('executemany', {'chunksize': 30}, 4)])
+def test_batches(engine, method, kwargs, batches):
+    df = _frame(100)
+    result = sc.bulk_insert(df, 't', engine=engine, column_types=COLUMN_TYPES, method=method, **kwargs)
+
+    assert (result.method, result.rows_inserted, result.batches) == (method, 100, batches)
+    pd.testing.assert_frame_equal(_read(engine), df, check_dtype=False)
+    assert _read(engine)['asof_date'].iloc[1] == pd.Timestamp('2024-02-01')
+
+
+def test_values_rows_are_capped(engine, monkeypatch):
+    monkeypatch.setitem(sc.BACKENDS, 'sqlite', dict(sc.BACKENDS['sqlite'], max_values_rows=8))
+    result = sc.bulk_insert(_frame(100), 't', engine=engine, method='values')
+    assert result.batches == 13
+
+
+def test_column_types_are_inferred(engine):
+    df = _frame(10)
+    assert {col: sc._infer_column_type(df[col]) for col in df.columns} == \
+        {'id': 'BIGINT', 'asof_date': 'DATETIME', 'value': 'FLOAT', 'source': None, 'flag': 'BIT'}
+    sc.bulk_insert(df, 't', engine=engine)
+    loaded = _read(engine)
+    assert loaded['id'].dtype == 'int64' and loaded['value'].dtype == 'float64'
+    assert pd.api.types.is_datetime64_any_dtype(loaded['asof_date'])
+    pd.testing.assert_frame_equal(loaded, df, check_dtype=False)
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+
+from sc_py import sc_fxns as sc
+
+
+def test_gates_are_fractions():
+    df = pd.DataFrame({'redemption_gate': ['25%', '10 %', 0.1, '0.2', 1, 25, '25', 'none', np.nan]})
+    gates = sc.normalize_liquidity(df)['redemption_gate']
+    np.testing.assert_allclose(gates.to_numpy(), [0.25, 0.1, 0.1, 0.2, 1.0, np.nan, np.nan, np.nan, np.nan])
+
+
+def test_convert_lockup_synonyms():
+    for value in ['no lock up', 'no lock', 'No Lockup', 'none']:
+        assert sc.convert_lockup(value) is False
+    assert sc.convert_lockup('1 year') is True
+    assert np.isnan(sc.convert_lockup('Unknown'))
@@ -0,0 +1,66 @@
+import smtplib
+
+import pytest
+
+from sc_py import sc_fxns as sc
+
+
+class _StandInSMTP(object):
+    """
+    Records connections and messages instead of talking to a mail server
+    """
+    connections = []
+    failures = 0
+
+    def __init__(self, host, port, timeout=None):
+        self.sent = []
+        self.quit_called = False
+        _StandInSMTP.connections.append(self)
+
+    def ehlo(self):
+        pass
+
+    def sendmail(self, sender, receivers, message):
+        if _StandInSMTP.failures > 0:
+            _StandInSMTP.failures -= 1
+            raise smtplib.SMTPServerDisconnected('connection dropped')
+        self.sent.append(message)
+        return {}
+
+    def quit(self):
+        self.quit_called = True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(smtplib, 'SMTP', _StandInSMTP)
+    _StandInSMTP.connections = []
+    _StandInSMTP.failures = 0
+    sc.start_mailer('localhost', 1025, retry_wait=0)
+    yield _StandInSMTP
+    sc.stop_mailer()
+
+
+def test_sends_are_queued_on_one_connection(smtp):
+    futures = [sc.send_email_with_attachment('to@example.com', 'from@example.com', 'alert '+str(i), 'body')
+               for i in range(3)]
+    assert [future.result(timeout=10) for future in futures] == [{}, {}, {}]
+    assert len(smtp.connections) == 1
+    assert len(smtp.connections[0].sent) == 3
+
+
+def test_failed_send_is_retried(smtp):
+    smtp.failures = 1
+    assert sc.send_email_with_attachment('to@example.com', 'from@example.com', 'alert', 'body', wait=True) == {}
+    # the dropped connection is replaced and the message sent once
+    assert len(smtp.connections) == 2
+    assert [len(conn.sent) for conn in smtp.connections] == [0, 1]
+
+
+def test_stop_mailer_quits(smtp):
+    sc.send_email_with_attachment('to@example.com', 'from@example.com', 'alert', 'body', wait=True)
+    sc.stop_mailer()
+    assert smtp.connections[0].quit_called
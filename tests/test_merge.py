@@ -0,0 +1,65 @@
+import os
+import re
+
+import pandas as pd
+import pytest
+
+from sc_py import benchmark
+from sc_py import sc_fxns as sc
+
+SQL_SERVER = os.environ.get('SC_DATABASE_URL', '').startswith('mssql')
+COLUMNS = {'returns_ts': ['id', 'asof_date', 'return_value', 'source', 'type'],
+           'aum_ts': ['id', 'asof_date', 'asset_value', 'source']}
+FRAMES = {'returns_ts': 'returns_df', 'aum_ts': 'aum_df'}
+
+
+@pytest.mark.parametrize('table', ['returns_ts', 'aum_ts'])
+def test_merge_statements_compile(table, sql_server, monkeypatch):
+    universe = benchmark.make_universe(200, seed=0, months=12)
+    conn = sql_server
+    monkeypatch.setattr(pd, 'read_sql_query',
+                        lambda sql, con, **kwargs: conn.statements.append(sql) or pd.DataFrame())
+
+    sc.merge_reconciliation(table, 'hfr', universe[FRAMES[table]], ['manual', 'albourne'], connection=conn)
+
+    created = set()
+    for statement in conn.statements:
+        assert statement.count('(') == statement.count(')'), statement
+        for temp_table in re.findall(r'(?:INTO|CREATE TABLE) (#\w+)', statement):
+            created.add(temp_table)
+        dropped = re.match(r"IF OBJECT_ID\('tempdb\.\.(#\w+)'\)", statement)
+        if dropped is None:
+            # every temp table is created before it is used
+            assert set(re.findall(r'#\w+', statement)) <= created, statement
+    merge = [statement for statement in conn.statements if statement.startswith('MERGE')]
+    assert len(merge) == 1 and merge[0].endswith(';') and 'OUTPUT $action' in merge[0]
+    # the better sources are bound, never interpolated
+    assert not any("'albourne'" in statement for statement in conn.statements)
+    assert conn.statements[-len(created):] == ['DROP TABLE '+temp_table for temp_table in
+                                               ['#sc_merge_stage', '#sc_merge_funds', '#sc_merge_worse',
+                                                '#sc_merge_load', '#sc_merge_breaks', '#sc_merge_output']]
+
+
+def _rows(engine, table, columns):
+    return pd.read_sql_query('SELECT '+', '.join(columns)+' FROM '+table, engine) \
+        .sort_values(columns, ignore_index=True)
+
+
+@pytest.mark.skipif(not SQL_SERVER, reason='merge mode runs on sql server, set SC_DATABASE_URL to a test database')
+@pytest.mark.parametrize('table', ['returns_ts', 'aum_ts'])
+def test_merge_matches_pandas(table, tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    monkeypatch.chdir(tmp_path)
+    universe = benchmark.make_universe(2000, seed=0, months=24)
+    engine = create_engine(os.environ['SC_DATABASE_URL'])
+    loaded = {}
+    try:
+        for mode in ['pandas', 'merge']:
+            benchmark.load_universe(engine, universe)
+            sc.reconcile(table, 'hfr', universe[FRAMES[table]], ['manual', 'albourne'], engine=engine, mode=mode)
+            # breaks keep their row id in merge mode, so the tables are compared without it
+            loaded[mode] = [_rows(engine, name, COLUMNS[table]) for name in [table, 'old_'+table]]
+    finally:
+        engine.dispose()
+    for merged, planned in zip(loaded['merge'], loaded['pandas']):
+        pd.testing.assert_frame_equal(merged, planned)
@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from sc_py import sc_fxns as sc
+
+FRAMES = {'returns_ts': 'returns_df', 'aum_ts': 'aum_df', 'fees': 'fees_df', 'fund_liquidity': 'liquidity_df'}
+
+
+def _table(engine, table):
+    df = pd.read_sql_query('SELECT * FROM '+table, engine)
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+@pytest.mark.parametrize('table', list(FRAMES))
+def test_saved_plan_matches_reconcile(database, tmp_path, table):
+    build, universe = database
+    df = universe[FRAMES[table]]
+    reconciled = build('reconciled.db')
+    expected = sc.reconcile(table, 'hfr', df, ['manual', 'albourne'], engine=reconciled)
+
+    engine = build()
+    plan = sc.plan_reconciliation(table, 'hfr', df, ['manual', 'albourne'], engine=engine)
+    sc.save_plan(plan, str(tmp_path/'plan'))
+    applied = sc.apply_plan(str(tmp_path/'plan'), engine=engine)
+
+    assert applied['counts'] == expected['counts']
+    for name in [table, sc.RECONCILE_SPECS[table]['archive_table']]:
+        if name is not None:
+            pd.testing.assert_frame_equal(_table(engine, name), _table(reconciled, name))
@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import text
+
+from sc_py import sc_fxns as sc
+
+
+@pytest.fixture
+def replica(tmp_path):
+    sc.enable_replica(str(tmp_path/'replica'), tables=['returns_ts'])
+    yield
+    sc.disable_replica()
+
+
+def _return_value(df, row_id):
+    return df.loc[df['ret_ts_id'] == row_id, 'return_value'].iloc[0]
+
+
+def test_merge_write_rebuilds_replica_without_version_column(database, replica):
+    build, universe = database
+    engine = build()
+    row_id = int(sc.refresh_replica('returns_ts', engine=engine)['ret_ts_id'].iloc[0])
+    with engine.begin() as conn:
+        conn.execute(text('UPDATE returns_ts SET return_value = 0.123 WHERE ret_ts_id = :row_id'), {'row_id': row_id})
+
+    # an in-place update moves neither the row id watermark nor the row count
+    assert _return_value(sc.refresh_replica('returns_ts', engine=engine), row_id) != 0.123
+
+    sc._replica_merged('returns_ts')
+    assert _return_value(sc.refresh_replica('returns_ts', engine=engine), row_id) == 0.123
+    # the rebuild clears the flag
+    assert not sc._load_replica('returns_ts')[0].get('merged')
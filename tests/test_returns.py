@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from sc_py import sc_fxns as sc
+
+
+def _levels():
+    return pd.DataFrame({'id': [2, 2, 2, 1, 1, 1, 1, 1],
+                         'asof_date': pd.to_datetime(['2020-01-31', '2020-02-29', '2020-03-31', '2020-01-31',
+                                                      '2020-02-29', '2020-03-31', '2020-05-31', '2020-06-30']),
+                         'level': [100.0, 110.0, 99.0, 50.0, -11.0, 16.0, 0.0, 10.0]})
+
+
+def test_returns_are_per_fund():
+    returns = sc.pct_returns_from_levels_long(_levels().iloc[::-1])
+    assert returns['id'].tolist() == [1, 1, 1, 1, 2, 2]
+    np.testing.assert_allclose(returns[returns['id'] == 2]['return_value'], [0.1, -0.1])
+
+
+def test_non_positive_levels_have_no_return():
+    for method in ['simple', 'log']:
+        returns = sc.pct_returns_from_levels_long(_levels(), method=method)
+        # -11 after 50, 16 after -11, 0 after 16 and 10 after 0
+        assert returns[returns['id'] == 1]['return_value'].isnull().all()
+
+
+def test_missing_periods():
+    levels = _levels()
+    levels['level'] = levels['level'].abs()+1
+    returns = sc.pct_returns_from_levels_long(levels, freq='M')
+    gap = returns['asof_date'] == pd.Timestamp('2020-05-31')
+    assert returns.loc[gap, 'periods'].tolist() == [2]
+    assert returns.loc[gap, 'return_value'].isnull().all()
+    kept = sc.pct_returns_from_levels_long(levels, freq='M', gaps='keep')
+    np.testing.assert_allclose(kept.loc[gap, 'return_value'], [1/17-1])
+    dropped = sc.pct_returns_from_levels_long(levels, freq='M', gaps='drop')
+    assert pd.Timestamp('2020-05-31') not in dropped['asof_date'].tolist()
+
+
+def _stored(engine, ids=None):
+    df = pd.read_sql_query('SELECT id, asof_date, return_value FROM returns_ts', engine, parse_dates=['asof_date'])
+    df = df.sort_values(['id', 'asof_date'])
+    return {fund_id: (rows['asof_date'].to_numpy(dtype='datetime64[D]'), rows['return_value'].to_numpy())
+            for fund_id, rows in df.groupby('id') if ids is None or fund_id in ids}
+
+
+def _assert_series_equal(series, expected):
+    assert list(series) == list(expected)
+    for fund_id, (dates, values) in expected.items():
+        np.testing.assert_array_equal(series[fund_id][0], dates)
+        np.testing.assert_array_equal(series[fund_id][1], values)
+
+
+def test_returns_store_build(database, tmp_path):
+    build, universe = database
+    engine = build()
+    store = str(tmp_path/'store')
+    meta = sc.refresh_returns_store(store, engine=engine)
+    assert (meta['rows'], meta['funds_refreshed']) == (len(universe['returns_ts'].index), meta['funds'])
+
+    series = sc.read_returns_store(store)
+    _assert_series_equal(series, _stored(engine))
+    # the series are read-only slices of the memory-mapped arrays
+    dates, values = series[1]
+    assert not values.flags.writeable and isinstance(values.base, np.memmap)
+
+
+def test_returns_store_slices(database, tmp_path):
+    build, universe = database
+    engine = build()
+    store = str(tmp_path/'store')
+    sc.refresh_returns_store(store, engine=engine)
+
+    series = sc.read_returns_store(store, ids=[5, 3, 10**9], start_date='2023-03-31', end_date='2023-06-30')
+    assert sorted(series) == [3, 5]
+    expected = _stored(engine, ids=[3, 5])
+    for fund_id, (dates, values) in expected.items():
+        inside = (dates >= np.datetime64('2023-03-31')) & (dates <= np.datetime64('2023-06-30'))
+        assert inside.sum() == 4
+        np.testing.assert_array_equal(series[fund_id][0], dates[inside])
+        np.testing.assert_array_equal(series[fund_id][1], values[inside])
+
+
+def test_returns_store_refresh(database, tmp_path):
+    build, universe = database
+    engine = build()
+    store = str(tmp_path/'store')
+    sc.refresh_returns_store(store, engine=engine)
+    # nothing changed, so the version is kept
+    meta = sc.refresh_returns_store(store, engine=engine)
+    assert (meta['version'], meta['funds_refreshed']) == (1, 0)
+
+    # a new month for fund 1 and a deleted month of fund 2
+    sc.bulk_insert(pd.DataFrame({'id': [1], 'asof_date': [pd.Timestamp('2030-01-31')], 'return_value': [0.5],
+                                 'source': ['hfr'], 'type': ['monthly']}), 'returns_ts', engine=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql('DELETE FROM returns_ts WHERE id = 2 AND ret_ts_id = (SELECT MIN(ret_ts_id) '
+                             'FROM returns_ts WHERE id = 2)')
+    meta = sc.refresh_returns_store(store, engine=engine)
+
+    assert (meta['version'], meta['funds_refreshed']) == (2, 2)
+    _assert_series_equal(sc.read_returns_store(store), _stored(engine))
+    assert sorted(os.listdir(store)) == ['store.json', 'v2']
@@ -0,0 +1,46 @@
+import pandas as pd
+
+from sc_py import sc_fxns as sc
+
+HIERARCHY = ['manual', 'albourne', 'hfr', 'eurekahedge']
+COLUMNS = ['id', 'asof_date', 'return_value', 'source']
+
+
+def _rows(engine, table):
+    return pd.read_sql_query('SELECT '+', '.join(COLUMNS)+' FROM '+table, engine) \
+        .sort_values(COLUMNS, ignore_index=True)
+
+
+def test_run_sources_matches_a_serial_run(database):
+    build, universe = database
+    returns_df = universe['returns_df']
+    # albourne and hfr share funds 30-40 (one group), eurekahedge has funds of its own (a second group)
+    frames = {'albourne': returns_df[returns_df['id'] <= 40].assign(source='albourne',
+                                                                    return_value=lambda df: df['return_value']+0.01),
+              'hfr': returns_df[returns_df['id'].between(30, 60)],
+              'eurekahedge': returns_df[returns_df['id'] > 60].assign(source='eurekahedge')}
+
+    serial = build('serial.db')
+    for source in HIERARCHY:
+        if source in frames:
+            sc.reconcile('returns_ts', source, frames[source], HIERARCHY[:HIERARCHY.index(source)], engine=serial)
+    parallel = build()
+    plans = sc.run_sources('returns_ts', frames, HIERARCHY, engine=parallel, max_workers=2)
+
+    assert set(plans) == set(frames)
+    # row ids depend on the order the groups ran in, the rows themselves must not
+    for table in ['returns_ts', 'old_returns_ts']:
+        pd.testing.assert_frame_equal(_rows(parallel, table), _rows(serial, table))
+
+
+def test_fund_locks_without_temp_tables(database):
+    from sqlalchemy import event
+    build, universe = database
+    engine = build()
+    checkouts = []
+    event.listen(engine, 'checkout', lambda *args: checkouts.append(args))
+    for lock in [None, 'app']:
+        with sc._fund_locks('returns_ts', [3, 1, 2], engine=engine, lock=lock):
+            pass
+    # sqlite has no application locks, so not even a connection is taken
+    assert checkouts == []
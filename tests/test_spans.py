@@ -0,0 +1,39 @@
+import pytest
+
+from sc_py import sc_fxns as sc
+
+
+@pytest.fixture
+def spans():
+    records = []
+    sc.set_span_sink(records.append)
+    yield records
+    sc.set_span_sink()
+
+
+def test_spans_of_a_run(database, spans):
+    build, universe = database
+    engine = build()
+    plan = sc.reconcile('returns_ts', 'hfr', universe['returns_df'], ['manual', 'albourne'], engine=engine)
+
+    names = [record['span'] for record in spans]
+    assert names[:4] == ['eligibility', 'snapshot', 'diff', 'archive lookup'] and names[-1] == 'reconcile'
+    assert all(record['status'] == 'ok' and record['table'] == 'returns_ts' for record in spans)
+    diff = spans[names.index('diff')]
+    assert (diff['inferior'], diff['new'], diff['breaks']) == \
+        (plan['counts']['inferior'], plan['counts']['new'], plan['counts']['breaks'])
+
+
+def test_failed_phase_is_an_error_span(database, spans, monkeypatch):
+    build, universe = database
+    engine = build()
+
+    def failing_diff(*args):
+        raise RuntimeError('diff failed')
+    monkeypatch.setattr(sc, '_diff_values', failing_diff)
+
+    with pytest.raises(RuntimeError):
+        sc.reconcile('returns_ts', 'hfr', universe['returns_df'], ['manual', 'albourne'], engine=engine)
+    failed = {record['span']: record for record in spans if record['status'] == 'error'}
+    assert sorted(failed) == ['diff', 'reconcile']
+    assert failed['diff']['error'] == "RuntimeError('diff failed')"
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from sc_py import sc_fxns as sc
+
+
+def test_status_source_column_is_kept(database):
+    build, universe = database
+    engine = build()
+    status_df = universe['status_df'].assign(status_source='hfr_manual_review')
+    status_df.loc[status_df.index[::2], 'status_source'] = None
+
+    status_update = sc.get_status(status_df, 'hfr', ['albourne'], engine=engine)
+
+    # the rows written, merged with the statuses they replaced
+    assert list(status_update.columns) == ['id', 'current_status', 'status_source', 'current_status existing',
+                                           'status_source existing', 'included', 'included_source']
+    assert (status_update['current_status'] != status_update['current_status existing']).all()
+    assert len(status_update.index) > 0
+    written = pd.read_sql_query('SELECT id, status_source FROM fund_status', engine)
+    written = written[written['id'].isin(status_update['id'])]
+    given = status_df.set_index('id')['status_source'].loc[written['id']].fillna('hfr')
+    assert written['status_source'].to_list() == given.to_list()